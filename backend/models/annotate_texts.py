@@ -1,4 +1,5 @@
 import os
+import re
 
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
@@ -31,6 +32,20 @@ def get_annotation(model_type: str) -> tuple:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/models/normalize/materials", methods=["POST"])
+def normalize_materials() -> tuple:
+    try:
+        data: dict = request.get_json()
+        materials: list = data.get("materials", [])
+
+        normalized: list = [normalize_mats(mats) for mats in materials]
+
+        return jsonify({"normalized": normalized}), 200
+    except Exception as e:
+        app.logger.exception("Failed to normalize materials")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/models/health", methods=["GET"])
 def health() -> tuple:
     return jsonify({"message": "Success"}), 200
@@ -53,6 +68,27 @@ def model_selection(model_type: str):
     return ner_model
 
 
+def normalize_mats(mats: list) -> dict:
+    """
+    Canonical formulas (SimpleParser.matgen_parser) of one paper's MAT entities,
+    and the sorted set of elements they contain.
+    """
+    from lbnlp.parse.simple import SimpleParser
+
+    matgen_parser = SimpleParser().matgen_parser
+
+    formulas: list = []
+    elements: set = set()
+    for mat in mats:
+        formula = matgen_parser(mat.replace("_", " "))
+        if not formula or formula in formulas:
+            continue
+        formulas.append(formula)
+        elements.update(re.findall(r"[A-Z][a-z]?", formula))
+
+    return {"formulas": formulas, "elements": sorted(elements)}
+
+
 def annotate(docs: list, model, model_type: str) -> list:
     if model_type == "matscholar":
         tags: list = [model.tag_doc(doc) for doc in docs]
@@ -1,6 +1,10 @@
+import concurrent.futures
+import fcntl
 import hashlib
 import json
 import os
+import shutil
+import threading
 import zipfile
 
 import requests
@@ -8,11 +12,19 @@ import tqdm
 
 
 class ModelPkgLoader:
-    def __init__(self, modelpkg_name, external_model_path=None):
-        self.data_dir = os.path.dirname(os.path.abspath(__file__))
+    """
+    Downloads, validates and unpacks a model package.
+
+    data_dir and metadata_path default to this directory and its
+    modelpkg_metadata.json; they can be pointed elsewhere, e.g. at a metadata file
+    whose url is served by a local HTTP server.
+    """
+
+    def __init__(self, modelpkg_name, external_model_path=None, data_dir=None, metadata_path=None):
+        self.data_dir = data_dir or os.path.dirname(os.path.abspath(__file__))
         self.pkg_dir = os.path.join(self.data_dir, "pkg")
         self.models_dir = os.path.join(self.data_dir, "models")
-        self.metadata_path = os.path.join(self.data_dir, "modelpkg_metadata.json")
+        self.metadata_path = metadata_path or os.path.join(self.data_dir, "modelpkg_metadata.json")
 
         with open(self.metadata_path, "r") as f:
             self.metadata_modelpkgs = json.load(f)
@@ -24,16 +36,31 @@ class ModelPkgLoader:
         self.models_info = self.metadata_pkg["models"]
         self.model_names = list(self.models_info.keys())
         self.file_path = os.path.join(self.pkg_dir, modelpkg_name)
+        self.part_path = self.file_path + ".part"
+        self.state_path = self.file_path + ".part.json"
+        self.lock_path = self.file_path + ".lock"
         self.structured_path = os.path.join(self.models_dir, modelpkg_name)
 
         self.modelpkg_name = modelpkg_name
 
         self.is_downloaded = None
+        # SHA256 of the package, computed during download (in ranged mode as the
+        # segments are written, see _PrefixHash)
+        self.sha256 = None
 
-    def download(self):
+    def download(self, connections=4, chunk_size=1024 * 1024):
         """
         Fetch the raw model package file from an online repo.
 
+        If the server supports ranged requests the file is fetched in segments over
+        several connections, and an interrupted download resumes from the segments
+        recorded in the .part.json state file. The file is written to a .part file
+        and only renamed into place once complete.
+
+        Args:
+            connections (int): number of parallel ranged requests
+            chunk_size (int): bytes read from the response at a time
+
         Returns:
 
         """
@@ -45,39 +72,123 @@ class ModelPkgLoader:
         # Download modelpkg only if not already downloaded.
         if os.path.exists(self.file_path):
             self.is_downloaded = True
+            return
+
+        print(
+            f"Fetching {os.path.basename(self.file_path)} model package from {url} to {self.file_path}",
+            flush=True,
+        )
+
+        content_length, ranged = _probe(url)
+        if content_length:
+            print(f"Total file size: {content_length/1e9} GB")
+
+        if ranged and connections > 1:
+            self.sha256 = self._download_ranges(url, content_length, connections, chunk_size)
         else:
-            print(
-                f"Fetching {os.path.basename(self.file_path)} model package from {url} to {self.file_path}",
-                flush=True,
-            )
+            self.sha256 = self._download_stream(url, content_length, chunk_size)
+
+        os.replace(self.part_path, self.file_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.is_downloaded = True
+
+    def _download_stream(self, url, content_length, chunk_size):
+        sha256hash = hashlib.sha256()
+        with requests.get(url, stream=True) as r:
+            r.raise_for_status()
+            with open(self.part_path, "wb") as file_out, tqdm.tqdm(
+                total=content_length or None, unit="B", unit_scale=True, desc=self.modelpkg_name
+            ) as progress:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    file_out.write(chunk)
+                    sha256hash.update(chunk)
+                    progress.update(len(chunk))
+        return sha256hash.hexdigest()
 
-            content_length = requests.get(url, stream=True).headers["Content-length"]
-            print(f"Total file size: {int(content_length)/1e9} GB")
+    def _download_ranges(self, url, content_length, connections, chunk_size):
+        segments = self._load_segments(url, content_length, connections)
+        with open(self.part_path, "ab") as f:
+            f.truncate(content_length)
 
-            chunk_size = 2048
-            chunks = int(int(content_length) / chunk_size)
+        # Hashed in file order while the segments are written
+        prefix_hash = _PrefixHash(self.part_path, segments)
 
-            r = requests.get(url, stream=True)
-            with open(self.file_path, "wb") as file_out:
-                for chunk in tqdm.tqdm(
-                    r.iter_content(chunk_size=chunk_size),
-                    total=chunks,
-                    desc=f"Total chunks of size {chunk_size} bytes downloaded",
-                ):
+        done = sum(segment["written"] for segment in segments)
+        with tqdm.tqdm(
+            total=content_length, initial=done, unit="B", unit_scale=True, desc=self.modelpkg_name
+        ) as progress, concurrent.futures.ThreadPoolExecutor(connections) as executor:
+            futures = [
+                executor.submit(self._fetch_segment, url, segment, chunk_size, progress, prefix_hash)
+                for segment in segments
+                if segment["written"] < segment["end"] - segment["start"]
+            ]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    self._save_segments(url, content_length, segments)
+            finally:
+                for future in futures:
+                    future.cancel()
+                self._save_segments(url, content_length, segments)
+
+        return prefix_hash.hexdigest()
+
+    def _fetch_segment(self, url, segment, chunk_size, progress, prefix_hash):
+        start = position = segment["start"] + segment["written"]
+        headers = {"Range": f"bytes={start}-{segment['end'] - 1}"}
+        with requests.get(url, headers=headers, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise OSError(f"Server ignored range request for {url}")
+            # Unbuffered, so "written" never runs ahead of what reached the file
+            with open(self.part_path, "r+b", buffering=0) as file_out:
+                file_out.seek(start)
+                for chunk in r.iter_content(chunk_size=chunk_size):
                     file_out.write(chunk)
-            r.close()
-            self.is_downloaded = True
+                    segment["written"] += len(chunk)
+                    prefix_hash.update(position, chunk)
+                    position += len(chunk)
+                    progress.update(len(chunk))
+        if not _segment_done(segment):
+            raise OSError(f"Incomplete segment {segment['start']}-{segment['end']} of {url}")
+
+    def _load_segments(self, url, content_length, connections):
+        if os.path.exists(self.state_path) and os.path.exists(self.part_path):
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if state.get("url") == url and state.get("length") == content_length:
+                print(f"Resuming download of {self.modelpkg_name}")
+                return state["segments"]
+
+        # At least one segment per connection, at most 64 MB each so resumes lose little
+        segment_size = min(max(content_length // connections, 1), 64 * 1024 * 1024)
+        return [
+            {"start": start, "end": min(start + segment_size, content_length), "written": 0}
+            for start in range(0, content_length, segment_size)
+        ]
+
+    def _save_segments(self, url, content_length, segments):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": url, "length": content_length, "segments": segments}, f)
+        os.replace(tmp_path, self.state_path)
 
     def validate(self):
         """
-        Ensure the raw file hash matches the canonical version.
+        Ensure the raw file hash matches the canonical version. Uses the hash computed
+        during download when available. A mismatching file is removed so that the next
+        load downloads it again.
         Returns:
 
         """
         print(f"Validating downloaded package '{self.modelpkg_name}'...")
-        sha256_test = _get_file_sha256_hash(self.file_path)
+        sha256_test = self.sha256 or _get_file_sha256_hash(self.file_path)
         sha256_truth = self.metadata_pkg["hash"]
         if sha256_test != sha256_truth:
+            os.remove(self.file_path)
+            self.is_downloaded = False
+            self.sha256 = None
             raise ValueError(
                 f"Hash of modelpkg file {os.path.basename(self.file_path)} ({sha256_test}) does not match truth hash ({sha256_truth})."
             )
@@ -86,6 +197,10 @@ class ModelPkgLoader:
         """
         Move the models into the models dir in a logical format.
 
+        Members are streamed out of the archive one at a time into a temporary
+        directory which is renamed into place at the end, so a partially extracted
+        package is never mistaken for a complete one.
+
         Returns:
 
         """
@@ -95,18 +210,155 @@ class ModelPkgLoader:
             "relevance_2020v1",
         ]:
             print(f"Extracting file for model package {self.modelpkg_name}...")
+            tmp_path = f"{self.structured_path}.{os.getpid()}.tmp"
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
             with zipfile.ZipFile(self.file_path, "r") as zipped:
-                zipped.extractall(self.structured_path)
+                for member in zipped.infolist():
+                    _extract_member(zipped, member, tmp_path)
+            os.replace(tmp_path, self.structured_path)
         else:
             raise NotImplementedError(
                 f"Model package {self.modelpkg_name} has no structuring/unzipping protocol"
             )
 
     def load(self):
-        if not os.path.exists(self.structured_path):
-            self.download()
-            self.validate()
-            self.structure()
+        """
+        Download, validate and unpack the package unless already done. Concurrent
+        loaders (other workers, pods sharing the volume) wait on a file lock instead of
+        downloading into pkg/ at the same time.
+        """
+        if os.path.exists(self.structured_path):
+            return
+
+        if not os.path.exists(self.pkg_dir):
+            os.makedirs(self.pkg_dir, exist_ok=True)
+
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another process may have finished while we were waiting
+                if not os.path.exists(self.structured_path):
+                    self.download()
+                    self.validate()
+                    self.structure()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _probe(url):
+    """
+    Size of the file at url and whether the server accepts range requests, as
+    (content_length, ranged); content_length is 0 if unknown.
+
+    Tries a HEAD request first, then a one byte ranged GET: download links that
+    redirect to presigned URLs (figshare -> S3) usually refuse HEAD, as the
+    signature only covers GET. If both fail the file is fetched in one stream,
+    whose request reports the actual error.
+    """
+    try:
+        head = requests.head(url, allow_redirects=True)
+        if head.ok:
+            content_length = int(head.headers.get("Content-Length", 0))
+            ranged = head.headers.get("Accept-Ranges") == "bytes" and content_length > 0
+            return content_length, ranged
+    except requests.RequestException:
+        pass
+
+    try:
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True) as r:
+            if r.status_code == 206:
+                # Content-Range: bytes 0-0/<length>
+                total = r.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit():
+                    return int(total), int(total) > 0
+            elif r.ok:
+                return int(r.headers.get("Content-Length", 0)), False
+    except requests.RequestException:
+        pass
+    return 0, False
+
+
+def _segment_done(segment):
+    return segment["written"] >= segment["end"] - segment["start"]
+
+
+class _PrefixHash:
+    """
+    SHA256 of a file written in segments by several threads. Bytes are hashed in
+    file order as they are written, from the chunk itself when it continues the
+    hashed prefix; bytes written ahead of the prefix (by a later segment, or before
+    a resume) are read back from disk once the prefix reaches them.
+    """
+
+    def __init__(self, file_path, segments, chunk_size=1024 * 1024):
+        self.file_path = file_path
+        self.segments = segments
+        self.chunk_size = chunk_size
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+        # bytes hashed from disk rather than as they were written
+        self.read_back = 0
+        self._segment = 0
+        self._lock = threading.Lock()
+
+    def update(self, position, chunk):
+        """
+        Called once chunk has been written at position and counted in its segment.
+        """
+        with self._lock:
+            self._catch_up(position)
+            if position == self.offset:
+                self.sha256.update(chunk)
+                self.offset += len(chunk)
+            self._catch_up()
+
+    def _catch_up(self, limit=None):
+        # reads back what was written right after the prefix, up to limit
+        while self._segment < len(self.segments):
+            segment = self.segments[self._segment]
+            written_end = segment["start"] + segment["written"]
+            if limit is not None:
+                written_end = min(written_end, limit)
+            if self.offset < written_end:
+                self._read_back(written_end)
+            if self.offset < segment["end"]:
+                return
+            self._segment += 1
+
+    def _read_back(self, end):
+        with open(self.file_path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < end:
+                buffer = f.read(min(self.chunk_size, end - self.offset))
+                if not buffer:
+                    raise OSError(f"{self.file_path} ends before {end}")
+                self.sha256.update(buffer)
+                self.offset += len(buffer)
+                self.read_back += len(buffer)
+
+    def hexdigest(self):
+        with self._lock:
+            self._catch_up()
+        return self.sha256.hexdigest()
+
+
+def _extract_member(zipped, member, dest, chunk_size=1024 * 1024):
+    """
+    Streams one member of an open zip archive into dest, refusing paths that
+    would land outside it.
+    """
+    root = os.path.realpath(dest)
+    target = os.path.realpath(os.path.join(root, member.filename))
+    if os.path.commonpath([root, target]) != root:
+        raise ValueError(f"Zip member {member.filename} is outside the package")
+
+    if member.is_dir():
+        os.makedirs(target, exist_ok=True)
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with zipped.open(member) as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, chunk_size)
 
 
 def _get_file_sha256_hash(file_path):
@@ -5,6 +5,7 @@ from lbnlp.models.util import model_loader_setup
 from lbnlp.ner.clf import NERClassifier
 from lbnlp.normalize import Normalizer
 from lbnlp.process.matscholar import MatScholarProcess
+from lbnlp.resources import BUNDLE_NAME, ensure_bundle
 
 pkg = ModelPkgLoader("matscholar_2020v1")
 
@@ -24,10 +25,17 @@ def load_ner_model(basepath):
     ner_path = os.path.join(basepath, "ner")
 
     processor = MatScholarProcess(phraser_path=os.path.join(basepath, "embeddings/phraser.pkl"))
-    normalizer = Normalizer(os.path.join(basepath, "normalize"), os.path.join(basepath, "rsc"))
+    normalizer = load_normalizer(basepath)
     return NERClassifier(ner_path, normalizer, processor, enforce_local=True)
 
 
+def load_normalizer(basepath):
+    data_path = os.path.join(basepath, "normalize")
+    material_parser_data_path = os.path.join(basepath, "rsc")
+    bundle_path = ensure_bundle(data_path, material_parser_data_path, os.path.join(data_path, BUNDLE_NAME))
+    return Normalizer(data_path, material_parser_data_path, bundle_path=bundle_path)
+
+
 def load_ner_simple_model(basepath):
     ner_path = os.path.join(basepath, "ner")
     return NERClassifierConvenienceWrapper(ner_path, basepath)
@@ -43,7 +51,7 @@ class NERClassifierConvenienceWrapper:
     """
     def __init__(self, ner_path, basepath):
         self.processor = MatScholarProcess(phraser_path=os.path.join(basepath, "embeddings/phraser.pkl"))
-        self.normalizer = Normalizer(os.path.join(basepath, "normalize"), os.path.join(basepath, "rsc"))
+        self.normalizer = load_normalizer(basepath)
         self.clf = NERClassifier(ner_path, self.normalizer, self.processor, enforce_local=True)
 
     def tag_doc(self, doc):
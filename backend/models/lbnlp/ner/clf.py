@@ -147,16 +147,20 @@ class NERClassifier:
             concatenated.append(conc)
         return concatenated
 
-    def as_normalized(self, docs):
+    def as_normalized(self, docs, processes=None):
         """
         Tags the documents; each entity is concatenated into a single string, and normalized to
         a canonical form.
 
         :param docs: list; a list of documents; each document is a list of sentences;
         each sentence is a list of words (tokens)
+        :param processes: int; if given, normalize with a pool of this many worker processes
+        (see Normalizer.normalize_many)
         :return: list; a list of documents with normalized entities
         """
         tagged_docs = self.tag_docs(docs)
+        if processes:
+            return self.normalizer.normalize_many(docs, tagged_docs, processes=processes)
         return self.normalizer.normalize(docs, tagged_docs)
 
     def _preprocess(self, text):
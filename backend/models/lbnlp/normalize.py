@@ -1,23 +1,104 @@
 import json
+import multiprocessing
 import os
 import re
 from lbnlp.parse.material import MaterialParser
 from lbnlp.parse.simple import SimpleParser
+from lbnlp.resources import open_bundle
 from chemdataextractor.doc import Paragraph
 
+# Normalizer used by the worker processes of Normalizer.normalize_many
+_worker_normalizer = None
+
+
+def _init_worker(init_args):
+    global _worker_normalizer
+    # Forked workers inherit the parent's (already loaded) normalizer; only
+    # spawned workers have to build their own copy.
+    if _worker_normalizer is None:
+        _worker_normalizer = Normalizer(*init_args)
+
+
+def _normalize_chunk(chunk):
+    raw_docs, tagged_docs = chunk
+    return _worker_normalizer.normalize(raw_docs, tagged_docs)
+
 
 class Normalizer:
     """
     A class to perform entity normalization.
     """
 
-    def __init__(self, data_path, material_parser_data_path):
+    def __init__(self, data_path, material_parser_data_path, bundle_path=None):
         """
         Constructor method for Normalizer.
+
+        :param bundle_path: optional path to a compiled resource bundle (see lbnlp.resources);
+        when given, the dictionaries are read from it lazily instead of being parsed into memory
         """
 
-        self.normal_dict = NormalDict(data_path)
-        self.mat_normalizer = MatNormalizer(data_path, material_parser_data_path)
+        bundle = open_bundle(bundle_path) if bundle_path else None
+        self.normal_dict = NormalDict(data_path, bundle=bundle)
+        self.mat_normalizer = MatNormalizer(data_path, material_parser_data_path, bundle=bundle)
+
+        self._init_args = (data_path, material_parser_data_path, bundle_path)
+        self._pool = None
+        self._pool_size = None
+
+    def normalize_many(self, raw_docs, tagged_docs, processes=None, chunksize=16):
+        """
+        Normalize the entities in a list of documents using a pool of worker processes.
+
+        The pool is kept alive between calls, so the workers stay warm with the loaded
+        dictionaries; call close() when done with it. Results are in input order and
+        identical to normalize().
+
+        :param raw_docs: a list of strings
+        :param tagged_docs: a list of documents, as for normalize()
+        :param processes: int; number of worker processes (default: cpu count)
+        :param chunksize: int; number of documents sent to a worker at once
+        :return: a list of normalized documents
+        """
+
+        raw_docs = list(raw_docs)
+        tagged_docs = list(tagged_docs)
+        processes = processes or os.cpu_count() or 1
+        if processes == 1 or len(raw_docs) <= chunksize:
+            return self.normalize(raw_docs, tagged_docs)
+
+        if self._pool is None or self._pool_size != processes:
+            self.close()
+            global _worker_normalizer
+            _worker_normalizer = self
+            try:
+                self._pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                                  initargs=(self._init_args,))
+            finally:
+                _worker_normalizer = None
+            self._pool_size = processes
+
+        chunks = [(raw_docs[i:i + chunksize], tagged_docs[i:i + chunksize])
+                  for i in range(0, len(raw_docs), chunksize)]
+        normalized_docs = []
+        for normalized_chunk in self._pool.imap(_normalize_chunk, chunks):
+            normalized_docs.extend(normalized_chunk)
+        return normalized_docs
+
+    def close(self):
+        """
+        Shut down the worker pool started by normalize_many, if any.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._pool_size = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_size"] = None
+        return state
 
     # TODO: Make this normalize a single document
     def normalize(self, raw_docs, tagged_docs):
@@ -112,13 +193,16 @@ class NormalDict(dict):
         "CMT"
     ]
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, bundle=None):
         """
         A dictionary for mapping entities onto their normalized form
         """
 
         super().__init__()
         for key in self.DICT_KEYS:
+            if bundle is not None:
+                self[key] = bundle.table(f"normal:{key}")
+                continue
             dict_path = os.path.join(data_path, f"{key.lower()}.json")
             with open(dict_path, 'r') as f:
                 dict_ = json.load(f)
@@ -171,17 +255,23 @@ class MatNormalizer:
         "arsenide"
     ]
 
-    def __init__(self, data_path, material_parser_data_path):
+    def __init__(self, data_path, material_parser_data_path, bundle=None):
         """
         Constructor method for MatNormalizer.
         """
-        self.mp = MaterialParser(data_path=material_parser_data_path)
-        self.mp_lookup = MaterialParser(data_path=material_parser_data_path, pubchem_lookup=True)
+        chemical_names = bundle.table("names") if bundle is not None else None
+        self.mp = MaterialParser(data_path=material_parser_data_path, chemical_names=chemical_names)
+        # Both parsers read the same name dictionaries, so build them only once
+        self.mp_lookup = MaterialParser(data_path=material_parser_data_path, pubchem_lookup=True,
+                                        chemical_names=self.mp.chemical_names)
         self.matgen_parser = SimpleParser().matgen_parser
 
-        with open(os.path.join(data_path, "mat2formula.json")) as f:
-            mat_lookup = json.load(f)
-        self.mat_lookup = mat_lookup
+        if bundle is not None:
+            self.mat_lookup = bundle.table("mat2formula")
+        else:
+            with open(os.path.join(data_path, "mat2formula.json")) as f:
+                mat_lookup = json.load(f)
+            self.mat_lookup = mat_lookup
 
     def normalize_mat(self, mat, all_mats, raw_text):
         """
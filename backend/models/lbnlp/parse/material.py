@@ -13,7 +13,7 @@ __maintainer__ = "Olga Kononova"
 __email__ = "0lgaGkononova@yandex.ru"
 
 class MaterialParser:
-    def __init__(self, pubchem_lookup=False, data_path=None):
+    def __init__(self, pubchem_lookup=False, data_path=None, chemical_names=None):
         self.__list_of_elements_1 = ['H', 'B', 'C', 'N', 'O', 'F', 'P', 'S', 'K', 'V', 'Y', 'I', 'W', 'U']
         self.__list_of_elements_2 = ['He', 'Li', 'Be', 'Ne', 'Na', 'Mg', 'Al', 'Si', 'Cl', 'Ar', 'Ca', 'Sc', 'Ti', 'Cr',
                                      'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr',
@@ -27,9 +27,17 @@ class MaterialParser:
 
         self.__filename = os.path.dirname(os.path.realpath(__file__)) if not data_path else data_path
 
-        self.__chemical_names = self.build_names_dictionary()
+        # chemical_names may be shared between parsers (or backed by a compiled
+        # lbnlp.resources bundle) to avoid re-reading the name dictionaries
+        self.__chemical_names = chemical_names if chemical_names is not None else self.build_names_dictionary()
 
         self.__pubchem = pubchem_lookup
+        # names PubChem does not know; not asked again (failed requests are not remembered)
+        self.__pubchem_misses = set()
+
+    @property
+    def chemical_names(self):
+        return self.__chemical_names
 
     ###################################################################################################################
     ### Methods to build chemical structure
@@ -359,7 +367,7 @@ class MaterialParser:
             chemical_structure['fraction_vars'] = collections.defaultdict(str)
             chemical_structure['formula'] = ''
 
-            pcp_compounds = pcp.get_compounds(material_name, 'name')
+            pcp_compounds = self.__pubchem_compounds(material_name)
             if len(pcp_compounds) > 0:
                 try:
                     t_struct = self.get_structure_by_formula(pcp_compounds[0].molecular_formula)
@@ -382,6 +390,17 @@ class MaterialParser:
 
         return chemical_structure
 
+    def __pubchem_compounds(self, material_name):
+        if material_name in self.__pubchem_misses:
+            return []
+        try:
+            pcp_compounds = pcp.get_compounds(material_name, 'name')
+        except pcp.NotFoundError:
+            pcp_compounds = []
+        if len(pcp_compounds) == 0:
+            self.__pubchem_misses.add(material_name)
+        return pcp_compounds
+
     # TODO method merging materials with same composition
 
     ###################################################################################################################
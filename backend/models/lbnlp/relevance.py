@@ -1,8 +1,45 @@
+import collections
+import itertools
+import multiprocessing
+import os
+
 import dill
 import numpy as np
 
 from lbnlp.process.matscholar import MatScholarProcess
 
+# Processor used by the worker processes of RelevanceClassifier.iter_classify
+_worker_processor = None
+
+
+def _init_worker(processor):
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _preprocess_chunk(docs):
+    return [_preprocess_with(_worker_processor, doc) for doc in docs]
+
+
+def _preprocess_with(processor, text):
+    sents = processor.tokenize(text)
+    processed_sents = []
+    for sent in sents:
+        processed, _ = processor.process(sent)
+        processed_sents.append(processed)
+
+    flattened = [token for sent in processed_sents for token in sent]
+    return flattened
+
+
+def _chunks(docs, chunksize):
+    docs = iter(docs)
+    while True:
+        chunk = list(itertools.islice(docs, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
 
 class RelevanceClassifier:
     """
@@ -28,15 +65,7 @@ class RelevanceClassifier:
         :return: array; the processed tokens
         """
 
-        sents = self.processor.tokenize(text)
-        processed_sents = []
-        for sent in sents:
-            processed, _ = self.processor.process(sent)
-            processed_sents.append(processed)
-
-        flattened = [token for sent in processed_sents for token in sent]
-        return flattened
-
+        return _preprocess_with(self.processor, text)
 
     def classify(self, doc, decision_boundary=0.5):
         """
@@ -53,21 +82,91 @@ class RelevanceClassifier:
         pred = 1 if prob >= decision_boundary else 0
         return pred
 
-    def classify_many(self, docs, decision_boundary=0.5):
+    def classify_many(self, docs, decision_boundary=0.5, processes=1, chunksize=256, return_proba=False):
         """
         Classify multiple documents as relevant or not relevant
 
-        :param docs: list; a list of documents (as a string) to be classified
+        :param docs: iterable; documents (as a string) to be classified
         :param decision_boundary: float; probability required for a positive classification
-        :return: array; predicted labels (1 or 0)
+        :param processes: int; number of tokenizer processes (see iter_classify)
+        :param chunksize: int; documents per tokenization/tfidf chunk
+        :param return_proba: bool; also return the positive class probabilities
+        :return: array; predicted labels (1 or 0), or a (labels, probabilities) tuple
         """
 
-        processed = [self._preprocess(doc) for doc in docs]
-        X = self.tfidf.transform(processed)
-        prob = self.clf.predict_proba(X)[:, 1]
+        probs = list(self.iter_proba(docs, processes=processes, chunksize=chunksize))
+        prob = np.concatenate(probs) if probs else np.zeros(0)
         preds = np.where(prob > decision_boundary, 1, 0)
+        if return_proba:
+            return preds, prob
         return preds
 
+    def iter_classify(self, docs, decision_boundary=0.5, processes=1, chunksize=256):
+        """
+        Stream (label, probability) pairs for an iterable of documents, in input order.
+        Suitable as a first-stage filter over large corpora: only one chunk of sparse
+        tfidf features is held in memory at a time.
+
+        :param docs: iterable; documents (as a string) to be classified
+        :param decision_boundary: float; probability required for a positive classification
+        :param processes: int; number of tokenizer processes (default 1: tokenize in this
+        process; None: one per cpu)
+        :param chunksize: int; documents per tokenization/tfidf chunk
+        :return: generator of (int, float)
+        """
+
+        for prob in self.iter_proba(docs, processes=processes, chunksize=chunksize):
+            for p in prob:
+                yield (1 if p > decision_boundary else 0), float(p)
+
+    def iter_proba(self, docs, processes=1, chunksize=256):
+        """
+        Stream positive class probabilities, one array per chunk of documents.
+
+        With processes other than 1, tokenization (the expensive part) runs in a pool of
+        worker processes; each tokenized chunk is turned into a sparse tfidf matrix and
+        scored in this process.
+
+        :param docs: iterable; documents (as a string) to be classified
+        :param processes: int; number of tokenizer processes (default 1: tokenize in this
+        process; None: one per cpu)
+        :param chunksize: int; documents per tokenization/tfidf chunk
+        :return: generator of arrays
+        """
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+        chunks = _chunks(docs, chunksize)
+
+        first = next(chunks, None)
+        if first is None:
+            return
+        # A single (short) chunk is not worth starting a pool for
+        if processes <= 1 or len(first) < chunksize:
+            yield self._proba([self._preprocess(doc) for doc in first])
+            for chunk in chunks:
+                yield self._proba([self._preprocess(doc) for doc in chunk])
+            return
+        chunks = itertools.chain([first], chunks)
+
+        # Only a bounded number of chunks is in flight, so docs may be a lazy stream
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self.processor,))
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append(pool.apply_async(_preprocess_chunk, (chunk,)))
+                if len(pending) >= 2 * processes:
+                    yield self._proba(pending.popleft().get())
+            while pending:
+                yield self._proba(pending.popleft().get())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _proba(self, processed):
+        X = self.tfidf.transform(processed)
+        return self.clf.predict_proba(X)[:, 1]
+
 
 if __name__ == "__main__":
     clf = RelevanceClassifier()
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+BUNDLE_NAME = "normalize.sqlite"
+BUNDLE_VERSION = "1"
+
+# Memory map up to 256 MB of the bundle; pages are shared between every process
+# that opens the same file, so forked gunicorn/pool workers do not copy them.
+MMAP_SIZE = 256 * 1024 * 1024
+
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+# MaterialParser's name dictionaries, in material_parser_data_path
+PARSER_SOURCES = ("inorganic_compounds_dictionary", "pub_chem_dictionary")
+
+
+class ResourceBundle:
+    """
+    Read-only view over a compiled normalization bundle (see build_bundle).
+
+    The sqlite connection is opened lazily, once per thread and process, so the
+    bundle object itself can be created before a fork and shared afterwards.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, table, key, default=None):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM entries WHERE tbl = ? AND key = ?", (table, key)
+            )
+            .fetchone()
+        )
+        return default if row is None else json.loads(row[0])
+
+    def contains(self, table, key):
+        row = (
+            self._connection()
+            .execute("SELECT 1 FROM entries WHERE tbl = ? AND key = ?", (table, key))
+            .fetchone()
+        )
+        return row is not None
+
+    def keys(self, table):
+        cursor = self._connection().execute(
+            "SELECT key FROM entries WHERE tbl = ?", (table,)
+        )
+        return [key for (key,) in cursor]
+
+    def count(self, table):
+        return (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM entries WHERE tbl = ?", (table,))
+            .fetchone()[0]
+        )
+
+    def table(self, name):
+        return BundleTable(self, name)
+
+
+class BundleTable(Mapping):
+    """
+    A dict-like, read-only table of a ResourceBundle. Drop-in replacement for the
+    plain dictionaries used by MaterialParser, NormalDict and MatNormalizer.
+    """
+
+    _missing = object()
+
+    def __init__(self, bundle, name):
+        self.bundle = bundle
+        self.name = name
+
+    def __getitem__(self, key):
+        value = self.bundle.get(self.name, key, self._missing)
+        if value is self._missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.bundle.contains(self.name, key)
+
+    def __iter__(self):
+        return iter(self.bundle.keys(self.name))
+
+    def __len__(self):
+        return self.bundle.count(self.name)
+
+
+def open_bundle(path):
+    """
+    Returns the process-wide ResourceBundle for path, creating it on first use.
+    """
+    path = os.path.abspath(path)
+    with _bundles_lock:
+        if path not in _bundles:
+            _bundles[path] = ResourceBundle(path)
+        return _bundles[path]
+
+
+def source_paths(data_path, material_parser_data_path):
+    """
+    The dictionaries a bundle is compiled from.
+    """
+    from lbnlp.normalize import NormalDict
+
+    paths = [
+        os.path.join(data_path, f"{key.lower()}.json") for key in NormalDict.DICT_KEYS
+    ]
+    paths.append(os.path.join(data_path, "mat2formula.json"))
+    paths += [os.path.join(material_parser_data_path, name) for name in PARSER_SOURCES]
+    return paths
+
+
+def source_signature(data_path, material_parser_data_path):
+    """
+    Name, size and mtime of every source dictionary, so a bundle built from other
+    versions of them is detected and rebuilt.
+    """
+    signature = []
+    for path in source_paths(data_path, material_parser_data_path):
+        stat = os.stat(path)
+        signature.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return json.dumps(signature)
+
+
+def build_bundle(data_path, material_parser_data_path, bundle_path):
+    """
+    Compiles the normalization dictionaries into a single sqlite file.
+
+    :param data_path: string; directory with pro/apl/dsc/spl/smt/cmt.json and mat2formula.json
+    :param material_parser_data_path: string; directory with the MaterialParser name dictionaries
+    :param bundle_path: string; output file, replaced atomically
+    :return: string; bundle_path
+    """
+    from lbnlp.normalize import NormalDict
+    from lbnlp.parse.material import MaterialParser
+
+    tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+    conn.execute(
+        "CREATE TABLE entries (tbl TEXT, key TEXT, value TEXT, PRIMARY KEY (tbl, key)) WITHOUT ROWID"
+    )
+
+    def insert(table, items):
+        conn.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+            ((table, key, json.dumps(value)) for key, value in items),
+        )
+
+    names = MaterialParser(data_path=material_parser_data_path).chemical_names
+    insert("names", names.items())
+
+    for key in NormalDict.DICT_KEYS:
+        with open(os.path.join(data_path, f"{key.lower()}.json"), "r") as f:
+            dict_ = json.load(f)
+        insert(f"normal:{key}", ((k.upper(), v) for k, v in dict_.items()))
+
+    with open(os.path.join(data_path, "mat2formula.json")) as f:
+        insert("mat2formula", json.load(f).items())
+
+    conn.execute("INSERT INTO meta VALUES ('version', ?)", (BUNDLE_VERSION,))
+    conn.execute(
+        "INSERT INTO meta VALUES ('sources', ?)",
+        (source_signature(data_path, material_parser_data_path),),
+    )
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, bundle_path)
+    return bundle_path
+
+
+def ensure_bundle(data_path, material_parser_data_path, bundle_path):
+    """
+    Builds the bundle at bundle_path unless a current one already exists, i.e.
+    one of this BUNDLE_VERSION built from the source dictionaries as they are now.
+    """
+    if os.path.exists(bundle_path):
+        conn = sqlite3.connect(f"file:{bundle_path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+        except sqlite3.DatabaseError:
+            meta = {}
+        finally:
+            conn.close()
+        if meta.get("version") == BUNDLE_VERSION:
+            if meta.get("sources") == source_signature(
+                data_path, material_parser_data_path
+            ):
+                return bundle_path
+            print(f"Normalization dictionaries changed, rebuilding {bundle_path}")
+    return build_bundle(data_path, material_parser_data_path, bundle_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the matscholar normalization dictionaries into one sqlite bundle"
+    )
+    parser.add_argument("data_path", help="normalize/ directory of the model package")
+    parser.add_argument(
+        "material_parser_data_path", help="rsc/ directory of the model package"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help=f"Output file (default: <data_path>/{BUNDLE_NAME})",
+    )
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.data_path, BUNDLE_NAME)
+    print(build_bundle(args.data_path, args.material_parser_data_path, output))
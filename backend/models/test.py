@@ -1,4 +1,5 @@
 import argparse
+import time
 
 program_name: str = """
 test.py
@@ -44,6 +45,20 @@ def set_parser(
         - relevance: Relevance classification 0 (not relevant), 1 (relevant)
         """,
     )
+    parser.add_argument(
+        "--repeat",
+        required=False,
+        default=1,
+        type=int,
+        help="[Optional] Annotate the test document this many times and report docs/s\nDefault: 1",
+    )
+    parser.add_argument(
+        "--processes",
+        required=False,
+        default=None,
+        type=int,
+        help="[Optional] Worker processes for relevance classification\nDefault: cpu count",
+    )
     parser.add_argument("-v", "--version", action="version", version=program_version)
 
     return parser
@@ -71,13 +86,13 @@ def get_documents():
     return [doc]
 
 
-def annotate(docs, model, model_type):
+def annotate(docs, model, model_type, processes=None):
     if model_type == "matscholar":
         tags = [model.tag_doc(doc) for doc in docs]
     elif model_type == "matbert":
         tags = model.tag_docs(docs)
     elif model_type == "relevance":
-        tags = model.classify_many(docs)
+        tags = model.classify_many(docs, processes=processes, return_proba=True)
 
     return tags
 
@@ -86,10 +101,15 @@ def main(args):
     model_type = args.model_type
 
     model = model_selection(model_type)
-    docs = get_documents()
-    tags = annotate(docs, model, model_type)
+    docs = get_documents() * args.repeat
+
+    start = time.perf_counter()
+    tags = annotate(docs, model, model_type, args.processes)
+    elapsed = time.perf_counter() - start
 
-    print(tags)
+    if args.repeat == 1:
+        print(tags)
+    print(f"{len(docs)} docs in {elapsed:.2f}s ({len(docs) / elapsed:.1f} docs/s)")
 
 
 if __name__ == "__main__":
@@ -12,6 +12,8 @@ from io import BytesIO
 from xml.etree import ElementTree as ET
 
 import fitz
+import redis
+import redis.exceptions
 import requests
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
@@ -67,6 +69,7 @@ logging.basicConfig(level=logging.WARNING)
 logging.getLogger("sentence_transformers").setLevel(logging.WARNING)
 logging.getLogger("elastic_transport").setLevel(logging.WARNING)
 logging.getLogger("root").setLevel(logging.INFO)
+logger = logging.getLogger("add_papers")
 
 
 model: SentenceTransformer = SentenceTransformer("all-MiniLM-L6-v2")
@@ -162,6 +165,13 @@ def set_parser(
         type=str,
         help="[Optional] Location of input dataset. Will not use bulk API.",
     )
+    parser.add_argument(
+        "--exclude-vectors",
+        required=False,
+        default=False,
+        action="store_true",
+        help="[Optional] When creating the index, leave the embedding fields out of the stored _source (smaller index and responses, but the vectors cannot be reindexed from it)\nDefault: False",
+    )
     parser.add_argument("-v", "--version", action="version", version=program_version)
 
     return parser
@@ -169,9 +179,9 @@ def set_parser(
 
 def sleep_with_timer(seconds: int) -> None:
     for remaining in range(seconds, 0, -1):
-        logging.info(f"Resuming in {remaining} seconds...")
+        logger.info(f"Resuming in {remaining} seconds...")
         time.sleep(1)
-    logging.info("\nResuming now...")
+    logger.info("\nResuming now...")
 
 
 # using AWS S3 bulk data (full text only)
@@ -202,15 +212,15 @@ def sleep_with_timer(seconds: int) -> None:
 #                     pdf_file = tar.extractfile(member)
 #                     pdf_content = BytesIO(pdf_file.read())
 #                     text_content = convert_pdf_to_text(pdf_content)
-#                     logging.info(f"Full text indexed for arXiv ID: {arxiv_id}")
+#                     logger.info(f"Full text indexed for arXiv ID: {arxiv_id}")
 #                     return text_content
 
-#         logging.error(f"PDF not found in tar for arXiv ID: {arxiv_id}")
+#         logger.error(f"PDF not found in tar for arXiv ID: {arxiv_id}")
 
 #     except s3_client.exceptions.NoSuchKey:
-#         logging.error(f"Tar file not found for arXiv ID: {arxiv_id}")
+#         logger.error(f"Tar file not found for arXiv ID: {arxiv_id}")
 #     except Exception as e:
-#         logging.exception(f"Error fetching full text: {e}")
+#         logger.exception(f"Error fetching full text: {e}")
 
 
 #     return None
@@ -221,28 +231,28 @@ def get_full_text(arxiv_id):
 
     for i in range(2):
         try:
-            logging.info(f"Attempt {i + 1}")
+            logger.info(f"Attempt {i + 1}")
             response = requests.get(pdf_url, timeout=60)
             response.raise_for_status()
             break
-        except requests.exceptions.RequestException as e:
+        except requests.exceptions.RequestException:
             if response is not None and response.status_code == 503:
                 wait_time = int(
                     response.headers.get("Retry-After") or sleep_after_rate_limit
                 )
-                logging.exception(f"Rate limit, sleeping for {wait_time} seconds")
+                logger.exception(f"Rate limit, sleeping for {wait_time} seconds")
                 sleep_with_timer(wait_time)
             else:
-                logging.exception(f"Error fetching page, will try again. {e}")
+                logger.exception("Error fetching page, will try again.")
 
     if response is None:
-        logging.error("Could not download PDF after multiple attempts.")
+        logger.error("Could not download PDF after multiple attempts.")
         return None
 
     pdf_content = BytesIO(response.content)
     text_content = convert_pdf_to_text(pdf_content)
 
-    logging.info(f"Full text indexed for arXiv ID: {arxiv_id}")
+    logger.info(f"Full text indexed for arXiv ID: {arxiv_id}")
     return text_content
 
 
@@ -386,7 +396,7 @@ def read_dataset(dataset: str) -> tuple[list[dict], int]:
                 bad = client.options(ignore_status=[404]).get(index=INDEX, id=id)
                 exists = bad.get("found")
                 if exists is True and not ignore_dups:
-                    logging.info("Duplicate paper found")
+                    logger.info("Duplicate paper found")
                     dups += 1
                     continue
 
@@ -478,22 +488,22 @@ def annotate_papers(summaries: list[str], paper_dicts: list[dict]) -> list[dict]
             )
         except Exception:
             if not drop_batches:
-                logging.warning(
+                logger.warning(
                     "Batch did not successfully complete, uploading current documents"
                 )
                 break
 
-            logging.error(
+            logger.error(
                 "Batch did not successfully complete, dropping all batches\n"
                 "To upload partial iterations, please remove the --drop-batches flag"
             )
             exit()
 
         if annotations_response.status_code == 200:
-            logging.info(f"Batch {batch_num + 1}/{num_batches} annotation succeeded")
+            logger.info(f"Batch {batch_num + 1}/{num_batches} annotation succeeded")
             batch_annotations = annotations_response.json().get("annotation", [])
         else:
-            logging.error(
+            logger.error(
                 f"Batch {batch_num + 1}/{num_batches} annotation failed: "
                 f"{annotations_response.status_code}, {annotations_response.text}"
             )
@@ -513,6 +523,40 @@ def annotate_papers(summaries: list[str], paper_dicts: list[dict]) -> list[dict]
         p_dict["SMT"] = annotation.get("SMT", [])
         p_dict["SPL"] = annotation.get("SPL", [])
 
+    return normalize_materials(paper_dicts)
+
+
+# canonical MAT formulas and element sets, used by the "composition" search field
+def normalize_materials(paper_dicts: list[dict]) -> list[dict]:
+    num_batches: int = math.ceil(len(paper_dicts) / batch_size)
+
+    for batch_num in range(num_batches):
+        batch_start: int = batch_num * batch_size
+        batch_paper_dicts: list[dict] = paper_dicts[
+            batch_start : batch_start + batch_size
+        ]
+
+        try:
+            response: requests.Response = requests.post(
+                f"{LBNLP_URL}/normalize/materials",
+                json={"materials": [p.get("MAT", []) for p in batch_paper_dicts]},
+                headers={
+                    "Content-Type": "application/json",
+                },
+                verify=CERT_PATH,
+            )
+            response.raise_for_status()
+            normalized: list[dict] = response.json().get("normalized", [])
+        except (requests.RequestException, ValueError) as e:
+            logger.error(
+                f"Batch {batch_num + 1}/{num_batches} material normalization failed: {e}"
+            )
+            normalized = [{}] * len(batch_paper_dicts)
+
+        for p_dict, norm in zip(batch_paper_dicts, normalized):
+            p_dict["MAT_formula"] = norm.get("formulas", [])
+            p_dict["MAT_elements"] = norm.get("elements", [])
+
     return paper_dicts
 
 
@@ -536,23 +580,21 @@ def findInfo() -> tuple[list[dict], int]:
         else:
             url = f"https://export.arxiv.org/oai2?verb=ListRecords&resumptionToken={resumption_token}"
 
-        logging.info(
-            f"Fetching OAI-PMH page. Have {len(paper_list)} so far. URL: {url}"
-        )
+        logger.info(f"Fetching OAI-PMH page. Have {len(paper_list)} so far. URL: {url}")
 
         try:
             # Use requests for consistency
             response = requests.get(url, timeout=60)
             response.raise_for_status()
-        except Exception as e:
+        except Exception:
             if response.status_code == 503:
                 wait_time = int(
                     response.headers.get("Retry-After") or sleep_after_rate_limit
                 )
-                logging.exception(f"Rate limit, sleeping for {wait_time} seconds")
+                logger.exception(f"Rate limit, sleeping for {wait_time} seconds")
                 sleep_with_timer(int(wait_time))
 
-            logging.exception(f"Error fetching OAI-PMH data, exiting: {e}")
+            logger.exception("Error fetching OAI-PMH data, exiting")
             exit()
 
         # Parse XML
@@ -568,7 +610,7 @@ def findInfo() -> tuple[list[dict], int]:
         records = root.findall(".//oai:record", ns)
 
         if len(records) == 0:
-            logging.error("No data returned, exiting program")
+            logger.error("No data returned, exiting program")
             exit()
 
         paper_dicts: list[dict] = []
@@ -616,7 +658,7 @@ def findInfo() -> tuple[list[dict], int]:
                     )
                     exists = bad.get("found")
                     if exists is True and not ignore_dups:
-                        logging.info("Duplicate paper found")
+                        logger.info("Duplicate paper found")
                         dups += 1
                         continue
 
@@ -681,17 +723,17 @@ def findInfo() -> tuple[list[dict], int]:
 
                 paper_dicts.append(entry)
 
-            except Exception as ex:
-                logging.exception(f"Error parsing record: {ex}")
+            except Exception:
+                logger.exception("Error parsing record")
 
         # Collect all feed entries
         if not paper_dicts:
             # If for some reason we had records but couldn't parse anything
-            logging.error("No valid entries, exit flag enabled, exiting program")
+            logger.error("No valid entries, exit flag enabled, exiting program")
             exit()
 
         if not no_annotate:
-            logging.info("Fetched papers, starting annotations")
+            logger.info("Fetched papers, starting annotations")
 
         # The annotation logic remains the same
 
@@ -699,7 +741,7 @@ def findInfo() -> tuple[list[dict], int]:
             paper_dicts = annotate_papers(summaries, paper_dicts)
 
         paper_list.extend(paper_dicts)
-        logging.info(
+        logger.info(
             f"Collected papers (so far) 0 - {len(paper_list)}; Duplicates skipped: {dups}"
         )
 
@@ -707,11 +749,11 @@ def findInfo() -> tuple[list[dict], int]:
         rt_elem = root.find(".//oai:resumptionToken", ns)
         resumption_token = rt_elem.text if rt_elem is not None else None
         if not resumption_token:
-            logging.info("No resumptionToken found; no more pages to fetch from OAI.")
+            logger.info("No resumptionToken found; no more pages to fetch from OAI.")
             break
 
         wait_time = sleep_between_calls or wait_time
-        logging.info(f"Iteration complete, sleeping {wait_time} seconds")
+        logger.info(f"Iteration complete, sleeping {wait_time} seconds")
         sleep_with_timer(wait_time)
 
     return replaceNullValues(paper_list), dups
@@ -725,7 +767,17 @@ def replaceNullValues(papers_list: list[dict]) -> list[dict]:
     return papers_list
 
 
-def createNewIndex(delete: bool, index: str) -> None:
+# keyword fields searched with term filters by the server's "composition" field
+COMPOSITION_MAPPING: dict = {
+    "MAT_formula": {"type": "keyword"},
+    "MAT_elements": {"type": "keyword"},
+}
+
+# dense vectors, only needed by knn search
+EMBEDDING_FIELDS: list[str] = ["summary_embedding", "title_embedding"]
+
+
+def createNewIndex(delete: bool, index: str, exclude_vectors: bool = False) -> None:
     if client.indices.exists(index=index) and delete:
         client.indices.delete(index=index)
     if not client.indices.exists(index=index):
@@ -735,7 +787,13 @@ def createNewIndex(delete: bool, index: str) -> None:
                 "mappings": {
                     "properties": {
                         "embedding": {"type": "dense_vector"},
+                        **COMPOSITION_MAPPING,
                     },
+                    **(
+                        {"_source": {"excludes": EMBEDDING_FIELDS}}
+                        if exclude_vectors
+                        else {}
+                    ),
                 },
                 "settings": {
                     "number_of_replicas": 0,
@@ -743,7 +801,8 @@ def createNewIndex(delete: bool, index: str) -> None:
             },
         )
     else:
-        logging.info("Index already exists and no deletion specified")
+        logger.info("Index already exists and no deletion specified")
+        client.indices.put_mapping(index=index, properties=COMPOSITION_MAPPING)
 
 
 def getEmbedding(text: str):
@@ -755,7 +814,7 @@ def insert_documents(documents: list[dict], index: str):
         print(json.dumps(documents, indent=4))
         return
 
-    logging.info("Starting Insertion")
+    logger.info("Starting Insertion")
     operations: list[dict] = []
     operations_string: str = ""
 
@@ -788,10 +847,27 @@ def insert_documents(documents: list[dict], index: str):
     if output:
         with open(output, "a") as file:
             file.write(operations_string)
-        logging.info("Successfully wrote to file")
+        logger.info("Successfully wrote to file")
     elif not no_es:
         client.bulk(operations=operations)
-        logging.info("Successfully Completed Insertion")
+        logger.info("Successfully Completed Insertion")
+        bump_index_generation(index)
+
+
+def bump_index_generation(index: str) -> None:
+    """
+    Increments the index generation counter the search server includes in its
+    cache keys, so nothing cached before this write is served anymore.
+    """
+    redis_host: str = os.getenv("REDIS_HOST") or (
+        "redis" if DOCKER == "true" else "localhost"
+    )
+    try:
+        redis_client = redis.StrictRedis(host=redis_host, port=6379, db=0)
+        generation: int = redis_client.incr(f"index_generation:{index}")  # type: ignore
+        logger.info(f"Index generation is now {generation}")
+    except redis.exceptions.RedisError:
+        logger.exception("Failed to bump index generation, server caches may be stale")
 
 
 def upload_to_es() -> None:
@@ -800,7 +876,7 @@ def upload_to_es() -> None:
     else:
         start_db_count = 0
 
-    logging.info(f"Total documents in DB: {start_db_count}\n")
+    logger.info(f"Total documents in DB: {start_db_count}\n")
 
     if dataset:
         docs, dups = read_dataset(dataset)
@@ -808,16 +884,16 @@ def upload_to_es() -> None:
         docs, dups = findInfo()
 
     if len(docs) == 0:
-        logging.error("No docs to upload, exiting")
+        logger.error("No docs to upload, exiting")
         exit()
 
     insert_documents(docs, INDEX)
-    logging.info(f"Uploaded {iter * 1000 - dups} documents")
+    logger.info(f"Uploaded {iter * 1000 - dups} documents")
 
 
-def main() -> None:
+def main(exclude_vectors: bool = False) -> None:
     if not no_es:
-        createNewIndex(False, INDEX)
+        createNewIndex(False, INDEX, exclude_vectors)
 
     if iter < 1:
         raise Exception(
@@ -849,11 +925,11 @@ if __name__ == "__main__":
     sleep_between_calls: int = args.sleep_between_calls
     dataset: str | None = args.file_dataset
 
-    logging.info("Running script with the following arguments:")
+    logger.info("Running script with the following arguments:")
     for key, value in vars(args).items():
-        logging.info(f"{key}: {value}")
+        logger.info(f"{key}: {value}")
 
     # Set up the Elasticsearch client
     client: Elasticsearch = Elasticsearch(ES_URL, api_key=API_KEY, ca_certs=CERT_PATH)
 
-    main()
+    main(args.exclude_vectors)
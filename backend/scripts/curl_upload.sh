@@ -84,4 +84,14 @@ echo -e "\nChecking document count...\n"
 curl --cacert "$SCRIPT_DIR/ca.crt" -X GET "$ES_URL/$INDEX_NAME/_count?pretty" \
      -H "Authorization: ApiKey $API_KEY_INPUT"
 
+# bump the index generation the search server keys its caches by, so results
+# cached before this upload are no longer served
+REDIS_HOST=${REDIS_HOST:-$([[ "$DOCKER" == "true" ]] && echo "redis" || echo "localhost")}
+if command -v redis-cli > /dev/null \
+    && generation=$(redis-cli -h "$REDIS_HOST" -p 6379 INCR "index_generation:$INDEX_NAME"); then
+    echo -e "\nIndex generation is now $generation"
+else
+    echo -e "\nWarning: failed to bump index generation, server caches may be stale"
+fi
+
 echo "Bulk upload completed successfully!"
\ No newline at end of file
@@ -0,0 +1,750 @@
+"""
+Async (ASGI) variant of the search API: /api/papers, /api/papers/<id>,
+/api/papers/batch and /api/papers/export with the same contract as server.py,
+built on AsyncElasticsearch and redis.asyncio so a worker keeps serving other
+requests while it waits on Elasticsearch or Redis. Embedding and highlighting are
+CPU bound and run on a bounded thread pool (EXECUTOR_WORKERS, default one per
+core).
+
+Both servers build their searches and pages with pipeline.py and use the same
+cache keys and values, so they can run side by side; this module only does the
+I/O.
+
+Run with:
+  uvicorn async_server:app --host 0.0.0.0 --port 8080 --workers <cores>
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import redis
+import redis.asyncio
+import redis.exceptions
+from cache import (
+    AsyncIndexGeneration,
+    AsyncIndexSize,
+    AsyncPaperCache,
+    AsyncSingleFlight,
+    BytesLRUCache,
+    CacheStats,
+    EmbeddingCache,
+    ResultCodec,
+)
+from dotenv import load_dotenv
+from elasticsearch import ApiError, AsyncElasticsearch
+from metrics import (
+    CountedStats,
+    count_lookup,
+    observe_request,
+    render,
+    request_timings,
+    server_timing,
+    start_request,
+    timed,
+)
+from pipeline import (
+    CACHE_STALE_TTL,
+    EMBEDDING_FIELDS,
+    MAX_BATCH_IDS,
+    MAX_RESULT_WINDOW,
+    NEGATIVE_CACHE_TTL,
+    PAGE_CACHE_TTL,
+    PAPER_CACHE_TTL,
+    PIT_BATCH_SIZE,
+    PIT_KEEP_ALIVE,
+    DateSegment,
+    SearchPlan,
+    advance_pit,
+    batch_body,
+    batch_ids,
+    date_segment_key,
+    date_segments,
+    highlight_page,
+    highlight_search_body,
+    hits_by_id,
+    join_segments,
+    knn_bodies,
+    ndjson,
+    page_body,
+    page_ids,
+    paper_etag,
+    pit_body,
+    plan_export,
+    plan_search,
+    regular_window,
+    regular_window_body,
+    source_bodies,
+    use_es_highlight,
+    vector_window,
+    window_hit,
+    window_ttl,
+)
+from profiling import (
+    is_admin,
+    loggable_knn,
+    note_search,
+    profiling,
+    request_profile,
+    slow_query_entry,
+    track_searches,
+)
+from query_log import WARMUP_HEADER, QueryLog, log_body
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from search import (
+    HIGHLIGHT_MODES,
+    make_page_key,
+    make_window_key,
+    parse_request,
+    req_validation,
+    window_target,
+)
+from sentence_transformers import SentenceTransformer  # type: ignore
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+load_dotenv(dotenv_path="./env/.env")
+API_KEY: str | None = os.getenv("API_KEY")
+ES_URL: str | None = os.getenv("ES_URL")
+DOCKER: str | None = os.getenv("DOCKER")
+INDEX: str = os.getenv("INDEX", "")
+CERT_PATH: str = os.getenv("CERT_PATH", "")
+HIGHLIGHT_ENGINE: str = os.getenv("HIGHLIGHT_ENGINE", "python")
+EXECUTOR_WORKERS: int = int(os.getenv("EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+
+logger = logging.getLogger("uvicorn.error")
+
+# one client (and connection pool) per worker process, shared by every request
+client: AsyncElasticsearch = AsyncElasticsearch(
+    ES_URL, api_key=API_KEY, ca_certs=CERT_PATH or None
+)
+executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+model: SentenceTransformer = SentenceTransformer(EMBEDDING_MODEL)
+
+redis_host = "redis" if DOCKER == "true" else "localhost"
+redis_client: AsyncRedis = redis.asyncio.StrictRedis(
+    host=redis_host, port=6379, db=0, decode_responses=True
+)
+# cached pages and windows are binary (ResultCodec)
+redis_results_client: AsyncRedis = redis.asyncio.StrictRedis(
+    host=redis_host, port=6379, db=0
+)
+# the embedding cache runs on the executor, so it keeps a blocking client
+redis_bytes_client: Redis = redis.StrictRedis(host=redis_host, port=6379, db=0)
+redis_success: bool = False
+
+embedding_cache: EmbeddingCache = EmbeddingCache(
+    model.encode, EMBEDDING_MODEL, redis_client=redis_bytes_client
+)
+
+
+async def run_in_executor(func: Callable, *args):  # type: ignore
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def get_embedding(text: str):  # type: ignore
+    with timed("embedding"):
+        return await run_in_executor(embedding_cache.get, text)
+
+
+async def count_papers() -> int:
+    with timed("count", es=True):
+        return (await client.count(index=INDEX))["count"]
+
+
+index_size: AsyncIndexSize = AsyncIndexSize(INDEX, count_papers)
+
+PAPER_LRU_SIZE: int = int(os.getenv("PAPER_LRU_SIZE", "0"))
+
+index_generation: AsyncIndexGeneration = AsyncIndexGeneration(INDEX)
+paper_cache: AsyncPaperCache = AsyncPaperCache(
+    INDEX, index_generation, maxsize=PAPER_LRU_SIZE, ttl=PAPER_CACHE_TTL
+)
+
+
+async def get_papers_by_id(paper_ids: list[str]) -> dict[str, str]:
+    with timed("paper_cache"):
+        bodies: dict[str, str] = await paper_cache.get_many(paper_ids)
+
+    misses: list[str] = [pid for pid in paper_ids if pid not in bodies]
+    if misses:
+        with timed("mget", es=True):
+            docs: list[dict] = (
+                await client.mget(
+                    index=INDEX, ids=misses, source_excludes=EMBEDDING_FIELDS
+                )
+            )["docs"]
+        found: dict[str, str] = source_bodies(docs)
+        await paper_cache.set_many(found)
+        bodies.update(found)
+
+    return bodies
+
+
+async def cache_search_sources(hits: list[dict]) -> None:
+    await paper_cache.set_many(source_bodies(hits))
+
+
+RESULT_CODEC: ResultCodec = ResultCodec.from_file(os.getenv("CACHE_ZSTD_DICT"))
+
+page_stats: CacheStats = CountedStats("page", "stale", "misses")
+
+PAGE_L1_BYTES: int = int(os.getenv("PAGE_L1_BYTES", str(32 * 1024 * 1024)))
+PAGE_L1_TTL: int = 60
+page_bodies: BytesLRUCache | None = (
+    BytesLRUCache(PAGE_L1_BYTES, PAGE_L1_TTL) if PAGE_L1_BYTES > 0 else None
+)
+single_flight: AsyncSingleFlight = AsyncSingleFlight()
+
+
+async def get_cache_entry(cache_key: str) -> tuple | None:
+    if not redis_success:
+        return None
+    return RESULT_CODEC.decode_entry(await redis_results_client.get(cache_key))
+
+
+async def get_cached_results(cache_key: str) -> dict | None:
+    entry: tuple | None = await get_cache_entry(cache_key)
+    if entry is None or entry[1]:
+        return None
+    return entry[0]
+
+
+async def cache_results(
+    cache_key: str, data: tuple | dict, ttl: int = PAGE_CACHE_TTL
+) -> None:
+    if redis_success:
+        with timed("cache_write"):
+            await redis_results_client.setex(
+                cache_key, ttl + CACHE_STALE_TTL, RESULT_CODEC.encode_entry(data, ttl)
+            )
+
+
+async def msearch(*bodies: dict) -> list[dict]:
+    searches: list[dict] = []
+    for body in bodies:
+        searches.extend(({"index": INDEX}, body))
+
+    with timed("search", es=True):
+        responses: list[dict] = (await client.msearch(searches=searches))["responses"]
+    for response in responses:
+        if "error" in response:
+            raise RuntimeError(f"msearch failed: {response['error']}")
+
+    return responses
+
+
+RESULT_WINDOW: int = int(os.getenv("RESULT_WINDOW", "200"))
+window_stats: CacheStats = CountedStats("window", "extends", "misses")
+
+
+async def load_window(window_key: str, depth: int, plan: SearchPlan) -> dict:
+    """
+    Async load_window of server.py, reading and writing the same window entries.
+    """
+    target: int = window_target(depth, RESULT_WINDOW, MAX_RESULT_WINDOW)
+    with timed("window_cache"):
+        window: dict | None = (
+            None if profiling() else await get_cached_results(window_key)
+        )
+    if window_hit(window, depth, target):
+        window_stats.count("hits")
+        return window  # type: ignore
+
+    window_stats.count("misses" if window is None else "extends")
+    if plan.kind == "vector":
+        window = await handle_vector_search(plan, target)
+    else:
+        window = await handle_regular_search(plan, window, target)
+    await cache_results(window_key, window, window_ttl(window))
+    return window
+
+
+async def load_date_window(
+    window_key: str, page: int, num_results: int, plan: SearchPlan
+) -> dict:
+    """
+    Async load_date_window of server.py, reading and writing the same segments.
+    """
+    segments: range = date_segments(page, num_results, RESULT_WINDOW)
+    return join_segments(
+        [await load_date_segment(window_key, segment, plan) for segment in segments],
+        segments[0],
+        RESULT_WINDOW,
+    )
+
+
+async def load_date_segment(window_key: str, segment: int, plan: SearchPlan) -> dict:
+    key: str = date_segment_key(window_key, segment)
+    previous: dict | None = None
+    with timed("window_cache"):
+        window: dict | None = None if profiling() else await get_cached_results(key)
+        if window is None and segment > 0 and not profiling():
+            previous = await get_cached_results(
+                date_segment_key(window_key, segment - 1)
+            )
+    if window is not None:
+        window_stats.count("hits")
+        return window
+
+    window_stats.count("misses" if previous is None else "extends")
+    reader: DateSegment = DateSegment(
+        segment, RESULT_WINDOW, plan.quer, plan.sort, previous
+    )
+    while not reader.done:
+        body: dict = reader.next_body()
+        with timed("search", es=True):
+            results = await client.search(index=INDEX, body=body)
+        note_search("search", body, results)
+        reader.add(results)
+    window = reader.window()
+    await cache_results(key, window, window_ttl(window))
+    return window
+
+
+async def handle_vector_search(plan: SearchPlan, target: int) -> dict:
+    size: int = await index_size.get()
+    embedding = await get_embedding(plan.vector_query)  # type: ignore
+    knn_body, total_body = knn_bodies(plan, embedding.tolist(), size, target)
+
+    knn_response, total_response = await msearch(knn_body, total_body)
+    note_search("knn", {**knn_body, "knn": loggable_knn(knn_body["knn"])}, knn_response)
+    note_search("total", total_body, total_response)
+    return vector_window(knn_response, total_response, size, target)
+
+
+async def handle_regular_search(
+    plan: SearchPlan, window: dict | None, target: int
+) -> dict:
+    body: dict = regular_window_body(plan.quer, window, target)
+    with timed("search", es=True):
+        results = await client.search(index=INDEX, body=body)
+    note_search("search", body, results)
+    return regular_window(window, results, target)
+
+
+async def build_page(
+    page_ids: list[str], highlight_quer: dict, highlight_mode: str
+) -> list[dict]:
+    es_highlighted: bool = use_es_highlight(HIGHLIGHT_ENGINE, highlight_mode)
+    if es_highlighted:
+        with timed("highlight_search", es=True):
+            results = await client.search(
+                index=INDEX, body=highlight_search_body(page_ids, highlight_quer)
+            )
+        await cache_search_sources(results["hits"]["hits"])
+        by_id: dict[str, dict] = {hit["_id"]: hit for hit in results["hits"]["hits"]}
+    else:
+        by_id = hits_by_id(await get_papers_by_id(page_ids))
+
+    with timed("highlight"):
+        return await run_in_executor(
+            highlight_page,
+            page_ids,
+            by_id,
+            highlight_quer,
+            highlight_mode,
+            es_highlighted,
+        )
+
+
+async def health(request: Request) -> Response:
+    return JSONResponse({"message": "Success"})
+
+
+READY_FILE: str | None = os.getenv("READY_FILE")
+
+
+async def ready(request: Request) -> Response:
+    if READY_FILE and not os.path.exists(READY_FILE):
+        return JSONResponse({"message": "Warming up"}, 503)
+    return JSONResponse({"message": "Ready"})
+
+
+QUERY_LOG: str | None = os.getenv("QUERY_LOG")
+query_log: QueryLog | None = QueryLog(QUERY_LOG) if QUERY_LOG else None
+
+ADMIN_TOKEN: str | None = os.getenv("ADMIN_TOKEN")
+SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", "1000"))
+SLOW_QUERY_LOG: str | None = os.getenv("SLOW_QUERY_LOG")
+slow_log: QueryLog | None = (
+    QueryLog(SLOW_QUERY_LOG, prefix="slow") if SLOW_QUERY_LOG else None
+)
+
+
+def record_query(
+    handler: Callable[[Request], Awaitable[Response]],
+) -> Callable[[Request], Awaitable[Response]]:
+    """
+    Wraps a handler so its requests are written to the query log, and to the slow
+    query log when slower than SLOW_QUERY_MS, and can be profiled by admins.
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(request: Request) -> Response:
+        start: float = time.perf_counter()
+        try:
+            body: dict | None = log_body(await request.json())
+        except ValueError:
+            body = None
+        track_searches(is_admin(request.headers.get("x-profile"), ADMIN_TOKEN))
+
+        response: Response = await handler(request)
+
+        latency_ms: float = (time.perf_counter() - start) * 1000
+        cache: str | None = getattr(request.state, "cache", None)
+        if query_log is not None and not request.headers.get(WARMUP_HEADER):
+            query_log.record(body, latency_ms, cache, response.status_code)
+        if latency_ms >= SLOW_QUERY_MS:
+            entry: dict = slow_query_entry(
+                body, latency_ms, cache, response.status_code, request_timings()
+            )
+            if slow_log is not None:
+                slow_log.write(entry)
+            else:
+                logger.warning(f"Slow query: {json.dumps(entry, default=str)}")
+        return response
+
+    return wrapper
+
+
+class ServerTimingMiddleware:
+    """
+    Adds the stage timings of each request as a Server-Timing header and observes
+    its latency (see metrics.py). Plain ASGI so handlers run in the task, and see
+    the context, the timings are started in.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start: float = time.perf_counter()
+        start_request()
+        status: int = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers: MutableHeaders = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", server_timing(time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            endpoint = scope.get("endpoint")
+            observe_request(
+                getattr(endpoint, "__name__", None),
+                status,
+                time.perf_counter() - start,
+            )
+
+
+async def metrics(request: Request) -> Response:
+    body, content_type = render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def cache_stats(request: Request) -> Response:
+    return JSONResponse(
+        {
+            "embedding": embedding_cache.stats(),
+            "page": page_stats.stats(),
+            "page_l1": page_bodies.stats() if page_bodies is not None else None,
+            "window": window_stats.stats(),
+        }
+    )
+
+
+async def get_paper(request: Request) -> Response:
+    paper_id: str = request.path_params["paper_id"]
+    body: str | None = (await get_papers_by_id([paper_id])).get(paper_id)
+    if body is None:
+        return JSONResponse({"error": "No results found"}, 404)
+
+    etag: str = f'"{paper_etag(body)}"'
+    headers: dict[str, str] = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def get_papers_batch(request: Request) -> Response:
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    paper_ids: list[str] | None = batch_ids(data)
+    if paper_ids is None:
+        logger.error("Batch request failed to validate")
+        return JSONResponse(
+            {"error": f"ids must be a list of at most {MAX_BATCH_IDS} ids"}, 400
+        )
+    if not paper_ids:
+        return JSONResponse({"papers": [], "missing": []})
+
+    try:
+        found: dict[str, str] = await get_papers_by_id(paper_ids)
+    except Exception:
+        logger.exception("Failed to read batch papers")
+        return JSONResponse(None, 500)
+
+    return JSONResponse(batch_body(paper_ids, found))
+
+
+async def search_page(
+    cache_key: str,
+    page: int,
+    num_results: int,
+    sorting: str,
+    sort: str,
+    start_date: int,
+    end_date: int,
+    searches: list,
+    highlight_mode: str,
+) -> tuple | None:
+    window_key: str = make_window_key(
+        INDEX, await index_generation.get(), searches, sorting, start_date, end_date
+    )
+
+    plan: SearchPlan | None = plan_search(searches, start_date, end_date, sorting, sort)
+    if plan is None:
+        logger.error("Failed to bool search")
+        return None
+
+    if plan.kind == "date":
+        window: dict = await load_date_window(window_key, page, num_results, plan)
+    else:
+        window = await load_window(window_key, page * num_results, plan)
+    total: int = window["total"]
+    inflated: int = window["inflated"]
+    ids: list[str] = page_ids(window, page, num_results)
+    if not ids:
+        logger.error("No hits")
+        await cache_results(cache_key, ([], total, inflated), NEGATIVE_CACHE_TTL)
+        return [], total, inflated
+
+    filtered_papers: list[dict] = await build_page(
+        ids, plan.highlight_quer, highlight_mode
+    )
+    if not filtered_papers:
+        logger.error("No results found")
+        return [], total, inflated
+
+    await cache_results(cache_key, (filtered_papers, total, inflated))
+    return filtered_papers, total, inflated
+
+
+async def papers(request: Request) -> Response:
+    try:
+        (
+            page,
+            num_results,
+            sorting,
+            start_date,
+            end_date,
+            searches,
+            highlight_mode,
+        ) = parse_request(await request.json() or {})
+
+        sort: str | None = req_validation(page, num_results, sorting)
+        if sort is None or highlight_mode not in HIGHLIGHT_MODES:
+            logger.error("Request failed to validate")
+            return JSONResponse(None, 500)
+
+        cache_key: str = make_page_key(
+            INDEX,
+            await index_generation.get(),
+            searches,
+            sorting,
+            page,
+            num_results,
+            start_date,
+            end_date,
+            highlight_mode,
+        )
+
+        def compute() -> Awaitable[tuple | None]:
+            return search_page(
+                cache_key,
+                page,
+                num_results,
+                sorting,
+                sort,
+                start_date,
+                end_date,
+                searches,
+                highlight_mode,
+            )
+
+        if profiling():
+            request.state.cache = "profile"
+            result: tuple | None = await compute()
+            if result is None:
+                return JSONResponse(None, 500)
+            return JSONResponse(page_body(result, request_profile()))
+
+        if page_bodies is not None:
+            with timed("l1"):
+                body: bytes | None = page_bodies.get(cache_key)
+            count_lookup("page_l1", "misses" if body is None else "hits")
+            if body is not None:
+                request.state.cache = "l1"
+                return Response(body, media_type="application/json")
+
+        with timed("cache"):
+            cached: tuple | None = await get_cache_entry(cache_key)
+        stale: bool = False
+        if cached is not None:
+            result, stale = cached
+            page_stats.count("stale" if stale else "hits")
+            request.state.cache = "stale" if stale else "hit"
+            if stale:
+                single_flight.refresh(cache_key, compute)
+        else:
+            page_stats.count("misses")
+            request.state.cache = "miss"
+            result = await single_flight.do(
+                cache_key, compute, lambda: get_cached_results(cache_key)
+            )
+
+        if result is None or not result[0]:
+            return JSONResponse(None, 500)
+
+        with timed("serialize"):
+            response: Response = JSONResponse(page_body(result))
+        if page_bodies is not None and not stale:
+            page_bodies.set(cache_key, bytes(response.body))
+        return response
+    except Exception:
+        logger.exception("Failed to search papers")
+        return JSONResponse(None, 500)
+
+
+async def open_pit() -> dict:
+    with timed("search", es=True):
+        pit = await client.open_point_in_time(index=INDEX, keep_alive=PIT_KEEP_ALIVE)
+    return {"pit_id": pit["id"], "search_after": None}
+
+
+async def close_pit(cursor: dict) -> None:
+    try:
+        await client.close_point_in_time(id=cursor["pit_id"])
+    except ApiError:
+        logger.exception("Failed to close point in time")
+
+
+async def pit_batches(plan: SearchPlan, cursor: dict) -> AsyncIterator[list[dict]]:
+    while True:
+        with timed("search", es=True):
+            results = await client.search(body=pit_body(plan, cursor))
+        hits: list[dict] = advance_pit(cursor, results)
+
+        yield hits
+
+        if len(hits) < PIT_BATCH_SIZE:
+            return
+
+
+async def export_papers(request: Request) -> Response:
+    """
+    Async export_papers of server.py: every paper matching a search as NDJSON.
+    """
+    try:
+        plan: SearchPlan | None = plan_export(await request.json() or {})
+        if plan is None:
+            logger.error("Export request failed to validate")
+            return JSONResponse(None, 400)
+        if plan.kind == "vector":
+            return JSONResponse({"error": "Vector searches cannot be exported"}, 400)
+
+        cursor: dict = await open_pit()
+    except Exception:
+        logger.exception("Failed to start export")
+        return JSONResponse(None, 500)
+
+    async def generate() -> AsyncIterator[str]:
+        try:
+            async for hits in pit_batches(plan, cursor):
+                yield ndjson(hits)
+        finally:
+            await close_pit(cursor)
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=papers.ndjson"},
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    global redis_success
+    try:
+        await redis_client.ping()
+        redis_success = True
+        index_generation.redis_client = redis_client
+        index_size.redis_client = redis_client
+        paper_cache.redis_client = redis_client
+        single_flight.redis_client = redis_client
+    except redis.exceptions.ConnectionError:
+        logger.exception("Failed to connect to redis")
+        embedding_cache.redis_client = None
+
+    yield
+
+    await client.close()
+    await redis_client.aclose()
+    await redis_results_client.aclose()
+    executor.shutdown(wait=False)
+
+
+middleware: list[Middleware] = []
+if DOCKER != "true":
+    middleware.append(
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["*"],
+            allow_headers=["Content-Type", "Authorization"],
+        )
+    )
+middleware.append(Middleware(ServerTimingMiddleware))
+
+app: Starlette = Starlette(
+    routes=[
+        Route("/api/health", health, methods=["GET"]),
+        Route("/api/ready", ready, methods=["GET"]),
+        Route("/api/metrics", metrics, methods=["GET"]),
+        Route("/api/cache/stats", cache_stats, methods=["GET"]),
+        Route("/api/papers", record_query(papers), methods=["POST"]),
+        Route("/api/papers/batch", get_papers_batch, methods=["POST"]),
+        Route("/api/papers/export", export_papers, methods=["POST"]),
+        Route("/api/papers/{paper_id}", get_paper, methods=["GET"]),
+    ],
+    middleware=middleware,
+    lifespan=lifespan,
+)
@@ -0,0 +1,790 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from typing import Any
+
+import msgpack  # type: ignore
+import numpy as np
+import redis.exceptions
+import redis.lock
+import zstandard
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+logger = logging.getLogger("gunicorn.error")
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU cache.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize: int = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheStats:
+    """
+    Thread-safe lookup counters. hit_ratio is "hits" over all counted lookups.
+    """
+
+    def __init__(self, *names: str) -> None:
+        self._counts: dict[str, int] = dict.fromkeys(("hits", *names), 0)
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats: dict = dict(self._counts)
+        lookups: int = sum(stats.values())
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class BytesLRUCache:
+    """
+    Thread-safe in-process LRU of serialized values with a TTL per entry, bounded
+    by the total size of the values in bytes instead of their number.
+    """
+
+    def __init__(self, maxbytes: int, ttl: float) -> None:
+        self.maxbytes: int = maxbytes
+        self.ttl: float = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.Lock()
+        self._stats: CacheStats = CacheStats("misses")
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry: tuple[float, bytes] | None = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        self._stats.count("misses" if entry is None else "hits")
+        return None if entry is None else entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        # values that would take over the whole cache are not worth keeping
+        if len(value) > self.maxbytes // 4:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._size += len(value)
+            while self._size > self.maxbytes:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            size: dict = {"bytes": self._size, "entries": len(self._data)}
+        return {**self._stats.stats(), **size}
+
+
+class ResultCodec:
+    """
+    Serializes cached search results (pages and result windows) as msgpack
+    compressed with zstd, behind a one byte format version. With a dictionary
+    (trained on paper sources, see testing/bench_cache_codec.py) small values
+    compress much better. Values of an unknown version, or compressed with a
+    dictionary other than ours, decode to None and are treated as misses.
+    """
+
+    VERSION: bytes = b"\x01"
+
+    def __init__(self, dictionary: bytes | None = None, level: int = 3) -> None:
+        self.level: int = level
+        self.dictionary: zstandard.ZstdCompressionDict | None = (
+            zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        )
+        self.dict_id: int = self.dictionary.dict_id() if self.dictionary else 0
+        # zstd contexts are not thread-safe, each thread gets its own
+        self._local = threading.local()
+
+    @classmethod
+    def from_file(cls, path: str | None, level: int = 3) -> "ResultCodec":
+        if not path:
+            return cls(level=level)
+        with open(path, "rb") as f:
+            return cls(f.read(), level=level)
+
+    def _contexts(self) -> tuple:
+        contexts = getattr(self._local, "contexts", None)
+        if contexts is None:
+            contexts = (
+                zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary),
+                zstandard.ZstdDecompressor(dict_data=self.dictionary),
+                zstandard.ZstdDecompressor(),
+            )
+            self._local.contexts = contexts
+        return contexts
+
+    def encode(self, data: Any) -> bytes:
+        compressor = self._contexts()[0]
+        return self.VERSION + compressor.compress(msgpack.packb(data))
+
+    def decode(self, raw: bytes | None) -> Any:
+        if not raw or raw[:1] != self.VERSION:
+            return None
+        frame = memoryview(raw)[1:]
+        try:
+            dict_id: int = zstandard.get_frame_parameters(frame).dict_id
+            if dict_id not in (0, self.dict_id):
+                return None
+            _, with_dict, without_dict = self._contexts()
+            decompressor = with_dict if dict_id else without_dict
+            return msgpack.unpackb(decompressor.decompress(frame))
+        except (zstandard.ZstdError, ValueError):
+            logger.exception("Failed to decode cached result")
+            return None
+
+    def encode_entry(self, value: Any, ttl: float) -> bytes:
+        """
+        A cache entry holding value, fresh for ttl seconds.
+        """
+        return self.encode({"soft_expires": time.time() + ttl, "value": value})
+
+    def decode_entry(self, raw: bytes | None) -> tuple | None:
+        """
+        (value, stale) of a cache entry, or None when there is none.
+        """
+        entry = self.decode(raw)
+        if not isinstance(entry, dict) or "soft_expires" not in entry:
+            return None
+        return entry["value"], time.time() > entry["soft_expires"]
+
+
+class EmbeddingCache:
+    """
+    Two-level cache for query embeddings: an in-process LRU in front of Redis,
+    which holds the raw float32 bytes so every gunicorn worker can reuse them.
+    Keys are built from the model name and the normalised query text.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[str], Any],
+        model_name: str,
+        redis_client: Redis | None = None,
+        maxsize: int = 1024,
+        ttl: int = 7 * 24 * 3600,
+    ) -> None:
+        self.encode = encode
+        self.model_name: str = model_name
+        self.redis_client: Redis | None = redis_client
+        self.ttl: int = ttl
+        self.local: LRUCache = LRUCache(maxsize)
+
+        self._lock = threading.Lock()
+        self._stats: dict[str, float] = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "encode_seconds": 0.0,
+        }
+
+    @staticmethod
+    def normalise(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def key(self, text: str) -> str:
+        digest: str = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"embedding:{self.model_name}:{digest}"
+
+    def get(self, text: str) -> np.ndarray:
+        text = self.normalise(text)
+        key: str = self.key(text)
+
+        embedding: np.ndarray | None = self.local.get(key)
+        if embedding is not None:
+            self._count("local_hits")
+            return embedding
+
+        if self.redis_client is not None:
+            try:
+                raw = self.redis_client.get(key)
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to read embedding from redis")
+                raw = None
+            if raw:
+                embedding = np.frombuffer(raw, dtype=np.float32)  # type: ignore
+                self.local.set(key, embedding)
+                self._count("redis_hits")
+                return embedding
+
+        start: float = time.perf_counter()
+        embedding = np.asarray(self.encode(text), dtype=np.float32)
+        elapsed: float = time.perf_counter() - start
+        self._count("misses", encode_seconds=elapsed)
+        logger.debug(f"Encoded query embedding in {elapsed * 1000:.1f} ms")
+
+        self.local.set(key, embedding)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.setex(key, self.ttl, embedding.tobytes())
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to write embedding to redis")
+
+        return embedding
+
+    def _count(self, stat: str, encode_seconds: float = 0.0) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+            self._stats["encode_seconds"] += encode_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats: dict = dict(self._stats)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = (
+            (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else 0.0
+        )
+        stats["avg_encode_ms"] = (
+            stats["encode_seconds"] * 1000 / stats["misses"] if stats["misses"] else 0.0
+        )
+        return stats
+
+
+class IndexGeneration:
+    """
+    Index generation number, a Redis counter that ingestion increments whenever
+    it writes to the index. Cache keys that include it stop matching as soon as
+    new documents land. Re-read at most every `refresh` seconds per process.
+    """
+
+    def __init__(
+        self, index: str, redis_client: Redis | None = None, refresh: float = 5.0
+    ) -> None:
+        self.key: str = f"index_generation:{index}"
+        self.redis_client: Redis | None = redis_client
+        self.refresh: float = refresh
+        self._value: int = 0
+        self._expires: float = 0.0
+
+    def _due(self) -> bool:
+        return self.redis_client is not None and time.monotonic() >= self._expires
+
+    def _store(self, value: Any) -> None:
+        self._value = int(value) if value else 0
+
+    def get(self) -> int:
+        if not self._due():
+            return self._value
+
+        try:
+            self._store(self.redis_client.get(self.key))  # type: ignore
+        except redis.exceptions.RedisError:
+            logger.exception("Failed to read index generation from redis")
+        self._expires = time.monotonic() + self.refresh
+        return self._value
+
+
+class IndexSize:
+    """
+    Document count of the index, shared through Redis and re-read at most every
+    `ttl` seconds per process; `count` asks Elasticsearch when Redis has none or
+    cannot be reached.
+    """
+
+    def __init__(
+        self,
+        index: str,
+        count: Callable[[], Any],
+        redis_client: Redis | None = None,
+        ttl: int = 60,
+    ) -> None:
+        self.key: str = f"index_size:{index}"
+        self.count = count
+        self.redis_client: Redis | None = redis_client
+        self.ttl: int = ttl
+        self._value: int = 0
+        self._expires: float = 0.0
+
+    def _fresh(self) -> bool:
+        return time.monotonic() < self._expires
+
+    def _store(self, size: int) -> int:
+        self._value = size
+        self._expires = time.monotonic() + self.ttl
+        return size
+
+    def clear(self) -> None:
+        self._expires = 0.0
+
+    def get(self) -> int:
+        if self._fresh():
+            return self._value
+
+        cached = None
+        if self.redis_client is not None:
+            try:
+                cached = self.redis_client.get(self.key)
+            except redis.exceptions.RedisError:
+                logger.warning("Failed to read index size from redis", exc_info=True)
+        if cached is not None:
+            return self._store(int(cached))  # type: ignore
+
+        size: int = int(self.count())
+        if self.redis_client is not None:
+            try:
+                self.redis_client.setex(self.key, self.ttl, size)
+            except redis.exceptions.RedisError:
+                logger.warning("Failed to write index size to redis", exc_info=True)
+        return self._store(size)
+
+
+class PaperCache:
+    """
+    Per-paper cache of serialized (JSON) paper sources: an optional in-process
+    LRU in front of Redis. Keys include the index generation, so papers cached
+    before the last ingestion are never served.
+    """
+
+    def __init__(
+        self,
+        index: str,
+        generation: IndexGeneration,
+        redis_client: Redis | None = None,
+        maxsize: int = 0,
+        ttl: int = 24 * 3600,
+    ) -> None:
+        self.index: str = index
+        self.generation: IndexGeneration = generation
+        self.redis_client: Redis | None = redis_client
+        self.ttl: int = ttl
+        self.local: LRUCache | None = LRUCache(maxsize) if maxsize > 0 else None
+
+    def key(self, paper_id: str, generation: int) -> str:
+        return f"paper:{self.index}:{generation}:{paper_id}"
+
+    def _get_local(self, paper_ids: list[str], generation: int) -> dict[str, str]:
+        found: dict[str, str] = {}
+        if self.local is not None:
+            for paper_id in paper_ids:
+                body = self.local.get(self.key(paper_id, generation))
+                if body is not None:
+                    found[paper_id] = body
+        return found
+
+    def _add_redis(
+        self, found: dict[str, str], misses: list[str], bodies: list, generation: int
+    ) -> None:
+        # bodies read from redis for misses, kept locally too
+        for paper_id, body in zip(misses, bodies):
+            if body:
+                found[paper_id] = body
+                if self.local is not None:
+                    self.local.set(self.key(paper_id, generation), body)
+
+    def _set_local(self, bodies: dict[str, str], generation: int) -> None:
+        if self.local is not None:
+            for paper_id, body in bodies.items():
+                self.local.set(self.key(paper_id, generation), body)
+
+    def get_many(self, paper_ids: list[str]) -> dict[str, str]:
+        """
+        Returns {id: serialized paper} for the ids found in either level.
+        """
+        generation: int = self.generation.get()
+        found: dict[str, str] = self._get_local(paper_ids, generation)
+
+        misses: list[str] = [pid for pid in paper_ids if pid not in found]
+        if misses and self.redis_client is not None:
+            try:
+                bodies: list = self.redis_client.mget(  # type: ignore
+                    [self.key(pid, generation) for pid in misses]
+                )
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to read papers from redis")
+                bodies = []
+            self._add_redis(found, misses, bodies, generation)
+
+        return found
+
+    def get(self, paper_id: str) -> str | None:
+        return self.get_many([paper_id]).get(paper_id)
+
+    def set_many(self, bodies: dict[str, str]) -> None:
+        """
+        Stores {id: serialized paper} in both levels.
+        """
+        if not bodies:
+            return
+        generation: int = self.generation.get()
+        self._set_local(bodies, generation)
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for paper_id, body in bodies.items():
+                    pipe.setex(self.key(paper_id, generation), self.ttl, body)
+                pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to write papers to redis")
+
+
+class AsyncIndexGeneration(IndexGeneration):
+    """
+    IndexGeneration for the async server, read through a redis.asyncio client.
+    """
+
+    async def get(self) -> int:
+        if not self._due():
+            return self._value
+
+        try:
+            self._store(await self.redis_client.get(self.key))
+        except redis.exceptions.RedisError:
+            logger.exception("Failed to read index generation from redis")
+        self._expires = time.monotonic() + self.refresh
+        return self._value
+
+
+class AsyncIndexSize(IndexSize):
+    """
+    IndexSize for the async server: count is a coroutine function and Redis a
+    redis.asyncio client.
+    """
+
+    async def get(self) -> int:
+        if self._fresh():
+            return self._value
+
+        cached = None
+        if self.redis_client is not None:
+            try:
+                cached = await self.redis_client.get(self.key)
+            except redis.exceptions.RedisError:
+                logger.warning("Failed to read index size from redis", exc_info=True)
+        if cached is not None:
+            return self._store(int(cached))
+
+        size: int = int(await self.count())
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.setex(self.key, self.ttl, size)
+            except redis.exceptions.RedisError:
+                logger.warning("Failed to write index size to redis", exc_info=True)
+        return self._store(size)
+
+
+class AsyncPaperCache(PaperCache):
+    """
+    PaperCache for the async server: same keys and values, so both servers share
+    the entries they write, read through a redis.asyncio client.
+    """
+
+    async def get_many(self, paper_ids: list[str]) -> dict[str, str]:
+        generation: int = await self.generation.get()
+        found: dict[str, str] = self._get_local(paper_ids, generation)
+
+        misses: list[str] = [pid for pid in paper_ids if pid not in found]
+        if misses and self.redis_client is not None:
+            try:
+                bodies: list = await self.redis_client.mget(
+                    [self.key(pid, generation) for pid in misses]
+                )
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to read papers from redis")
+                bodies = []
+            self._add_redis(found, misses, bodies, generation)
+
+        return found
+
+    async def get(self, paper_id: str) -> str | None:
+        return (await self.get_many([paper_id])).get(paper_id)
+
+    async def set_many(self, bodies: dict[str, str]) -> None:
+        if not bodies:
+            return
+        generation: int = await self.generation.get()
+        self._set_local(bodies, generation)
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for paper_id, body in bodies.items():
+                    pipe.setex(self.key(paper_id, generation), self.ttl, body)
+                await pipe.execute()
+            except redis.exceptions.RedisError:
+                logger.exception("Failed to write papers to redis")
+
+
+class SingleFlight:
+    """
+    Per-key coalescing of cache misses. Concurrent callers in this process share
+    one Future, and across worker processes a Redis lock lets one of them compute
+    while the others poll `lookup` for the value it writes. refresh() recomputes a
+    key in the background, for stale-while-revalidate.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis | None = None,
+        lock_timeout: float = 30.0,
+        wait: float = 10.0,
+        poll: float = 0.05,
+    ) -> None:
+        self.redis_client: Redis | None = redis_client
+        self.lock_timeout: float = lock_timeout
+        self.wait: float = wait
+        self.poll: float = poll
+        self._inflight: dict[str, Future] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def lock_name(key: str) -> str:
+        return f"lock:{key}"
+
+    def _redis_lock(self, key: str) -> redis.lock.Lock | None:
+        if self.redis_client is None:
+            return None
+        lock = self.redis_client.lock(
+            self.lock_name(key), timeout=self.lock_timeout, blocking=False
+        )
+        try:
+            return lock if lock.acquire() else None
+        except redis.exceptions.RedisError:
+            logger.exception("Failed to take single flight lock")
+            return lock
+
+    def _release(self, lock: redis.lock.Lock | None) -> None:
+        if lock is None:
+            return
+        try:
+            lock.release()
+        except (redis.exceptions.LockError, redis.exceptions.RedisError):
+            # expired while computing, someone else may hold it now
+            pass
+
+    def do(
+        self, key: str, compute: Callable[[], Any], lookup: Callable[[], Any]
+    ) -> Any:
+        with self._lock:
+            future: Future | None = self._inflight.get(key)
+            leader: bool = future is None
+            if future is None:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._compute_once(key, compute, lookup)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def _compute_once(
+        self, key: str, compute: Callable[[], Any], lookup: Callable[[], Any]
+    ) -> Any:
+        lock = self._redis_lock(key)
+        if lock is not None or self.redis_client is None:
+            try:
+                return compute()
+            finally:
+                self._release(lock)
+
+        # another worker is computing it: wait for its value, or for its lock to
+        # go away without one (failed or uncacheable), then compute here
+        deadline: float = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll)
+            try:
+                released: bool = not self.redis_client.exists(self.lock_name(key))
+            except redis.exceptions.RedisError:
+                break
+            value = lookup()
+            if value is not None:
+                return value
+            if released:
+                break
+        return compute()
+
+    def refresh(self, key: str, compute: Callable[[], Any]) -> None:
+        """
+        Recomputes key in a background thread, unless it is already being
+        refreshed in this process or another.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run() -> None:
+            try:
+                lock = self._redis_lock(key)
+                if lock is None and self.redis_client is not None:
+                    return
+                try:
+                    compute()
+                finally:
+                    self._release(lock)
+            except Exception:
+                logger.exception("Background refresh failed")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for the async server: asyncio futures within the worker and a
+    redis.asyncio lock across workers.
+    """
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis | None = None,
+        lock_timeout: float = 30.0,
+        wait: float = 10.0,
+        poll: float = 0.05,
+    ) -> None:
+        super().__init__(None, lock_timeout, wait, poll)
+        self.redis_client = redis_client
+        self._inflight: dict[str, asyncio.Future] = {}
+        # keeps background refreshes referenced until they finish
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _redis_lock(self, key: str) -> Any:
+        if self.redis_client is None:
+            return None
+        lock = self.redis_client.lock(
+            self.lock_name(key), timeout=self.lock_timeout, blocking=False
+        )
+        try:
+            return lock if await lock.acquire() else None
+        except redis.exceptions.RedisError:
+            logger.exception("Failed to take single flight lock")
+            return lock
+
+    async def _release(self, lock: Any) -> None:
+        if lock is None:
+            return
+        try:
+            await lock.release()
+        except (redis.exceptions.LockError, redis.exceptions.RedisError):
+            pass
+
+    async def do(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        future: asyncio.Future | None = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._compute_once(key, compute, lookup)
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here so an exception nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    async def _compute_once(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        lock = await self._redis_lock(key)
+        if lock is not None or self.redis_client is None:
+            try:
+                return await compute()
+            finally:
+                await self._release(lock)
+
+        deadline: float = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll)
+            try:
+                released: bool = not await self.redis_client.exists(self.lock_name(key))
+            except redis.exceptions.RedisError:
+                break
+            value = await lookup()
+            if value is not None:
+                return value
+            if released:
+                break
+        return await compute()
+
+    def refresh(self, key: str, compute: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def run() -> None:
+            try:
+                lock = await self._redis_lock(key)
+                if lock is None and self.redis_client is not None:
+                    return
+                try:
+                    await compute()
+                finally:
+                    await self._release(lock)
+            except Exception:
+                logger.exception("Background refresh failed")
+            finally:
+                self._refreshing.discard(key)
+
+        # started in an empty context: a copy of the request's would have the
+        # refresh time and profile itself into a request that has already finished
+        task: asyncio.Task = contextvars.Context().run(
+            asyncio.get_running_loop().create_task, run()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
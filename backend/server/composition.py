@@ -0,0 +1,125 @@
+import math
+import re
+from fractions import Fraction
+
+# Chemical element symbols, used to tell element lists ("Fe O") from formulas ("FeO")
+ELEMENT_SYMBOLS: str = """
+    H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu
+    Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs
+    Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl
+    Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh
+    Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og
+"""
+ELEMENTS: frozenset[str] = frozenset(ELEMENT_SYMBOLS.split())
+
+FORMULA_FIELD: str = "MAT_formula"
+ELEMENTS_FIELD: str = "MAT_elements"
+
+# pymatgen's Composition.special_formulas (diatomic gases and peroxides), which
+# its reduced formulas, and so the indexed MAT formulas, are written as.
+# Alphabetized like canonical_formula's output.
+SPECIAL_FORMULAS: dict[str, str] = {
+    "LiO": "Li2O2",
+    "NaO": "Na2O2",
+    "KO": "K2O2",
+    "HO": "H2O2",
+    "CsO": "Cs2O2",
+    "ORb": "O2Rb2",
+    "O": "O2",
+    "N": "N2",
+    "F": "F2",
+    "Cl": "Cl2",
+    "H": "H2",
+}
+
+_token = re.compile(r"([A-Z][a-z]?)(\d+(?:\.\d+)?)?|(\()|(\))(\d+(?:\.\d+)?)?")
+
+
+def parse_formula(formula: str) -> dict[str, Fraction] | None:
+    """
+    Parses a formula such as Li2(FePO4)2 into element amounts, None if invalid.
+    """
+    stack: list[dict[str, Fraction]] = [{}]
+    pos = 0
+    formula = formula.replace("[", "(").replace("]", ")").replace(" ", "")
+    if not formula:
+        return None
+
+    for match in _token.finditer(formula):
+        if match.start() != pos:
+            return None
+        pos = match.end()
+
+        element, amount, opening, closing, factor = match.groups()
+        if element:
+            if element not in ELEMENTS:
+                return None
+            current = stack[-1]
+            current[element] = current.get(element, Fraction(0)) + Fraction(
+                amount or "1"
+            )
+        elif opening:
+            stack.append({})
+        elif closing:
+            if len(stack) == 1:
+                return None
+            group = stack.pop()
+            multiplier = Fraction(factor or "1")
+            for el, amt in group.items():
+                stack[-1][el] = stack[-1].get(el, Fraction(0)) + amt * multiplier
+
+    if pos != len(formula) or len(stack) != 1 or not stack[0]:
+        return None
+    if any(amount <= 0 for amount in stack[0].values()):
+        return None
+
+    return stack[0]
+
+
+def canonical_formula(formula: str) -> str | None:
+    """
+    Reduced, alphabetized formula in the same form as the ingestion side's
+    SimpleParser.matgen_parser, e.g. "SrTiO3" -> "O3SrTi", "Fe4O6" -> "Fe2O3",
+    "H2O2" -> "H2O2" (not "HO", see SPECIAL_FORMULAS).
+    """
+    amounts = parse_formula(formula)
+    if amounts is None:
+        return None
+
+    denominator = math.lcm(*(amount.denominator for amount in amounts.values()))
+    integers = {el: int(amount * denominator) for el, amount in amounts.items()}
+    divisor = math.gcd(*integers.values())
+
+    tokens = [
+        f"{el}{count // divisor if count // divisor != 1 else ''}"
+        for el, count in integers.items()
+    ]
+    reduced = "".join(sorted(tokens))
+    return SPECIAL_FORMULAS.get(reduced, reduced)
+
+
+def parse_element_list(term: str) -> list[str] | None:
+    """
+    "Fe O", "Fe, O" or "Fe-O" -> ["Fe", "O"]; None if term is not a list of elements.
+    """
+    parts = [part for part in re.split(r"[\s,;+\-]+", term.strip()) if part]
+    if not parts or any(part not in ELEMENTS for part in parts):
+        return None
+    return sorted(set(parts))
+
+
+def composition_clause(term: str) -> dict | None:
+    """
+    Builds the term-level filter for a "composition" search:
+    - a list of element symbols matches papers whose materials contain all of them
+    - a formula matches papers mentioning exactly that (normalized) material
+    """
+    elements = parse_element_list(term)
+    if elements is not None:
+        return {"bool": {"filter": [{"term": {ELEMENTS_FIELD: el}} for el in elements]}}
+
+    formula = canonical_formula(term)
+    if formula is not None:
+        return {"term": {FORMULA_FIELD: formula}}
+
+    return None
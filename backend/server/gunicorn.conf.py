@@ -0,0 +1,10 @@
+# read by gunicorn from the working directory (see start.sh)
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker) -> None:
+    # drops the live metrics of workers that exited, see metrics.py
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
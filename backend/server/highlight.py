@@ -0,0 +1,222 @@
+import re
+from bisect import bisect_left
+
+from rapidfuzz import fuzz, process
+
+# fields of a paper that get highlighted
+FIELDS_TO_HIGHLIGHT: list[str] = [
+    "summary",
+    "title",
+    "authors",
+    "APL",
+    "CMT",
+    "DSC",
+    "MAT",
+    "PRO",
+    "PVL",
+    "PUT",
+    "SMT",
+    "SPL",
+]
+
+# words, split the same way for text and terms (and roughly like Elasticsearch's
+# standard analyzer, so highlights line up with what the query matched)
+WORD = re.compile(r"\w+")
+
+
+def find_matches(
+    text: str, terms: list[str], similarity_threshold: int = 80
+) -> list[tuple[int, int]]:
+    """
+    Returns the non-overlapping (start, end) offsets in text that fuzzily match
+    one of terms. Candidates are runs of as many whole words as the term has,
+    scored against the term in one vectorised rapidfuzz call per term; on overlap
+    the highest scoring (then leftmost) candidate wins.
+    """
+    if not isinstance(text, str) or not terms:
+        return []
+
+    spans: list[tuple[int, int]] = [m.span() for m in WORD.finditer(text)]
+    if not spans:
+        return []
+    text_lower: str = text.lower()
+
+    candidates: list[tuple[float, int, int]] = []
+    for term in terms:
+        term_lower: str = term.lower()
+        width: int = max(len(WORD.findall(term_lower)), 1)
+        if width > len(spans):
+            continue
+
+        windows: list[tuple[int, int]] = [
+            (spans[i][0], spans[i + width - 1][1])
+            for i in range(len(spans) - width + 1)
+        ]
+        scores = process.cdist(
+            [term_lower],
+            [text_lower[start:end] for start, end in windows],
+            scorer=fuzz.ratio,
+            score_cutoff=similarity_threshold,
+        )[0]
+        for idx in scores.nonzero()[0]:
+            start, end = windows[idx]
+            candidates.append((float(scores[idx]), start, end))
+
+    # best candidates first; accepted matches are disjoint, so keeping their
+    # starts sorted lets every overlap check look at two neighbours only
+    candidates.sort(key=lambda c: (-c[0], c[1]))
+    starts: list[int] = []
+    ends: list[int] = []
+    for _, start, end in candidates:
+        pos: int = bisect_left(starts, start)
+        if pos > 0 and ends[pos - 1] > start:
+            continue
+        if pos < len(starts) and starts[pos] < end:
+            continue
+        starts.insert(pos, start)
+        ends.insert(pos, end)
+
+    return list(zip(starts, ends))
+
+
+def mark(text: str, matches: list[tuple[int, int]]) -> str:
+    result: list[str] = []
+    last_end: int = 0
+    for start, end in matches:
+        result.append(text[last_end:start])
+        result.append(f"<mark>{text[start:end]}</mark>")
+        last_end = end
+    result.append(text[last_end:])
+    return "".join(result)
+
+
+def apply_fuzzy_mark_tags(text, terms, similarity_threshold):
+    if not isinstance(text, str):
+        return text
+
+    return mark(text, find_matches(text, terms, similarity_threshold))
+
+
+def apply_highlight_markup(
+    source,
+    highlighted_terms,
+    fields_to_highlight,
+    similarity_threshold: int = 80,
+):
+    for field in fields_to_highlight:
+        if field in highlighted_terms:
+            highlight_values = highlighted_terms[field]
+
+            if isinstance(source.get(field), list):
+                source[field] = [
+                    apply_fuzzy_mark_tags(item, highlight_values, similarity_threshold)
+                    for item in source[field]
+                ]
+            elif isinstance(source.get(field), str):
+                source[field] = apply_fuzzy_mark_tags(
+                    source[field], highlight_values, similarity_threshold
+                )
+
+    return source
+
+
+def highlight_offsets(
+    source: dict,
+    highlighted_terms: dict,
+    fields_to_highlight: list[str],
+    similarity_threshold: int = 80,
+) -> dict:
+    """
+    Like apply_highlight_markup, but leaves source untouched and returns the match
+    offsets instead: {field: [[start, end], ...]} for string fields and
+    {field: [[[start, end], ...], ...]} (one list per item) for list fields.
+    """
+    offsets: dict = {}
+    for field in fields_to_highlight:
+        if field not in highlighted_terms:
+            continue
+        highlight_values = highlighted_terms[field]
+        value = source.get(field)
+
+        if isinstance(value, list):
+            item_offsets = [
+                [
+                    list(m)
+                    for m in find_matches(item, highlight_values, similarity_threshold)
+                ]
+                for item in value
+            ]
+            if any(item_offsets):
+                offsets[field] = item_offsets
+        elif isinstance(value, str):
+            matches = find_matches(value, highlight_values, similarity_threshold)
+            if matches:
+                offsets[field] = [list(m) for m in matches]
+
+    return offsets
+
+
+def es_highlight(to_highlight: dict) -> dict | None:
+    """
+    Elasticsearch "highlight" section covering the highlighted fields that were
+    searched. number_of_fragments=0 returns whole field values, so they can
+    replace the originals; the fuzzy match clauses of the query make the
+    highlighting fuzzy-aware.
+    """
+    fields: dict = {
+        field: {"number_of_fragments": 0}
+        for field in FIELDS_TO_HIGHLIGHT
+        if field in to_highlight
+    }
+
+    if not fields:
+        return None
+
+    return {
+        "pre_tags": ["<mark>"],
+        "post_tags": ["</mark>"],
+        "require_field_match": True,
+        "fields": fields,
+    }
+
+
+def merge_es_highlight(source: dict, highlight: dict) -> dict:
+    """
+    Replaces the fields of source with the highlighted values Elasticsearch
+    returned for a hit. For list fields only the values that matched come back,
+    so they are put in place of the items they were made from.
+    """
+    for field, values in highlight.items():
+        if isinstance(source.get(field), list):
+            marked: dict = {
+                value.replace("<mark>", "").replace("</mark>", ""): value
+                for value in values
+            }
+            source[field] = [
+                marked.get(item, item) if isinstance(item, str) else item
+                for item in source[field]
+            ]
+        elif isinstance(source.get(field), str) and values:
+            source[field] = values[0]
+
+    return source
+
+
+def highlight_source(
+    source: dict, to_highlight: dict, highlight_mode: str, hit: dict, es_highlight: bool
+) -> dict:
+    """
+    Highlights one hit's source for the requested mode. es_highlight says whether
+    Elasticsearch was asked for highlights; hits without them fall back to python.
+    """
+    # offsets mode sends match positions instead of rewriting fields with <mark> tags
+    if highlight_mode == "offsets":
+        source["highlights"] = highlight_offsets(
+            source, to_highlight, FIELDS_TO_HIGHLIGHT
+        )
+        return source
+
+    if es_highlight and "highlight" in hit:
+        return merge_es_highlight(source, hit["highlight"])
+
+    return apply_highlight_markup(source, to_highlight, FIELDS_TO_HIGHLIGHT)
@@ -0,0 +1,134 @@
+"""
+Request metrics: per stage timers reported in a Server-Timing header and, with
+cache lookups and Elasticsearch errors, as Prometheus metrics on /api/metrics.
+
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR (start.sh does) so
+/api/metrics reports the metrics of every worker, not just the one answering.
+"""
+
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from cache import CacheStats
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# seconds, from an L1 hit to a deep vector search
+BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REQUEST_SECONDS: Histogram = Histogram(
+    "request_seconds", "Request latency", ["endpoint", "status"], buckets=BUCKETS
+)
+STAGE_SECONDS: Histogram = Histogram(
+    "stage_seconds", "Time spent in each stage of a request", ["stage"], buckets=BUCKETS
+)
+CACHE_LOOKUPS: Counter = Counter(
+    "cache_lookups", "Cache lookups by outcome", ["cache", "result"]
+)
+ES_ERRORS: Counter = Counter(
+    "es_errors", "Failed Elasticsearch calls", ["stage", "error"]
+)
+
+# stage -> seconds of the request being handled, None outside of one (e.g. in a
+# background refresh, whose stages only go to STAGE_SECONDS)
+_timings: ContextVar[dict[str, float] | None] = ContextVar("timings", default=None)
+
+
+def start_request() -> None:
+    _timings.set({})
+
+
+def request_timings() -> dict[str, float]:
+    return _timings.get() or {}
+
+
+@contextmanager
+def timed(stage: str, es: bool = False) -> Iterator[None]:
+    """
+    Times the block as `stage`, adding up repeated stages of a request. With es
+    set, exceptions raised by the block are counted as Elasticsearch errors.
+    """
+    start: float = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if es:
+            ES_ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        elapsed: float = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings: dict[str, float] | None = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def server_timing(total: float) -> str:
+    """
+    Server-Timing header value of the request's stages and its total, in ms.
+    """
+    metrics: list[str] = [
+        f"{stage};dur={seconds * 1000:.2f}"
+        for stage, seconds in request_timings().items()
+    ]
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+def observe_request(endpoint: str | None, status: int, total: float) -> None:
+    REQUEST_SECONDS.labels(endpoint or "unknown", str(status)).observe(total)
+
+
+def count_lookup(cache: str, result: str) -> None:
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+class CountedStats(CacheStats):
+    """
+    CacheStats that also counts its lookups in CACHE_LOOKUPS as `cache`.
+    """
+
+    def __init__(self, cache: str, *names: str) -> None:
+        super().__init__(*names)
+        self.cache: str = cache
+
+    def count(self, name: str) -> None:
+        super().count(name)
+        count_lookup(self.cache, name)
+
+
+def render() -> tuple[bytes, str]:
+    """
+    The metrics in the Prometheus text format, and its content type.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry: CollectorRegistry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,433 @@
+"""
+The search pipeline behind /api/papers and /api/papers/export, shared by
+server.py (Flask) and async_server.py (Starlette): the Elasticsearch bodies a
+request sends, how their responses become result windows, and how pages and
+responses are put together from a window. Nothing here does I/O, each server
+runs the searches and cache reads and writes these ask for, sync or async.
+"""
+
+import hashlib
+import json
+
+from highlight import es_highlight, highlight_source
+from profiling import profiling
+from search import (
+    bool_expression_to_dict,
+    date_window_body,
+    handle_bool_searching,
+    is_date_sorted,
+    parse_request,
+    pit_sort,
+    req_validation,
+    vector_match_query,
+)
+
+# dense vectors only used by knn, never returned to the client (~8 KB of JSON each)
+EMBEDDING_FIELDS: list[str] = ["summary_embedding", "title_embedding"]
+
+MAX_RESULT_WINDOW: int = 10000  # Elasticsearch's index.max_result_window default
+WINDOW_CACHE_TTL: int = 24 * 3600
+PAGE_CACHE_TTL: int = 24 * 3600
+# queries and pages without hits are cached too, for less time in case papers
+# reach the index without an index generation bump
+NEGATIVE_CACHE_TTL: int = 3600
+# entries are fresh for their ttl, then kept CACHE_STALE_TTL longer so a page can
+# be served stale while it is refreshed in the background
+CACHE_STALE_TTL: int = 3600
+
+PAPER_CACHE_TTL: int = 7 * 24 * 3600
+MAX_BATCH_IDS: int = 200
+
+# export reads every hit of a search from a point in time (PIT) with search_after
+PIT_KEEP_ALIVE: str = "5m"
+PIT_BATCH_SIZE: int = 1000
+
+
+class SearchPlan:
+    """
+    How a valid search is run: kind is "vector", "date" (date sorted, read in
+    segments, see DateSegment) or "regular". quer is the bool query, highlight_quer the query
+    papers are highlighted with (for vector searches, quer with the vector term as
+    a fuzzy match, which also gives the approximate total).
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        quer: dict,
+        highlight_quer: dict,
+        sort: str,
+        vector_field: str | None = None,
+        vector_query: str | None = None,
+    ) -> None:
+        self.kind: str = kind
+        self.quer: dict = quer
+        self.highlight_quer: dict = highlight_quer
+        self.sort: str = sort
+        self.vector_field: str | None = vector_field
+        self.vector_query: str | None = vector_query
+
+
+def plan_search(
+    searches: list, start_date: int, end_date: int, sorting: str, sort: str
+) -> SearchPlan | None:
+    """
+    The SearchPlan of a request's searches, None when they are invalid.
+    """
+    all_query, quer, vector_field, vector_query = handle_bool_searching(
+        searches, start_date, end_date, sorting
+    )
+    if all_query is None or quer is None:
+        return None
+
+    if vector_field is None or vector_query is None or all_query:
+        kind: str = "date" if is_date_sorted(sorting) else "regular"
+        return SearchPlan(kind, quer, quer, sort)
+
+    highlight_quer: dict = vector_match_query(quer, vector_field, vector_query)
+    return SearchPlan("vector", quer, highlight_quer, sort, vector_field, vector_query)
+
+
+def window_hit(window: dict | None, depth: int, target: int) -> bool:
+    """
+    Whether a cached window already holds the ids of a page reaching depth.
+    """
+    return window is not None and (
+        window["complete"] or len(window["ids"]) >= min(depth, target)
+    )
+
+
+def window_ttl(window: dict) -> int:
+    return WINDOW_CACHE_TTL if window["ids"] else NEGATIVE_CACHE_TTL
+
+
+def knn_bodies(
+    plan: SearchPlan, query_vector: list[float], index_size: int, target: int
+) -> tuple[dict, dict]:
+    """
+    The knn search of a vector window and the fuzzy query only used to see
+    apprx how many papers to display, sent together in one _msearch. The knn
+    results are re-ranked as a whole, so a window is always fetched from the top.
+    """
+    # queries done based on size of index
+    size: int = max(index_size, target)
+    knn_body: dict = {
+        "knn": {
+            "field": plan.vector_field,
+            "query_vector": query_vector,
+            "num_candidates": min(size, 10000),  # not sure if should be lower or not
+            "k": target,
+        },
+        "query": plan.quer,
+        "size": target,
+        "sort": [{"_score": {"order": plan.sort}}],
+        "track_total_hits": False,
+        "_source": False,
+    }
+    total_body: dict = {"query": plan.highlight_quer, "size": 0}
+    if profiling():
+        knn_body["profile"] = total_body["profile"] = True
+    return knn_body, total_body
+
+
+def vector_window(
+    knn_response: dict, total_response: dict, index_size: int, target: int
+) -> dict:
+    ids: list[str] = [hit["_id"] for hit in knn_response["hits"]["hits"]]
+    inflated: int = -1
+    total: int = total_response["hits"]["total"]["value"]
+
+    # if small total, set inflated to be papers found and total is 100 default
+    if total < 100 and max(index_size, target) >= 100:
+        inflated = total
+        total = 100
+
+    return {
+        "ids": ids,
+        "total": total,
+        "inflated": inflated,
+        "complete": len(ids) < target,
+    }
+
+
+def regular_window_body(quer: dict, window: dict | None, target: int) -> dict:
+    """
+    Search body for the ids of a relevance sorted window after the ones it has.
+    """
+    offset: int = len(window["ids"]) if window else 0
+    body: dict = {
+        "query": quer,
+        "size": target - offset,
+        "from": offset,
+        "_source": False,
+    }
+    if profiling():
+        body["profile"] = True
+    return body
+
+
+def regular_window(window: dict | None, results: dict, target: int) -> dict:
+    ids: list[str] = window["ids"] if window else []
+    new_ids: list[str] = [hit["_id"] for hit in results["hits"]["hits"]]
+    return {
+        "ids": ids + new_ids,
+        "total": results["hits"]["total"]["value"],
+        "inflated": -1,
+        "complete": len(new_ids) < target - len(ids),
+    }
+
+
+def date_segments(page: int, num_results: int, size: int) -> range:
+    """
+    The segments of a date sorted ranking (size ids each) a page's ids are in.
+    """
+    start: int = (page - 1) * num_results
+    return range(start // size, (start + num_results - 1) // size + 1)
+
+
+def date_segment_key(window_key: str, segment: int) -> str:
+    return f"{window_key}:{segment}"
+
+
+class DateSegment:
+    """
+    Reads one segment of a date sorted ranking, the size ids from segment * size
+    on. Segments are cached under their own keys with the sort values of their
+    last paper ("search_after"), so the segment after a cached one is a single
+    search from there and a page only reads and decodes the segments its ids are
+    in, whatever its depth. Without the previous segment, segments within
+    MAX_RESULT_WINDOW are read with from, deeper ones after walking the ranking
+    with search_after MAX_RESULT_WINDOW ids at a time. Until done, the caller
+    runs next_body() and hands the response to add(); window() is the segment.
+    """
+
+    def __init__(
+        self, segment: int, size: int, quer: dict, sort: str, previous: dict | None
+    ) -> None:
+        self.start: int = segment * size
+        self.size: int = size
+        self.quer: dict = quer
+        self.sort: str = sort
+        self.ids: list[str] = []
+        self.total: int | None = None
+        self.complete: bool = False
+        self.read: bool = False
+        # position in the ranking search_after reads on from
+        self.position: int = 0
+        self.search_after: list | None = None
+        self.offset: int = 0
+        self._size: int = 0
+
+        if previous is not None:
+            self.total = previous["total"]
+            self.complete = previous["complete"]
+            self.position = self.start
+            self.search_after = previous["search_after"]
+        elif self.start + size <= MAX_RESULT_WINDOW:
+            self.position = self.offset = self.start
+
+    @property
+    def done(self) -> bool:
+        return self.complete or self.read
+
+    def next_body(self) -> dict:
+        self._size = min(self.start - self.position, MAX_RESULT_WINDOW) or self.size
+        # the total is only counted (up to 10000) when the previous segment did
+        # not have it
+        body: dict = date_window_body(
+            self.quer, self.sort, self._size, self.search_after, self.total is None
+        )
+        if self.offset:
+            body["from"] = self.offset
+        if profiling():
+            body["profile"] = True
+        return body
+
+    def add(self, results: dict) -> None:
+        hits: list[dict] = results["hits"]["hits"]
+        if hits:
+            self.search_after = hits[-1]["sort"]
+        if "total" in results["hits"]:
+            self.total = results["hits"]["total"]["value"]
+        self.complete = len(hits) < self._size
+
+        if self.position < self.start:
+            # walking on towards the segment, which is empty if the ranking ends
+            self.position += len(hits)
+        else:
+            self.ids = [hit["_id"] for hit in hits]
+            self.read = True
+
+    def window(self) -> dict:
+        return {
+            "ids": self.ids,
+            "total": self.total or 0,
+            "inflated": -1,
+            "complete": self.complete,
+            "search_after": self.search_after,
+        }
+
+
+def join_segments(segments: list[dict], first: int, size: int) -> dict:
+    """
+    The window of consecutive date sorted segments from segment first on, for
+    page_ids.
+    """
+    return {
+        "ids": [pid for segment in segments for pid in segment["ids"]],
+        "total": segments[0]["total"],
+        "inflated": -1,
+        "offset": first * size,
+    }
+
+
+def page_ids(window: dict, page: int, num_results: int) -> list[str]:
+    # windows of date sorted segments start at their first segment's offset
+    start: int = (page - 1) * num_results - window.get("offset", 0)
+    return window["ids"][start : start + num_results]
+
+
+def use_es_highlight(highlight_engine: str, highlight_mode: str) -> bool:
+    return highlight_engine == "elasticsearch" and highlight_mode == "markup"
+
+
+def highlight_search_body(page_ids: list[str], highlight_quer: dict) -> dict:
+    """
+    ES highlighting needs a search; the ids query fetches exactly the page and
+    highlight_query carries the terms to mark.
+    """
+    body: dict = {
+        "query": {"ids": {"values": page_ids}},
+        "size": len(page_ids),
+        "_source": {"excludes": EMBEDDING_FIELDS},
+    }
+    highlight: dict | None = es_highlight(bool_expression_to_dict(highlight_quer))
+    if highlight is not None:
+        highlight["highlight_query"] = highlight_quer
+        body["highlight"] = highlight
+    return body
+
+
+def source_bodies(hits: list[dict]) -> dict[str, str]:
+    """
+    {id: serialized paper} of search hits or found mget docs, for the paper cache.
+    """
+    return {
+        hit["_id"]: json.dumps(hit["_source"]) for hit in hits if hit.get("found", True)
+    }
+
+
+def hits_by_id(bodies: dict[str, str]) -> dict[str, dict]:
+    """
+    Serialized papers in the shape of search hits, for highlight_page.
+    """
+    return {pid: {"_source": json.loads(body)} for pid, body in bodies.items()}
+
+
+def highlight_page(
+    page_ids: list[str],
+    by_id: dict[str, dict],
+    highlight_quer: dict,
+    highlight_mode: str,
+    es_highlighted: bool,
+) -> list[dict]:
+    """
+    The papers of a page, in order, highlighted. Ids without a hit (no longer in
+    the index) are left out.
+    """
+    to_highlight: dict = bool_expression_to_dict(highlight_quer)
+    filtered_papers: list[dict] = []
+    for paper_id in page_ids:
+        hit: dict | None = by_id.get(paper_id)
+        if hit is None:
+            continue
+
+        filtered_papers.append(
+            highlight_source(
+                hit["_source"], to_highlight, highlight_mode, hit, es_highlighted
+            )
+        )
+
+    return filtered_papers
+
+
+def page_body(result: tuple, profile: list[dict] | None = None) -> dict:
+    body: dict = {"papers": result[0], "total": result[1], "inflated": result[2]}
+    if profile is not None:
+        body["profile"] = profile
+    return body
+
+
+def paper_etag(body: str) -> str:
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def batch_ids(data) -> list[str] | None:
+    """
+    The distinct ids of a /api/papers/batch body, in order, or None when it is
+    invalid.
+    """
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if (
+        not isinstance(ids, list)
+        or not all(isinstance(pid, str) for pid in ids)
+        or len(ids) > MAX_BATCH_IDS
+    ):
+        return None
+    return list(dict.fromkeys(ids))
+
+
+def batch_body(paper_ids: list[str], found: dict[str, str]) -> dict:
+    return {
+        "papers": [json.loads(found[pid]) for pid in paper_ids if pid in found],
+        "missing": [pid for pid in paper_ids if pid not in found],
+    }
+
+
+def plan_export(data: dict) -> SearchPlan | None:
+    """
+    The SearchPlan of an export, which takes the same body as /api/papers (page
+    and results are ignored), or None when it is invalid.
+    """
+    _, _, sorting, start_date, end_date, searches, _ = parse_request(data)
+    sort: str | None = req_validation(1, 10, sorting)
+    if sort is None:
+        return None
+    return plan_search(searches, start_date, end_date, sorting, sort)
+
+
+def pit_body(plan: SearchPlan, cursor: dict, batch_size: int = PIT_BATCH_SIZE) -> dict:
+    """
+    Search body for the batch of an export after the cursor's position (PIT id
+    and search_after values).
+    """
+    body: dict = {
+        "query": plan.quer,
+        "pit": {"id": cursor["pit_id"], "keep_alive": PIT_KEEP_ALIVE},
+        "sort": (
+            pit_sort(plan.sort)
+            if plan.kind == "date"
+            else [{"_score": {"order": "desc"}}, {"_shard_doc": {"order": "asc"}}]
+        ),
+        "size": batch_size,
+        "_source": {"excludes": EMBEDDING_FIELDS},
+        "track_total_hits": False,
+    }
+    if cursor["search_after"] is not None:
+        body["search_after"] = cursor["search_after"]
+    return body
+
+
+def advance_pit(cursor: dict, results: dict) -> list[dict]:
+    """
+    Moves the cursor past a batch and returns its hits.
+    """
+    hits: list[dict] = results["hits"]["hits"]
+    cursor["pit_id"] = results.get("pit_id", cursor["pit_id"])
+    if hits:
+        cursor["search_after"] = hits[-1]["sort"]
+    return hits
+
+
+def ndjson(hits: list[dict]) -> str:
+    return "".join(json.dumps(hit["_source"]) + "\n" for hit in hits)
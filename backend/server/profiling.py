@@ -0,0 +1,160 @@
+"""
+Elasticsearch query profiling and the slow query log.
+
+Admins (ADMIN_TOKEN) can send /api/papers with an X-Profile header holding the
+token (never a query parameter, which would land in the access log): the
+request skips the caches, its searches run with "profile": true and the response
+gets a "profile" list with the per-clause timings of each search, condensed by
+condense_profile.
+
+The bodies of the searches a request sends are noted either way, so requests
+slower than SLOW_QUERY_MS can be written to the slow query log with them.
+"""
+
+import hmac
+import time
+from contextvars import ContextVar
+
+# {"profile": bool, "searches": [...]} of the request being handled, None outside
+# of one (e.g. in a background refresh)
+_request: ContextVar[dict | None] = ContextVar("profiling", default=None)
+
+
+def is_admin(token: str | None, admin_token: str | None) -> bool:
+    if not token or not admin_token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), admin_token.encode("utf-8"))
+
+
+def track_searches(profile: bool = False) -> None:
+    _request.set({"profile": profile, "searches": []})
+
+
+def profiling() -> bool:
+    state: dict | None = _request.get()
+    return state is not None and state["profile"]
+
+
+def note_search(stage: str, body: dict, response: dict) -> None:
+    """
+    Notes a search sent for the request: its body, how long Elasticsearch took
+    and, when profiling, its condensed profile.
+    """
+    state: dict | None = _request.get()
+    if state is None:
+        return
+    search: dict = {"stage": stage, "body": body, "took": response.get("took")}
+    if "profile" in response:
+        search["profile"] = condense_profile(response["profile"])
+    state["searches"].append(search)
+
+
+def request_searches() -> list[dict]:
+    state: dict | None = _request.get()
+    return state["searches"] if state is not None else []
+
+
+def request_profile() -> list[dict]:
+    """
+    The condensed profile of every search, without the bodies.
+    """
+    return [
+        {field: value for field, value in search.items() if field != "body"}
+        for search in request_searches()
+        if "profile" in search
+    ]
+
+
+def slow_query_entry(
+    body: dict | None,
+    latency_ms: float,
+    cache: str | None,
+    status: int,
+    timings: dict[str, float],
+) -> dict:
+    """
+    Slow query log entry: the request, its stage timings in ms and the searches
+    it sent.
+    """
+    return {
+        "ts": round(time.time(), 3),
+        "latency_ms": round(latency_ms, 2),
+        "cache": cache,
+        "status": status,
+        "request": body,
+        "timings": {
+            stage: round(seconds * 1000, 2) for stage, seconds in timings.items()
+        },
+        "searches": request_searches(),
+    }
+
+
+def loggable_knn(knn: dict) -> dict:
+    # query vectors are hundreds of floats and say nothing about the query
+    return {**knn, "query_vector": f"<{len(knn['query_vector'])} dims>"}
+
+
+def _nanos_ms(nanos: int) -> float:
+    return round(nanos / 1e6, 3)
+
+
+def _flatten(
+    queries: list[dict], depth: int, clauses: dict[tuple, dict], shard: str
+) -> None:
+    for query in queries:
+        key: tuple = (depth, query.get("type"), query.get("description"))
+        clause: dict = clauses.setdefault(
+            key,
+            {
+                "depth": depth,
+                "type": query.get("type"),
+                "description": query.get("description"),
+                "time_ms": 0.0,
+                "max_shard_ms": 0.0,
+                "max_shard": None,
+            },
+        )
+        time_ms: float = _nanos_ms(query.get("time_in_nanos", 0))
+        clause["time_ms"] = round(clause["time_ms"] + time_ms, 3)
+        if time_ms >= clause["max_shard_ms"]:
+            clause["max_shard_ms"] = time_ms
+            clause["max_shard"] = shard
+        _flatten(query.get("children", []), depth + 1, clauses, shard)
+
+
+def condense_profile(profile: dict) -> dict:
+    """
+    Reduces an Elasticsearch search profile to its query clauses, in tree order
+    with their depth, each with its time summed over the shards and the slowest
+    shard, plus the rewrite and collector times and the kNN (dfs) phase.
+    """
+    shards: list[dict] = profile.get("shards", [])
+    clauses: dict[tuple, dict] = {}
+    knn: dict[tuple, dict] = {}
+    rewrite_nanos: int = 0
+    collector_nanos: int = 0
+    vector_operations: int = 0
+    for shard in shards:
+        shard_id: str = str(shard.get("id"))
+        for search in shard.get("searches", []):
+            _flatten(search.get("query", []), 0, clauses, shard_id)
+            rewrite_nanos += search.get("rewrite_time", 0)
+            collector_nanos += sum(
+                collector.get("time_in_nanos", 0)
+                for collector in search.get("collector", [])
+            )
+        for knn_search in shard.get("dfs", {}).get("knn", []):
+            _flatten(knn_search.get("query", []), 0, knn, shard_id)
+            rewrite_nanos += knn_search.get("rewrite_time", 0)
+            vector_operations += knn_search.get("vector_operations_count", 0)
+
+    condensed: dict = {
+        "shards": len(shards),
+        "clauses": list(clauses.values()),
+        "rewrite_ms": _nanos_ms(rewrite_nanos),
+        "collector_ms": _nanos_ms(collector_nanos),
+    }
+    if knn:
+        condensed["knn"] = list(knn.values())
+        condensed["vector_operations"] = vector_operations
+    return condensed
@@ -0,0 +1,122 @@
+"""
+Query log of /api/papers: one JSON line per request holding the canonical request
+body (search.canonical_request) plus "ts", "latency_ms", "cache" (how the caches
+answered it) and "status". Lines are still /api/papers bodies, so they can be
+replayed by warmup.py, testing/replay_cache_hits.py and testing/load_test.py.
+
+The slow query log (SLOW_QUERY_LOG, see profiling.py) is written the same way,
+to slow-<pid>.jsonl files.
+"""
+
+import glob
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+
+from search import canonical_request
+
+logger = logging.getLogger("gunicorn.error")
+
+# sent by warmup.py; its replays are not logged, so each warmup does not count
+# the previous one's top queries again
+WARMUP_HEADER: str = "X-Warmup"
+
+
+class QueryLog:
+    """
+    Writes the log to <directory>/<prefix>-<pid>.jsonl, one file per worker process
+    so rotation never races, rotated at max_bytes with `backups` old files kept.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 50 * 1024 * 1024,
+        backups: int = 5,
+        prefix: str = "queries",
+    ) -> None:
+        self.directory: str = directory
+        self.prefix: str = prefix
+        self.max_bytes: int = max_bytes
+        self.backups: int = backups
+        self._pid: int | None = None
+        self._logger: logging.Logger | None = None
+
+    def _get_logger(self) -> logging.Logger:
+        # opened lazily, so workers forked from a preloaded app get their own file
+        if self._logger is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(self.directory, f"{self.prefix}-{self._pid}.jsonl"),
+                maxBytes=self.max_bytes,
+                backupCount=self.backups,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"query_log.{self.prefix}.{self._pid}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(handler)
+        return self._logger
+
+    def record(
+        self, body: dict | None, latency_ms: float, cache: str | None, status: int
+    ) -> None:
+        if body is None:
+            return
+        self.write(
+            dict(
+                body,
+                ts=round(time.time(), 3),
+                latency_ms=round(latency_ms, 2),
+                cache=cache,
+                status=status,
+            )
+        )
+
+    def write(self, entry: dict) -> None:
+        try:
+            self._get_logger().info(json.dumps(entry, default=str))
+        except OSError:
+            logger.exception("Failed to write query log")
+
+
+def log_body(data) -> dict | None:
+    """
+    The canonical request written to the log, taken before the request is handled
+    since searching rewrites the searches in place. None if data is not a body.
+    """
+    if not isinstance(data, dict):
+        return None
+    try:
+        return canonical_request(data)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def read_query_logs(paths: list[str]) -> list[dict]:
+    """
+    Reads query log entries from files, or from every log (rotated ones too) in
+    directories, skipping lines that are not JSON objects.
+    """
+    files: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "queries-*.jsonl*"))))
+        else:
+            files.append(path)
+
+    entries: list[dict] = []
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict):
+                    entries.append(entry)
+    return entries
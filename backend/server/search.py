@@ -0,0 +1,367 @@
+import copy
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from composition import composition_clause
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def parse_request(data: dict) -> tuple:
+
+    page: int = int(data.get("page", 1))
+    num_results: int = int(data.get("results", 10))
+    sorting: str = str(data.get("sorting", "Most-Recent"))
+
+    today: datetime = datetime.now().astimezone()
+    formatted_date: str = today.strftime("%Y%m%d")
+    date: str = str(data.get("date", f"00000000-{formatted_date}"))
+    start_date: int = int(date.split("-")[0])
+    end_date: int = int(date.split("-")[1])
+
+    searches: list = list(data.get("searches", []))
+
+    highlight_mode: str = str(data.get("highlight", "markup"))
+
+    return (
+        page,
+        num_results,
+        sorting,
+        start_date,
+        end_date,
+        searches,
+        highlight_mode,
+    )
+
+
+# MAT: material
+# DSC: description of sample
+# SPL: symmetry or phase labels
+# SMT: synthesis method
+# CMT: characterization method
+# PRO: property - may also include PVL (property value) or PUT (property unit)
+# APL: application
+# composition: normalized MAT formulas/element sets (see composition.py)
+def handle_bool_searching(
+    searches: list[dict], start_date: int, end_date: int, sorting: str
+) -> tuple:
+    must_clause: list[dict] = []
+    or_clause: list[dict] = []
+    not_clause: list[dict] = []
+    vector_field: str | None = None
+    vector_query: str | None = None
+
+    valid_properties: dict = {
+        "material": "MAT",
+        "description": "DSC",
+        "symmetry or phase labels": "SPL",
+        "synthesis": "SMT",
+        "characterization": "CMT",
+        "property": "PRO",
+        "application": "APL",
+        "abstract": "summary",
+        "category": "categories",
+        "authors": "authors",
+        "title": "title",
+        "composition": "composition",
+    }
+
+    # every clause is checked before any is used, so clause order never decides
+    # whether a request is valid
+    compositions: dict[int, dict] = {}
+    for i, search in enumerate(searches):
+        if search["field"].lower() not in valid_properties:
+            return None, None, None, None
+        if search["field"].lower() == "composition" and search["term"] != "all":
+            composition: dict | None = composition_clause(search["term"])
+            if composition is None:
+                return None, None, None, None
+            compositions[i] = composition
+
+    # all query will always be all papers, wherever its clause is
+    if any(search["term"] == "all" for search in searches):
+        query: dict = {
+            "bool": {
+                "must": [{"match_all": {}}],
+                "filter": [{"range": {"date": {"gte": start_date, "lte": end_date}}}],
+            }
+        }
+        return True, query, None, None
+
+    for i, search in enumerate(searches):
+        # vector search will use embedding fields
+        if (
+            search["isVector"]
+            and sorting == "Most-Relevant"
+            and search["field"].lower() in ("abstract", "title")
+        ):
+            if search["field"].lower() == "abstract":
+                vector_field = "summary_embedding"
+            else:
+                vector_field = "title_embedding"
+            vector_query = search["term"].lower()
+            continue
+
+        # adjusting field according to correct search term
+        field: str = valid_properties[search["field"].lower()]
+
+        # constructing match clause, composition uses exact term filters instead
+        if field == "composition":
+            match_clause: dict = compositions[i]
+        else:
+            match_clause = {
+                "match": {
+                    field: {
+                        "query": search["term"],
+                        "fuzziness": "AUTO",
+                    }
+                }
+            }
+
+        # deciding where to put match clause
+        if search["operator"] == "" or search["operator"] == "AND":
+            must_clause.append(match_clause)
+        elif search["operator"] == "NOT":
+            not_clause.append(match_clause)
+        elif search["operator"] == "OR":
+            or_clause.append(match_clause)
+
+    query = {
+        "bool": {
+            "must": must_clause,
+            "should": or_clause,
+            "must_not": not_clause,
+            "filter": [{"range": {"date": {"gte": start_date, "lte": end_date}}}],
+        }
+    }
+
+    return (
+        False,
+        query,
+        vector_field,
+        vector_query,
+    )
+
+
+# "markup": <mark> tags in the returned fields, "offsets": a "highlights" dict of
+# match positions per paper, fields left untouched
+HIGHLIGHT_MODES: tuple[str, ...] = ("markup", "offsets")
+
+
+def req_validation(page: int, num_results: int, sorting: str) -> str | None:
+    if page < 0:
+        logger.error("Pages less than 0, returning None")
+        return None
+    if num_results < 0 or (
+        num_results != 10
+        and num_results != 20
+        and num_results != 50
+        and num_results != 100
+    ):
+        logger.error("num_results invalid, returning None")
+        return None
+    if sorting == "Most-Recent" or sorting == "Most-Relevant":
+        sort: str = "desc"
+    elif sorting == "Oldest-First":
+        sort = "asc"
+    else:
+        logger.error("sorting invalid, returning None")
+        return None
+
+    return sort
+
+
+def bool_expression_to_dict(query_body):
+    # Grab the boolean part
+    bool_part = query_body.get("bool", {})
+    must_clauses = bool_part.get("must", [])
+    should_clauses = bool_part.get("should", [])
+
+    # This dictionary will hold { field: [query_string, ...], ... }
+    result = {}
+
+    def extract_terms(match_array):
+        for clause in match_array:
+            # clause might look like {"match": {"authors": {"query": "something", ...}}}
+            if "match" in clause:
+                match_content = clause["match"]
+                # match_content is e.g. {"authors": {"query": "piers coleman", "fuzziness": "AUTO"}}
+                for field, match_info in match_content.items():
+                    query_value = match_info.get("query")
+                    if query_value:
+                        # Append to our result dict
+                        if field not in result:
+                            result[field] = []
+                        result[field].append(query_value)
+
+    # Extract queries from must & should
+    extract_terms(must_clauses)
+    extract_terms(should_clauses)
+
+    # Optional: remove duplicates if needed
+    for field, terms in result.items():
+        result[field] = list(dict.fromkeys(terms))
+
+    return result
+
+
+def vector_match_query(quer: dict, vector_field: str, vector_query: str) -> dict:
+    """
+    Copy of quer with the vector search term as a fuzzy "must" on its text field,
+    used for the approximate total and for highlighting.
+    """
+    # getting query field
+    if vector_field == "summary_embedding":
+        quer_field = "summary"
+    elif vector_field == "title_embedding":
+        quer_field = "title"
+    vector_match: dict = {
+        "match": {quer_field: {"query": vector_query, "fuzziness": "AUTO"}}
+    }
+
+    # built on a copy so quer is left untouched
+    match_quer: dict = copy.deepcopy(quer)
+    match_quer["bool"].setdefault("must", []).append(vector_match)
+    return match_quer
+
+
+def is_date_sorted(sorting: str) -> bool:
+    return sorting == "Most-Recent" or sorting == "Oldest-First"
+
+
+def canonical_searches(searches: list) -> list[dict]:
+    """
+    The searches reduced to what decides the query: fields lower-cased and ""
+    operators written as "AND". handle_bool_searching validates every clause
+    and lets an "all" term win wherever it is, and non-vector clauses only end up
+    in bool clause lists, so their order does not matter and they are sorted;
+    vector clauses keep their order (the last one wins).
+    """
+    clauses: list[dict] = [
+        {
+            "term": search.get("term"),
+            "field": str(search.get("field", "")).lower(),
+            "operator": search.get("operator") or "AND",
+            "isVector": bool(search.get("isVector")),
+        }
+        for search in searches
+        if isinstance(search, dict)
+    ]
+    text: list[dict] = [clause for clause in clauses if not clause["isVector"]]
+    vector: list[dict] = [clause for clause in clauses if clause["isVector"]]
+    return sorted(text, key=lambda clause: json.dumps(clause, sort_keys=True)) + vector
+
+
+def canonical_request(data: dict) -> dict:
+    """
+    An /api/papers body with its searches canonicalised (see canonical_searches),
+    keeping only the fields the server reads.
+    """
+    body: dict = {
+        field: data[field]
+        for field in ("page", "results", "sorting", "date", "highlight")
+        if field in data
+    }
+    body["searches"] = canonical_searches(list(data.get("searches", [])))
+    return body
+
+
+def hash_key(prefix: str, *parts) -> str:
+    """
+    Fixed length cache key: prefix plus a hash of the JSON encoded parts.
+    """
+    payload: str = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    digest: str = hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{prefix}:{digest}"
+
+
+def make_page_key(
+    index: str,
+    generation: int,
+    searches: list,
+    sorting: str,
+    page: int,
+    num_results: int,
+    start_date: int,
+    end_date: int,
+    highlight_mode: str,
+) -> str:
+    """
+    Response cache key of one page of results. Keys include the index generation,
+    so pages cached before the last ingestion are never served.
+    """
+    return hash_key(
+        f"page:{index}:{generation}",
+        canonical_searches(searches),
+        sorting,
+        page,
+        num_results,
+        start_date,
+        end_date,
+        highlight_mode,
+    )
+
+
+def make_window_key(
+    index: str,
+    generation: int,
+    searches: list,
+    sorting: str,
+    start_date: int,
+    end_date: int,
+) -> str:
+    """
+    Result window cache key, shared by every page size and page of a query.
+    """
+    return hash_key(
+        f"window:{index}:{generation}",
+        canonical_searches(searches),
+        sorting,
+        start_date,
+        end_date,
+    )
+
+
+def window_target(depth: int, window_size: int, max_depth: int | None) -> int:
+    """
+    Number of ranked ids a window is grown to so it reaches depth: the next
+    multiple of window_size, capped at max_depth unless that is None.
+    """
+    target: int = -(-depth // window_size) * window_size
+    if max_depth is not None:
+        target = min(max_depth, target)
+    return target
+
+
+def pit_sort(sort: str) -> list[dict]:
+    # _shard_doc is unique within a PIT, so search_after never skips or repeats papers
+    return [{"date": {"order": sort}}, {"_shard_doc": {"order": sort}}]
+
+
+def date_sort(sort: str) -> list[dict]:
+    # papers of the same date are ordered by id (unique, it is also their _id), so
+    # every read of a date sorted ranking returns them in the same order
+    return [{"date": {"order": sort}}, {"id.keyword": {"order": sort}}]
+
+
+def date_window_body(
+    quer: dict, sort: str, size: int, search_after: list | None, count: bool
+) -> dict:
+    """
+    Search body for the next size ids of a date sorted window: the ranking read
+    on with search_after from the window's last paper, the total only counted
+    (up to Elasticsearch's default 10000) when count is set.
+    """
+    body: dict = {
+        "query": quer,
+        "size": size,
+        "sort": date_sort(sort),
+        "_source": False,
+    }
+    if not count:
+        body["track_total_hits"] = False
+    if search_after is not None:
+        body["search_after"] = search_after
+    return body
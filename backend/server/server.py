@@ -1,17 +1,98 @@
 import json
 import logging
 import os
-from datetime import datetime
-from typing import Mapping, Sequence
+import time
+from collections.abc import Iterator
 
 import redis
 import redis.exceptions
+from cache import (
+    BytesLRUCache,
+    CacheStats,
+    EmbeddingCache,
+    IndexGeneration,
+    IndexSize,
+    PaperCache,
+    ResultCodec,
+    SingleFlight,
+)
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
-from flask import Flask, Request, Response, jsonify, request
+from elasticsearch import ApiError, Elasticsearch
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
 from flask_cors import CORS
-from fuzzywuzzy import fuzz
+from metrics import (
+    CountedStats,
+    count_lookup,
+    observe_request,
+    render,
+    request_timings,
+    server_timing,
+    start_request,
+    timed,
+)
+from pipeline import (
+    CACHE_STALE_TTL,
+    EMBEDDING_FIELDS,
+    MAX_BATCH_IDS,
+    MAX_RESULT_WINDOW,
+    NEGATIVE_CACHE_TTL,
+    PAGE_CACHE_TTL,
+    PAPER_CACHE_TTL,
+    PIT_BATCH_SIZE,
+    PIT_KEEP_ALIVE,
+    DateSegment,
+    SearchPlan,
+    advance_pit,
+    batch_body,
+    batch_ids,
+    date_segment_key,
+    date_segments,
+    highlight_page,
+    highlight_search_body,
+    hits_by_id,
+    join_segments,
+    knn_bodies,
+    ndjson,
+    page_body,
+    page_ids,
+    paper_etag,
+    pit_body,
+    plan_export,
+    plan_search,
+    regular_window,
+    regular_window_body,
+    source_bodies,
+    use_es_highlight,
+    vector_window,
+    window_hit,
+    window_ttl,
+)
+from profiling import (
+    is_admin,
+    loggable_knn,
+    note_search,
+    profiling,
+    request_profile,
+    slow_query_entry,
+    track_searches,
+)
+from query_log import WARMUP_HEADER, QueryLog, log_body
 from redis import Redis
+from search import (
+    HIGHLIGHT_MODES,
+    make_page_key,
+    make_window_key,
+    parse_request,
+    req_validation,
+    window_target,
+)
 from sentence_transformers import SentenceTransformer  # type: ignore
 
 load_dotenv(dotenv_path="./env/.env")
@@ -20,8 +101,14 @@ ES_URL: str | None = os.getenv("ES_URL")
 DOCKER: str | None = os.getenv("DOCKER")
 INDEX: str = os.getenv("INDEX", "")
 CERT_PATH: str = os.getenv("CERT_PATH", "")
+# "python": highlight results in highlight.py, "elasticsearch": ask ES for highlights
+# (python highlighting is still used for the "offsets" mode and when ES returns none)
+HIGHLIGHT_ENGINE: str = os.getenv("HIGHLIGHT_ENGINE", "python")
 
-client: Elasticsearch = Elasticsearch(ES_URL, api_key=API_KEY, ca_certs=CERT_PATH)
+# no CERT_PATH for plain http clusters (e.g. testing/fake_es.py)
+client: Elasticsearch = Elasticsearch(
+    ES_URL, api_key=API_KEY, ca_certs=CERT_PATH or None
+)
 
 app: Flask = Flask(__name__)
 
@@ -31,7 +118,8 @@ if DOCKER != "true":
         allow_headers=["Content-Type", "Authorization"],
     )
 
-model: SentenceTransformer = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+model: SentenceTransformer = SentenceTransformer(EMBEDDING_MODEL)
 
 gunicorn_logger = logging.getLogger("gunicorn.error")
 app.logger.handlers = gunicorn_logger.handlers
@@ -48,14 +136,34 @@ try:
         host=redis_host, port=6379, db=0, decode_responses=True
     )
     redis_client.ping()
+    # raw bytes values (embeddings)
+    redis_bytes_client: Redis = redis.StrictRedis(host=redis_host, port=6379, db=0)
     redis_success = True
 except redis.exceptions.ConnectionError:
     gunicorn_logger.exception("Failed to connect to redis")
     redis_success = False
 
+embedding_cache: EmbeddingCache = EmbeddingCache(
+    model.encode,
+    EMBEDDING_MODEL,
+    redis_client=redis_bytes_client if redis_success else None,
+)
+
 
 def get_embedding(text: str):  # type: ignore
-    return model.encode(text)
+    with timed("embedding"):
+        return embedding_cache.get(text)
+
+
+def count_papers() -> int:
+    with timed("count", es=True):
+        return client.count(index=INDEX)["count"]
+
+
+# index document count, shared through redis and refreshed every minute
+index_size: IndexSize = IndexSize(
+    INDEX, count_papers, redis_client if redis_success else None
+)
 
 
 @app.route("/api/health", methods=["GET"])
@@ -63,543 +171,560 @@ def health() -> tuple[Response, int]:
     return jsonify({"message": "Success"}), 200
 
 
-# cache.clear()
-# print("Cleared cache")
-# redis-cli FLUSHALL # command on cli to clear cache
+# set by warmup.py once the caches are warm, /api/ready fails until then (always
+# ready when READY_FILE is not set)
+READY_FILE: str | None = os.getenv("READY_FILE")
+
+
+@app.route("/api/ready", methods=["GET"])
+def ready() -> tuple[Response, int]:
+    if READY_FILE and not os.path.exists(READY_FILE):
+        return jsonify({"message": "Warming up"}), 503
+    return jsonify({"message": "Ready"}), 200
+
+
+# /api/papers requests are logged to rotating files in QUERY_LOG (a directory),
+# see query_log.py
+QUERY_LOG: str | None = os.getenv("QUERY_LOG")
+query_log: QueryLog | None = QueryLog(QUERY_LOG) if QUERY_LOG else None
+
+# admins (ADMIN_TOKEN in an X-Profile header) can profile the searches of
+# /api/papers, see profiling.py; requests slower than SLOW_QUERY_MS are logged with
+# their searches to SLOW_QUERY_LOG (a directory), or the error log
+ADMIN_TOKEN: str | None = os.getenv("ADMIN_TOKEN")
+SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", "1000"))
+SLOW_QUERY_LOG: str | None = os.getenv("SLOW_QUERY_LOG")
+slow_log: QueryLog | None = (
+    QueryLog(SLOW_QUERY_LOG, prefix="slow") if SLOW_QUERY_LOG else None
+)
+
+
+@app.before_request
+def start_timer() -> None:
+    g.start = time.perf_counter()
+    start_request()
+    if request.endpoint == "papers":
+        g.query = log_body(request.get_json(silent=True))
+        track_searches(is_admin(request.headers.get("X-Profile"), ADMIN_TOKEN))
+
+
+@app.after_request
+def record_query(response: Response) -> Response:
+    if request.endpoint != "papers":
+        return response
+
+    latency_ms: float = (time.perf_counter() - g.start) * 1000
+    if query_log is not None and not request.headers.get(WARMUP_HEADER):
+        query_log.record(
+            g.get("query"), latency_ms, g.get("cache"), response.status_code
+        )
+    if latency_ms >= SLOW_QUERY_MS:
+        entry: dict = slow_query_entry(
+            g.get("query"),
+            latency_ms,
+            g.get("cache"),
+            response.status_code,
+            request_timings(),
+        )
+        if slow_log is not None:
+            slow_log.write(entry)
+        else:
+            gunicorn_logger.warning(f"Slow query: {json.dumps(entry, default=str)}")
+    return response
+
+
+# stage timings of every request, see metrics.py
+@app.after_request
+def add_server_timing(response: Response) -> Response:
+    total: float = time.perf_counter() - g.start
+    response.headers["Server-Timing"] = server_timing(total)
+    observe_request(request.endpoint, response.status_code, total)
+    return response
+
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics() -> Response:
+    body, content_type = render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats() -> tuple[Response, int]:
+    return jsonify(
+        {
+            "embedding": embedding_cache.stats(),
+            "page": page_stats.stats(),
+            "page_l1": page_bodies.stats() if page_bodies is not None else None,
+            "window": window_stats.stats(),
+        }
+    ), 200
+
+
+# per-paper cache of serialized sources, filled by detail/batch lookups and
+# written through from search results; PAPER_LRU_SIZE > 0 adds an in-process LRU
+PAPER_LRU_SIZE: int = int(os.getenv("PAPER_LRU_SIZE", "0"))
+
+index_generation: IndexGeneration = IndexGeneration(
+    INDEX, redis_client if redis_success else None
+)
+paper_cache: PaperCache = PaperCache(
+    INDEX,
+    index_generation,
+    redis_client=redis_client if redis_success else None,
+    maxsize=PAPER_LRU_SIZE,
+    ttl=PAPER_CACHE_TTL,
+)
+
+
+def get_papers_by_id(paper_ids: list[str]) -> dict[str, str]:
+    """
+    Looks the papers up in the paper cache first and fetches the rest with a
+    single client.mget, caching what it found. Returns {id: serialized paper}
+    for the ids that exist.
+    """
+    with timed("paper_cache"):
+        bodies: dict[str, str] = paper_cache.get_many(paper_ids)
+
+    misses: list[str] = [pid for pid in paper_ids if pid not in bodies]
+    if misses:
+        with timed("mget", es=True):
+            docs: list[dict] = client.mget(
+                index=INDEX, ids=misses, source_excludes=EMBEDDING_FIELDS
+            )["docs"]
+        found: dict[str, str] = source_bodies(docs)
+        paper_cache.set_many(found)
+        bodies.update(found)
+
+    return bodies
+
+
+def cache_search_sources(hits: list[dict]) -> None:
+    """
+    Writes the (not yet highlighted) sources of search hits through to the paper
+    cache, so opening one of them does not need another Elasticsearch call.
+    """
+    paper_cache.set_many(source_bodies(hits))
+
+
+# cached pages, windows and papers are keyed by the index generation, which
+# add_papers.py and curl_upload.sh bump after writing to the index; to drop every
+# cached result by hand: redis-cli INCR index_generation:<index>
 @app.route("/api/papers/<paper_id>", methods=["GET"])
 def get_paper(paper_id: str) -> tuple[Response, int] | Response:
-    results = client.get(index=INDEX, id=paper_id)
-    paper: dict = results["_source"]
-    if paper:
-        return jsonify(paper), 200
-    else:
+    body: str | None = get_papers_by_id([paper_id]).get(paper_id)
+    if body is None:
         return jsonify({"error": "No results found"}), 404
 
+    # clients revalidate with If-None-Match and get a 304 while the paper is unchanged
+    response: Response = Response(body, mimetype="application/json")
+    response.set_etag(paper_etag(body))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-def get_cached_results(cache_key: str) -> dict | None:
-    if redis_success:
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            return json.loads(cached_data)  # type: ignore
-    return None
 
+@app.route("/api/papers/batch", methods=["POST"])
+def get_papers_batch() -> tuple[Response, int]:
+    paper_ids: list[str] | None = batch_ids(request.get_json(silent=True))
+    if paper_ids is None:
+        gunicorn_logger.error("Batch request failed to validate")
+        return jsonify(
+            {"error": f"ids must be a list of at most {MAX_BATCH_IDS} ids"}
+        ), 400
+    if not paper_ids:
+        return jsonify({"papers": [], "missing": []}), 200
 
-def cache_results(cache_key: str, data: tuple) -> None:
-    if redis_success:
-        redis_client.setex(cache_key, 3600, json.dumps(data))
-
-
-def make_cache_key(args: list[str]):
-    def parse(arg: str | list[str]) -> str:
-        if isinstance(arg, list):
-            arg = f"[{','.join(arg)}]"
-
-        return arg
-
-    return "_".join([parse(arg) for arg in args])
-
-
-def parse_request(request: Request) -> tuple:
-    data: dict = request.get_json() or {}
-
-    page: int = int(data.get("page", 1))
-    num_results: int = int(data.get("results", 10))
-    sorting: str = str(data.get("sorting", "Most-Recent"))
-
-    today: datetime = datetime.today()
-    formatted_date: str = today.strftime("%Y%m%d")
-    date: str = str(data.get("date", f"00000000-{formatted_date}"))
-    start_date: int = int(date.split("-")[0])
-    end_date: int = int(date.split("-")[1])
-
-    searches: list = list(data.get("searches", []))
-
-    return page, num_results, sorting, start_date, end_date, searches
-
-
-# MAT: material
-# DSC: description of sample
-# SPL: symmetry or phase labels
-# SMT: synthesis method
-# CMT: characterization method
-# PRO: property - may also include PVL (property value) or PUT (property unit)
-# APL: application
-def handle_bool_searching(
-    searches: list[dict], start_date: int, end_date: int, sorting: str
-) -> tuple:
-    must_clause: list[dict] = []
-    or_clause: list[dict] = []
-    not_clause: list[dict] = []
-    query: dict | None = None
-    all_query: bool = False
-    vector_field: str | None = None
-    vector_query: str | None = None
-
-    valid_properties: dict = {
-        "material": "MAT",
-        "description": "DSC",
-        "symmetry or phase labels": "SPL",
-        "synthesis": "SMT",
-        "characterization": "CMT",
-        "property": "PRO",
-        "application": "APL",
-        "abstract": "summary",
-        "category": "categories",
-        "authors": "authors",
-        "title": "title",
-    }
-
-    for search in searches:
-        if search["field"].lower() not in valid_properties:
-            return None, None, None, None
-
-        # all query will always be all papers
-        if search["term"] == "all":
-            all_query = True
-            query = {
-                "bool": {
-                    "must": [{"match_all": {}}],
-                    "filter": [
-                        {"range": {"date": {"gte": start_date, "lte": end_date}}}
-                    ],
-                }
-            }
-            break
-
-        # vector search will use embedding fields
-        if (
-            search["isVector"]
-            and sorting == "Most-Relevant"
-            and search["field"].lower() in ("abstract", "title")
-        ):
-            if search["field"].lower() == "abstract":
-                vector_field = "summary_embedding"
-            else:
-                vector_field = "title_embedding"
-            vector_query = search["term"].lower()
-            continue
-
-        # adjusting field according to correct search term
-        search["field"] = valid_properties[search["field"].lower()]
-
-        # constructing match clause
-        match_clause: dict = {
-            "match": {
-                search["field"]: {
-                    "query": search["term"],
-                    "fuzziness": "AUTO",
-                }
-            }
-        }
+    try:
+        found: dict[str, str] = get_papers_by_id(paper_ids)
+    except Exception:
+        gunicorn_logger.exception("Failed to read batch papers")
+        return jsonify(None), 500
 
-        # deciding where to put match clause
-        if search["operator"] == "" or search["operator"] == "AND":
-            must_clause.append(match_clause)
-        elif search["operator"] == "NOT":
-            not_clause.append(match_clause)
-        elif search["operator"] == "OR":
-            or_clause.append(match_clause)
-
-    # if not all query construct query according to constraints
-    if not all_query:
-        query = {
-            "bool": {
-                "must": must_clause,
-                "should": or_clause,
-                "must_not": not_clause,
-                "filter": [{"range": {"date": {"gte": start_date, "lte": end_date}}}],
-            }
-        }
+    return jsonify(batch_body(paper_ids, found)), 200
 
-    return (
-        all_query,
-        query,
-        vector_field,
-        vector_query,
-    )
 
+# pages and result windows are stored as zstd compressed msgpack (see ResultCodec),
+# optionally with a dictionary trained on our papers
+RESULT_CODEC: ResultCodec = ResultCodec.from_file(os.getenv("CACHE_ZSTD_DICT"))
+
+page_stats: CacheStats = CountedStats("page", "stale", "misses")
+
+# serialized bodies of the hottest pages, kept in each worker (PAGE_L1_BYTES, 0 to
+# turn off) for PAGE_L1_TTL seconds; keys carry the index generation like redis'
+PAGE_L1_BYTES: int = int(os.getenv("PAGE_L1_BYTES", str(32 * 1024 * 1024)))
+PAGE_L1_TTL: int = 60
+page_bodies: BytesLRUCache | None = (
+    BytesLRUCache(PAGE_L1_BYTES, PAGE_L1_TTL) if PAGE_L1_BYTES > 0 else None
+)
+single_flight: SingleFlight = SingleFlight(redis_client if redis_success else None)
 
-def req_validation(page: int, num_results: int, sorting: str) -> str | None:
-    if page < 0:
-        gunicorn_logger.error("Pages less than 0, returning None")
+
+def get_cache_entry(cache_key: str) -> tuple | None:
+    """
+    Returns (value, stale) for a cached entry, or None when there is none.
+    """
+    if not redis_success:
         return None
-    if num_results < 0 or (
-        num_results != 10
-        and num_results != 20
-        and num_results != 50
-        and num_results != 100
-    ):
-        gunicorn_logger.error("num_results invalid, returning None")
+    return RESULT_CODEC.decode_entry(redis_bytes_client.get(cache_key))  # type: ignore
+
+
+def get_cached_results(cache_key: str) -> dict | None:
+    entry: tuple | None = get_cache_entry(cache_key)
+    if entry is None or entry[1]:
         return None
-    if sorting == "Most-Recent" or sorting == "Most-Relevant":
-        sort: str = "desc"
-    elif sorting == "Oldest-First":
-        sort = "asc"
+    return entry[0]
+
+
+def cache_results(
+    cache_key: str, data: tuple | dict, ttl: int = PAGE_CACHE_TTL
+) -> None:
+    if redis_success:
+        with timed("cache_write"):
+            redis_bytes_client.setex(
+                cache_key, ttl + CACHE_STALE_TTL, RESULT_CODEC.encode_entry(data, ttl)
+            )
+
+
+def msearch(*bodies: dict) -> list[dict]:
+    """
+    Runs the search bodies against the index in a single _msearch request and
+    returns their responses in order, raising if any of them failed.
+    """
+    searches: list[dict] = []
+    for body in bodies:
+        searches.extend(({"index": INDEX}, body))
+
+    with timed("search", es=True):
+        responses: list[dict] = client.msearch(searches=searches)["responses"]
+    for response in responses:
+        if "error" in response:
+            raise RuntimeError(f"msearch failed: {response['error']}")
+
+    return responses
+
+
+# ranked ids of a query are fetched RESULT_WINDOW at a time and cached, pages are
+# sliced out of that window and hydrated through the paper cache
+RESULT_WINDOW: int = int(os.getenv("RESULT_WINDOW", "200"))
+window_stats: CacheStats = CountedStats("window", "extends", "misses")
+
+
+def load_window(window_key: str, depth: int, plan: SearchPlan) -> dict:
+    """
+    Returns the cached window of ranked ids for a query, searching when there is
+    none or when it does not reach depth yet. Windows grow RESULT_WINDOW ids at a
+    time, up to MAX_RESULT_WINDOW (date sorted searches use load_date_window).
+    """
+    target: int = window_target(depth, RESULT_WINDOW, MAX_RESULT_WINDOW)
+    # profiled requests always search
+    with timed("window_cache"):
+        window: dict | None = None if profiling() else get_cached_results(window_key)
+    if window_hit(window, depth, target):
+        window_stats.count("hits")
+        return window  # type: ignore
+
+    window_stats.count("misses" if window is None else "extends")
+    if plan.kind == "vector":
+        window = handle_vector_search(plan, target)
     else:
-        gunicorn_logger.error("sorting invalid, returning None")
-        return None
+        window = handle_regular_search(plan, window, target)
+    cache_results(window_key, window, window_ttl(window))
+    return window
+
+
+def load_date_window(
+    window_key: str, page: int, num_results: int, plan: SearchPlan
+) -> dict:
+    """
+    Returns the window of a date sorted page: the cached RESULT_WINDOW id segments
+    of the ranking its ids are in, each read with one search after the one before
+    it when it is not cached (see DateSegment).
+    """
+    segments: range = date_segments(page, num_results, RESULT_WINDOW)
+    return join_segments(
+        [load_date_segment(window_key, segment, plan) for segment in segments],
+        segments[0],
+        RESULT_WINDOW,
+    )
 
-    return sort
-
-
-def bool_expression_to_dict(query_body):
-    # Grab the boolean part
-    bool_part = query_body.get("bool", {})
-    must_clauses = bool_part.get("must", [])
-    should_clauses = bool_part.get("should", [])
-
-    # This dictionary will hold { field: [query_string, ...], ... }
-    result = {}
-
-    def extract_terms(match_array):
-        for clause in match_array:
-            # clause might look like {"match": {"authors": {"query": "something", ...}}}
-            if "match" in clause:
-                match_content = clause["match"]
-                # match_content is e.g. {"authors": {"query": "piers coleman", "fuzziness": "AUTO"}}
-                for field, match_info in match_content.items():
-                    query_value = match_info.get("query")
-                    if query_value:
-                        # Append to our result dict
-                        if field not in result:
-                            result[field] = []
-                        result[field].append(query_value)
-
-    # Extract queries from must & should
-    extract_terms(must_clauses)
-    extract_terms(should_clauses)
-
-    # Optional: remove duplicates if needed
-    for field in result:
-        result[field] = list(dict.fromkeys(result[field]))
-
-    return result
-
-
-def apply_highlight_markup(
-    source,
-    highlighted_terms,
-    fields_to_highlight,
-    similarity_threshold: int = 80,
-):
-    for field in fields_to_highlight:
-        if field in highlighted_terms:
-            highlight_values = highlighted_terms[field]
-
-            if isinstance(source.get(field), list):
-                source[field] = [
-                    apply_fuzzy_mark_tags(item, highlight_values, similarity_threshold)
-                    for item in source[field]
-                ]
-            elif isinstance(source.get(field), str):
-                source[field] = apply_fuzzy_mark_tags(
-                    source[field], highlight_values, similarity_threshold
-                )
-
-    return source
-
-
-def apply_fuzzy_mark_tags(text, terms, similarity_threshold):
-    if not isinstance(text, str):
-        return text
-
-    # Keep track of matches to avoid overlapping highlights
-    matches = []
-
-    # Find all potential matches for each term
-    for term in terms:
-        text_lower = text.lower()
-        term_lower = term.lower()
-
-        # Slide a window the size of the search term through the text
-        window_size = len(term)
-        for i in range(len(text_lower) - window_size + 1):
-            window = text_lower[i : i + window_size]
-
-            # Calculate similarity score
-            score = fuzz.ratio(window.lower(), term_lower)
-
-            if score >= similarity_threshold:
-                matches.append(
-                    {
-                        "start": i,
-                        "end": i + window_size,
-                        "text": text[i : i + window_size],
-                        "score": score,
-                    }
-                )
-
-    # Sort matches by score (highest first) and position
-    matches.sort(key=lambda x: (-x["score"], x["start"]))
-
-    # Filter out overlapping matches, keeping the highest scoring ones
-    filtered_matches = []
-    for match in matches:
-        overlapping = False
-        for existing in filtered_matches:
-            if match["start"] < existing["end"] and match["end"] > existing["start"]:
-                overlapping = True
-                break
-        if not overlapping:
-            filtered_matches.append(match)
-
-    # Sort matches by position for proper highlighting
-    filtered_matches.sort(key=lambda x: x["start"])
-
-    # Apply highlighting tags
-    result = ""
-    last_end = 0
-    for match in filtered_matches:
-        result += text[last_end : match["start"]]
-        result += f"<mark>{match['text']}</mark>"
-        last_end = match["end"]
-    result += text[last_end:]
-
-    return result
-
-
-def handle_vector_search(
-    num_results: int,
-    vector_field: str,
-    vector_query: str,
-    quer: dict,
-    page: int,
-    p_sort: Sequence[Mapping | str],
-    size: int,
-):
-    # queries done based on size of index
-    if size < num_results:
-        size = num_results
-
-    results = client.search(
-        knn={
-            "field": vector_field,
-            "query_vector": get_embedding(vector_query),
-            "num_candidates": size
-            if size < 10000
-            else 10000,  # not sure if should be lower or not
-            "k": num_results,
-        },
-        query=quer,
-        from_=(page - 1) * num_results,
-        size=num_results,
-        sort=p_sort,
-        index=INDEX,
+
+def load_date_segment(window_key: str, segment: int, plan: SearchPlan) -> dict:
+    key: str = date_segment_key(window_key, segment)
+    previous: dict | None = None
+    with timed("window_cache"):
+        window: dict | None = None if profiling() else get_cached_results(key)
+        if window is None and segment > 0 and not profiling():
+            previous = get_cached_results(date_segment_key(window_key, segment - 1))
+    if window is not None:
+        window_stats.count("hits")
+        return window
+
+    window_stats.count("misses" if previous is None else "extends")
+    reader: DateSegment = DateSegment(
+        segment, RESULT_WINDOW, plan.quer, plan.sort, previous
+    )
+    while not reader.done:
+        body: dict = reader.next_body()
+        with timed("search", es=True):
+            results = client.search(index=INDEX, body=body)
+        note_search("search", body, results)
+        reader.add(results)
+    window = reader.window()
+    cache_results(key, window, window_ttl(window))
+    return window
+
+
+def handle_vector_search(plan: SearchPlan, target: int) -> dict:
+    size: int = index_size.get()
+    knn_body, total_body = knn_bodies(
+        plan, get_embedding(plan.vector_query).tolist(), size, target
     )
 
-    # if empty return Nones
-    if results["hits"]["hits"] == []:
-        return None, None, None
+    # knn search and total count in one round trip
+    knn_response, total_response = msearch(knn_body, total_body)
+    note_search("knn", {**knn_body, "knn": loggable_knn(knn_body["knn"])}, knn_response)
+    note_search("total", total_body, total_response)
+    return vector_window(knn_response, total_response, size, target)
 
-    hits: dict = results["hits"]["hits"]
-    inflated: int = -1
 
-    # getting query field
-    if vector_field == "summary_embedding":
-        quer_field = "summary"
-    elif vector_field == "title_embedding":
-        quer_field = "title"
+def handle_regular_search(plan: SearchPlan, window: dict | None, target: int) -> dict:
+    # searching index for the ids after the ones already in the window
+    body: dict = regular_window_body(plan.quer, window, target)
+    with timed("search", es=True):
+        results = client.search(index=INDEX, body=body)
+    note_search("search", body, results)
+    return regular_window(window, results, target)
 
-    # creating "must" bool expression
-    quer["bool"]["must"].append(
-        {"match": {quer_field: {"query": vector_query, "fuzziness": "AUTO"}}}
-    )
 
-    # running fuzzy search to see apprx how many papers to display
-    total = client.search(
-        query=quer,
-        size=num_results,
-        from_=(page - 1) * num_results,
-        index=INDEX,
-    )["hits"]["total"]["value"]
-
-    # if small total, set inflated to be papers found and total is 100 default
-    if total < 100 and size >= 100:
-        inflated = total
-        total = 100
-
-    to_highlight = bool_expression_to_dict(quer)
-
-    # constructing filtered papers
-    filtered_papers: list[dict] = []
-    for paper in hits:
-        source: dict = paper["_source"]
-
-        source.pop("summary_embedding", None)
-        source.pop("title_embedding", None)
-
-        fields_to_highlight = [
-            "summary",
-            "title",
-            "authors",
-            "APL",
-            "CMT",
-            "DSC",
-            "MAT",
-            "PRO",
-            "PVL",
-            "PUT",
-            "SMT",
-            "SPL",
-        ]
-
-        source = apply_highlight_markup(source, to_highlight, fields_to_highlight)
-
-        filtered_papers.append(source)
-
-    return inflated, filtered_papers, total
-
-
-def handle_regular_search(
-    quer: dict,
-    num_results: int,
-    page: int,
-    sort: str,
-    sorting: str,
-) -> tuple:
-    # searching index
-    results = client.search(
-        query=quer,
-        size=num_results,
-        from_=(page - 1) * num_results,
-        sort=[{"date": {"order": sort}}]
-        if (sorting == "Most-Recent" or sorting == "Oldest-First")
-        else None,
-        index=INDEX,
-    )
+def open_pit() -> dict:
+    """
+    Opens a point in time on the index and returns a fresh cursor for it.
+    """
+    with timed("search", es=True):
+        pit = client.open_point_in_time(index=INDEX, keep_alive=PIT_KEEP_ALIVE)
+    return {"pit_id": pit["id"], "search_after": None}
+
 
-    to_highlight = bool_expression_to_dict(quer)
+def close_pit(cursor: dict) -> None:
+    try:
+        client.close_point_in_time(id=cursor["pit_id"])
+    except ApiError:
+        gunicorn_logger.exception("Failed to close point in time")
+
+
+def pit_batches(plan: SearchPlan, cursor: dict) -> Iterator[list[dict]]:
+    """
+    Yields batches of hits after the cursor's position, moving the cursor along
+    before each batch is handed out.
+    """
+    while True:
+        with timed("search", es=True):
+            results = client.search(body=pit_body(plan, cursor))
+        hits: list[dict] = advance_pit(cursor, results)
+
+        yield hits
+
+        if len(hits) < PIT_BATCH_SIZE:
+            return
+
+
+def build_page(page_ids: list[str], highlight_quer: dict, highlight_mode: str):
+    """
+    Hydrates the papers of a page, in order, and highlights them.
+    """
+    es_highlighted: bool = use_es_highlight(HIGHLIGHT_ENGINE, highlight_mode)
+    if es_highlighted:
+        with timed("highlight_search", es=True):
+            results = client.search(
+                index=INDEX, body=highlight_search_body(page_ids, highlight_quer)
+            )
+        cache_search_sources(results["hits"]["hits"])
+        by_id: dict[str, dict] = {hit["_id"]: hit for hit in results["hits"]["hits"]}
+    else:
+        by_id = hits_by_id(get_papers_by_id(page_ids))
 
-    # no results, return Nones
-    if results["hits"]["hits"] == []:
-        return None, None, None
+    with timed("highlight"):
+        return highlight_page(
+            page_ids, by_id, highlight_quer, highlight_mode, es_highlighted
+        )
 
-    # getting data, if highlights to be made, add those
-    filtered_papers = []
-    for hit in results["hits"]["hits"]:
-        source = hit["_source"]
 
-        source.pop("summary_embedding", None)
-        source.pop("title_embedding", None)
+def search_page(
+    cache_key: str,
+    page: int,
+    num_results: int,
+    sorting: str,
+    sort: str,
+    start_date: int,
+    end_date: int,
+    searches: list,
+    highlight_mode: str,
+) -> tuple | None:
+    """
+    Runs the search for one page and caches it. Returns (papers, total, inflated),
+    with no papers when the page has no hits, or None when the query is invalid.
+    """
+    # the window of ranked ids is shared by every page size and page of a query
+    window_key: str = make_window_key(
+        INDEX, index_generation.get(), searches, sorting, start_date, end_date
+    )
 
-        fields_to_highlight = [
-            "summary",
-            "title",
-            "authors",
-            "APL",
-            "CMT",
-            "DSC",
-            "MAT",
-            "PRO",
-            "PVL",
-            "PUT",
-            "SMT",
-            "SPL",
-        ]
+    plan: SearchPlan | None = plan_search(searches, start_date, end_date, sorting, sort)
+    if plan is None:
+        gunicorn_logger.error("Failed to bool search")
+        return None
 
-        source = apply_highlight_markup(source, to_highlight, fields_to_highlight)
+    gunicorn_logger.info(f"{plan.kind.capitalize()} search")
+    if plan.kind == "date":
+        window: dict = load_date_window(window_key, page, num_results, plan)
+    else:
+        window = load_window(window_key, page * num_results, plan)
+    total: int = window["total"]
+    inflated: int = window["inflated"]
+    ids: list[str] = page_ids(window, page, num_results)
+    if not ids:
+        gunicorn_logger.error("No hits")
+        cache_results(cache_key, ([], total, inflated), NEGATIVE_CACHE_TTL)
+        return [], total, inflated
 
-        filtered_papers.append(source)
+    filtered_papers: list[dict] = build_page(ids, plan.highlight_quer, highlight_mode)
+    if not filtered_papers:
+        # ids of the window no longer in the index, not worth caching
+        gunicorn_logger.error("No results found")
+        return [], total, inflated
 
-    return -1, filtered_papers, results["hits"]["total"]["value"]
+    cache_results(cache_key, (filtered_papers, total, inflated))
+    return filtered_papers, total, inflated
 
 
 @app.route("/api/papers", methods=["POST"])
 def papers() -> tuple[Response, int]:
     try:
         # parsing req
-        page, num_results, sorting, start_date, end_date, searches = parse_request(
-            request
-        )
+        (
+            page,
+            num_results,
+            sorting,
+            start_date,
+            end_date,
+            searches,
+            highlight_mode,
+        ) = parse_request(request.get_json() or {})
 
         # returning None for invalid req
         sort: str | None = req_validation(page, num_results, sorting)
-        if sort is None:
+        if sort is None or highlight_mode not in HIGHLIGHT_MODES:
             logging.error("Request failed to validate")
             return jsonify(None), 500
 
         # constructing/querying cache
-        cache_key: str = make_cache_key(
-            [
-                json.dumps(searches),
-                sorting,
-                f"{page}",
-                f"{num_results}",
-                f"{start_date}",
-                f"{end_date}",
-            ]
-        )
-        if redis_success:
-            cached: dict | None = get_cached_results(cache_key)
-            if cached:
-                return jsonify(
-                    {
-                        "papers": cached[0],
-                        "total": cached[1],
-                        "inflated": cached[2],
-                    }
-                ), 200
-
-        # getting size of index and how to sort
-        size: int = client.count(index=INDEX)["count"]
-
-        if sorting == "Most-Recent" or sorting == "Oldest-First":
-            p_sort: Sequence[Mapping | str] = [{"date": {"order": sort}}, "_score"]
-        elif sorting == "Most-Relevant":
-            p_sort = [{"_score": {"order": sort}}]
-
-        # boolean search query
-        all_query, quer, vector_field, vector_query = handle_bool_searching(
-            searches, start_date, end_date, sorting
+        cache_key: str = make_page_key(
+            INDEX,
+            index_generation.get(),
+            searches,
+            sorting,
+            page,
+            num_results,
+            start_date,
+            end_date,
+            highlight_mode,
         )
-        if all_query is None or quer is None:
-            gunicorn_logger.error("Failed to bool search")
-            return jsonify(None), 500
 
-        # which type of search
-        if vector_field is None or vector_query is None or all_query:
-            gunicorn_logger.info("Regular search")
-            inflated, filtered_papers, total = handle_regular_search(
-                quer,
-                num_results,
+        def compute() -> tuple | None:
+            return search_page(
+                cache_key,
                 page,
-                sort,
+                num_results,
                 sorting,
+                sort,
+                start_date,
+                end_date,
+                searches,
+                highlight_mode,
             )
+
+        # profiled requests skip the caches so their searches run
+        if profiling():
+            g.cache = "profile"
+            result: tuple | None = compute()
+            if result is None:
+                return jsonify(None), 500
+            return jsonify(page_body(result, request_profile())), 200
+
+        # hot pages are answered from memory with the body sent the last time
+        if page_bodies is not None:
+            with timed("l1"):
+                body: bytes | None = page_bodies.get(cache_key)
+            count_lookup("page_l1", "misses" if body is None else "hits")
+            if body is not None:
+                g.cache = "l1"
+                return Response(body, mimetype="application/json"), 200
+
+        # stale pages are served while one request refreshes them; on a miss only
+        # one request per key searches and the others wait for its result
+        with timed("cache"):
+            cached: tuple | None = get_cache_entry(cache_key)
+        stale: bool = False
+        if cached is not None:
+            result, stale = cached
+            page_stats.count("stale" if stale else "hits")
+            g.cache = "stale" if stale else "hit"
+            if stale:
+                single_flight.refresh(cache_key, compute)
         else:
-            gunicorn_logger.info("Vector search")
-            inflated, filtered_papers, total = handle_vector_search(
-                num_results,
-                vector_field,
-                vector_query,
-                quer,
-                page,
-                p_sort,
-                size,
+            page_stats.count("misses")
+            g.cache = "miss"
+            result = single_flight.do(
+                cache_key, compute, lambda: get_cached_results(cache_key)
             )
 
-        if inflated is None or filtered_papers is None or total is None:
-            gunicorn_logger.error("No hits")
+        # no hits (possibly a cached empty page, see NEGATIVE_CACHE_TTL)
+        if result is None or not result[0]:
             return jsonify(None), 500
 
-        # cache and return, else error
-        if filtered_papers:
-            cache_results(cache_key, (filtered_papers, total, inflated))
-
-            return jsonify(
-                {
-                    "papers": filtered_papers,
-                    "total": total,
-                    "inflated": inflated,
-                }
-            ), 200
-        else:
-            return jsonify({"error": "No results found"}), 404
-    except Exception as e:
-        gunicorn_logger.exception(e)
+        with timed("serialize"):
+            response: Response = jsonify(page_body(result))
+        if page_bodies is not None and not stale:
+            page_bodies.set(cache_key, response.get_data())
+        return response, 200
+    except Exception:
+        gunicorn_logger.exception("Failed to search papers")
         return jsonify(None), 500
 
 
+@app.route("/api/papers/export", methods=["POST"])
+def export_papers() -> tuple[Response, int] | Response:
+    """
+    Streams every paper matching a search as NDJSON, in the requested order, read
+    from a point in time PIT_BATCH_SIZE papers at a time. Takes the same body as
+    /api/papers (page and results are ignored); vector searches cannot be exported.
+    """
+    try:
+        plan: SearchPlan | None = plan_export(request.get_json() or {})
+        if plan is None:
+            gunicorn_logger.error("Export request failed to validate")
+            return jsonify(None), 400
+        if plan.kind == "vector":
+            return jsonify({"error": "Vector searches cannot be exported"}), 400
+
+        cursor: dict = open_pit()
+    except Exception:
+        gunicorn_logger.exception("Failed to start export")
+        return jsonify(None), 500
+
+    def generate() -> Iterator[str]:
+        try:
+            for hits in pit_batches(plan, cursor):
+                yield ndjson(hits)
+        finally:
+            close_pit(cursor)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=papers.ndjson"},
+    )
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,30 @@
+#!/bin/sh
+# Starts gunicorn, warms the caches from the query log (warmup.py), then creates
+# READY_FILE so /api/ready reports ready.
+READY_FILE="${READY_FILE:-/tmp/ready}"
+export READY_FILE
+rm -f "$READY_FILE"
+
+# metrics of every gunicorn worker are shared through this directory (metrics.py)
+PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+export PROMETHEUS_MULTIPROC_DIR
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+gunicorn server:app \
+    -b 0.0.0.0:8080 \
+    --access-logfile - \
+    --error-logfile - \
+    --log-level debug \
+    --capture-output \
+    --enable-stdio-inheritance &
+pid=$!
+trap 'kill -TERM $pid' TERM INT
+
+if [ -n "$QUERY_LOG" ]; then
+    python warmup.py --log "$QUERY_LOG" --ready-file "$READY_FILE"
+else
+    python warmup.py --ready-file "$READY_FILE"
+fi
+
+wait $pid
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Warms the caches of a freshly started server by replaying the most frequent
+/api/papers bodies from the query log (QUERY_LOG, see query_log.py), then creates
+the ready file so /api/ready starts answering 200. Replays carry an X-Warmup
+header, so the servers leave them out of the query log.
+
+Run by start.sh after the server starts. The ready file is created even when
+warmup fails or there is no log, so a deploy is never held back by it.
+
+Examples:
+  python warmup.py --log /app/query-logs --ready-file /tmp/ready
+  python warmup.py --log queries.jsonl --top 500 --url http://localhost:8080
+"""
+
+import argparse
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from query_log import WARMUP_HEADER, read_query_logs
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [warmup] %(message)s")
+logger = logging.getLogger("warmup")
+
+# fields query_log.QueryLog adds to each body
+LOG_FIELDS: tuple[str, ...] = ("ts", "latency_ms", "cache", "status")
+
+
+def wait_for_health(url: str, timeout: float) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/api/health", timeout=5) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(1)
+    return False
+
+
+def top_bodies(paths: list[str], top: int) -> list[str]:
+    """
+    The `top` most requested successful bodies, most frequent first, as JSON.
+    """
+    counts: Counter = Counter()
+    for entry in read_query_logs(paths):
+        if entry.get("status") != 200:
+            continue
+        body: dict = {
+            field: value for field, value in entry.items() if field not in LOG_FIELDS
+        }
+        counts[json.dumps(body, sort_keys=True)] += 1
+    return [body for body, _ in counts.most_common(top)]
+
+
+def post(url: str, body: str) -> bool:
+    request = urllib.request.Request(
+        f"{url}/api/papers",
+        data=body.encode("utf-8"),
+        headers={"Content-Type": "application/json", WARMUP_HEADER: "1"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def warm(url: str, bodies: list[str], concurrency: int) -> int:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(lambda body: post(url, body), bodies))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument(
+        "--log", action="append", default=[], help="query log file or directory"
+    )
+    parser.add_argument("--top", type=int, default=1000, help="distinct bodies")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--health-timeout", type=float, default=300.0)
+    parser.add_argument("--ready-file", help="created once warmup is done")
+    args = parser.parse_args()
+    url: str = args.url.rstrip("/")
+
+    try:
+        if not wait_for_health(url, args.health_timeout):
+            logger.warning("Server not healthy, skipping warmup")
+        else:
+            bodies: list[str] = top_bodies(args.log, args.top) if args.log else []
+            start: float = time.perf_counter()
+            ok: int = warm(url, bodies, args.concurrency) if bodies else 0
+            logger.info(
+                f"Warmed {ok}/{len(bodies)} queries in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+    except Exception:
+        logger.exception("Warmup failed")
+    finally:
+        if args.ready_file:
+            open(args.ready_file, "a").close()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ function AdvancedSearch({
 		"Authors",
 		"Category",
 		"Material",
+		"Composition",
 		"Description",
 		"Symmetry or Phase Labels",
 		"Synthesis",
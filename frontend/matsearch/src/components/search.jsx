@@ -9,6 +9,7 @@ function Search({ searchParams, to }) {
 		to === "/properties"
 			? [
 					"Material",
+					"Composition",
 					"Description",
 					"Symmetry or Phase Labels",
 					"Synthesis",
@@ -26,6 +27,7 @@ function Search({ searchParams, to }) {
 					"Authors",
 					"Category",
 					"Material",
+					"Composition",
 					"Description",
 					"Symmetry or Phase Labels",
 					"Synthesis",
@@ -21,6 +21,40 @@ function Favorites({ setPrevUrl, setPaperToUse }) {
 			JSON.parse(localStorage.getItem("highlightedStars")) || [];
 		setHighlightedStars(Array.isArray(storedStars) ? storedStars : []);
 		setPapersCopy(Array.isArray(storedStars) ? storedStars : []);
+
+		if (!Array.isArray(storedStars) || storedStars.length === 0) {
+			return;
+		}
+
+		// refresh the stored copies with the current papers in one request
+		const backend_url = import.meta.env.VITE_BACKEND_URL;
+
+		fetch(`${backend_url}/papers/batch`, {
+			method: "POST",
+			headers: {
+				"Content-Type": "application/json",
+			},
+			body: JSON.stringify({
+				// the server takes at most 200 ids, the rest keep their stored copies
+				ids: storedStars.slice(0, 200).map((paper) => paper.id),
+			}),
+		})
+			.then((response) => response.json())
+			.then((data) => {
+				if (!data?.papers) return;
+
+				const fresh = Object.fromEntries(
+					data.papers.map((paper) => [paper.id, paper]),
+				);
+				const hydrated = storedStars.map((paper) => fresh[paper.id] || paper);
+
+				setHighlightedStars(hydrated);
+				setPapersCopy(hydrated);
+				localStorage.setItem("highlightedStars", JSON.stringify(hydrated));
+			})
+			.catch(() => {
+				// keep showing the stored copies
+			});
 	}, []);
 
 	useEffect(() => {
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Compares the size and decode time of cached result pages stored as JSON text
+(the previous format) against msgpack + zstd (ResultCodec in
+backend/server/cache.py), with and without a zstd dictionary, and can train
+that dictionary.
+
+Papers come from a db_to_file.py dump (--bulk) or from saved /api/papers
+responses (--pages, see bench_highlight.py --save). Pages are rebuilt as the
+server caches them, (papers, total, inflated), --results papers at a time. The
+dictionary is trained on the first papers and measured on pages of the rest.
+
+Examples:
+  python bench_cache_codec.py --bulk db_output.ndjson --results 100
+  python bench_cache_codec.py --bulk db_output.ndjson --train cache.dict
+  # then run the server with CACHE_ZSTD_DICT=/path/to/cache.dict
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import msgpack  # type: ignore
+import zstandard
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from cache import ResultCodec
+
+EMBEDDING_FIELDS = ["summary_embedding", "title_embedding"]
+
+
+def load_papers(args):
+    papers = []
+    for path in args.bulk:
+        with open(path, "r") as f:
+            # bulk format: action line, then the source line
+            for i, line in enumerate(f):
+                if i % 2 == 1 and line.strip():
+                    papers.append(json.loads(line))
+    for path in args.pages:
+        with open(path, "r") as f:
+            pages = json.load(f)
+        for page in pages if isinstance(pages, list) else [pages]:
+            papers.extend(page["papers"])
+
+    for paper in papers:
+        for field in EMBEDDING_FIELDS:
+            paper.pop(field, None)
+    return papers
+
+
+def measure(pages, encode, decode, repeat):
+    sizes = []
+    decode_us = []
+    for page in pages:
+        raw = encode(page)
+        sizes.append(len(raw))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            decode(raw)
+        decode_us.append((time.perf_counter() - start) / repeat * 1e6)
+    return statistics.mean(sizes), statistics.median(decode_us)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bulk", action="append", default=[])
+    parser.add_argument("--pages", action="append", default=[])
+    parser.add_argument("--results", type=int, default=100, help="papers per page")
+    parser.add_argument("--dict-size", type=int, default=112640)
+    parser.add_argument("--train-papers", type=int, default=5000)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--train", help="write the trained dictionary to this file")
+    args = parser.parse_args()
+    if not args.bulk and not args.pages:
+        parser.error("give at least one --bulk or --pages file")
+
+    papers = load_papers(args)
+    split = min(args.train_papers, len(papers) // 2)
+    samples = [msgpack.packb(paper) for paper in papers[:split]]
+    dictionary = zstandard.train_dictionary(args.dict_size, samples).as_bytes()
+    if args.train:
+        with open(args.train, "wb") as f:
+            f.write(dictionary)
+        print(f"wrote {len(dictionary)} byte dictionary to {args.train}")
+
+    held_out = papers[split:]
+    pages = [
+        (held_out[i : i + args.results], 10000, -1)
+        for i in range(0, len(held_out) - args.results + 1, args.results)
+    ]
+    if not pages:
+        parser.error(f"need more than {2 * args.results} papers")
+
+    codecs = {
+        "msgpack+zstd": ResultCodec(level=args.level),
+        "msgpack+zstd+dict": ResultCodec(dictionary, args.level),
+    }
+    schemes = {
+        "json": (lambda page: json.dumps(page).encode("utf-8"), json.loads),
+        **{name: (codec.encode, codec.decode) for name, codec in codecs.items()},
+    }
+
+    print(f"{len(pages)} pages of {args.results} papers ({split} papers trained on)")
+    print(f"{'format':<20} {'bytes/page':>11} {'ratio':>6} {'decode us':>10}")
+    baseline = None
+    for name, (encode, decode) in schemes.items():
+        size, decode_us = measure(pages, encode, decode, args.repeat)
+        baseline = baseline or size
+        print(f"{name:<20} {size:>11.0f} {baseline / size:>5.1f}x {decode_us:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Benchmark of search result highlighting: the previous character sliding window
+(fuzz.ratio at every offset) against the token-aligned rapidfuzz matcher in
+backend/server/highlight.py.
+
+Pages are either fetched from a running server (POST /api/papers with
+"highlight": "offsets", so fields come back unmarked) or read from JSON files
+holding saved /api/papers responses.
+
+Examples:
+  python bench_highlight.py --query graphene --query "topological insulator" --save pages.json
+  python bench_highlight.py --pages pages.json --repeat 10
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from highlight import FIELDS_TO_HIGHLIGHT, apply_highlight_markup
+
+try:
+    from fuzzywuzzy import fuzz  # type: ignore
+except ImportError:
+    from rapidfuzz import fuzz
+
+BASE_URL = "http://localhost:8080"
+
+
+def legacy_fuzzy_mark_tags(text, terms, similarity_threshold):
+    """The previous implementation, kept here as the baseline."""
+    if not isinstance(text, str):
+        return text
+
+    matches = []
+    for term in terms:
+        text_lower = text.lower()
+        term_lower = term.lower()
+
+        window_size = len(term)
+        for i in range(len(text_lower) - window_size + 1):
+            window = text_lower[i : i + window_size]
+            score = fuzz.ratio(window.lower(), term_lower)
+
+            if score >= similarity_threshold:
+                matches.append(
+                    {
+                        "start": i,
+                        "end": i + window_size,
+                        "text": text[i : i + window_size],
+                        "score": score,
+                    }
+                )
+
+    matches.sort(key=lambda x: (-x["score"], x["start"]))
+
+    filtered_matches = []
+    for match in matches:
+        overlapping = False
+        for existing in filtered_matches:
+            if match["start"] < existing["end"] and match["end"] > existing["start"]:
+                overlapping = True
+                break
+        if not overlapping:
+            filtered_matches.append(match)
+
+    filtered_matches.sort(key=lambda x: x["start"])
+
+    result = ""
+    last_end = 0
+    for match in filtered_matches:
+        result += text[last_end : match["start"]]
+        result += f"<mark>{match['text']}</mark>"
+        last_end = match["end"]
+    result += text[last_end:]
+
+    return result
+
+
+def legacy_highlight_markup(source, highlighted_terms, fields_to_highlight):
+    for field in fields_to_highlight:
+        if field in highlighted_terms:
+            values = highlighted_terms[field]
+            if isinstance(source.get(field), list):
+                source[field] = [
+                    legacy_fuzzy_mark_tags(item, values, 80) for item in source[field]
+                ]
+            elif isinstance(source.get(field), str):
+                source[field] = legacy_fuzzy_mark_tags(source[field], values, 80)
+    return source
+
+
+def strip_marks(paper):
+    paper.pop("highlights", None)
+    for field, value in paper.items():
+        if isinstance(value, str):
+            paper[field] = re.sub(r"</?mark>", "", value)
+        elif isinstance(value, list):
+            paper[field] = [
+                re.sub(r"</?mark>", "", v) if isinstance(v, str) else v for v in value
+            ]
+    return paper
+
+
+def fetch_pages(url, queries, results):
+    pages = []
+    for query in queries:
+        response = requests.post(
+            f"{url}/api/papers",
+            json={
+                "searches": [
+                    {
+                        "term": query,
+                        "field": "Abstract",
+                        "operator": "AND",
+                        "isVector": False,
+                    }
+                ],
+                "results": results,
+                "highlight": "offsets",
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+        pages.append({"query": query, "papers": response.json()["papers"]})
+    return pages
+
+
+def time_page(highlighter, page, fields, repeat):
+    terms = {field: [page["query"]] for field in fields}
+    timings = []
+    for _ in range(repeat):
+        papers = copy.deepcopy(page["papers"])
+        start = time.perf_counter()
+        for paper in papers:
+            highlighter(paper, terms, FIELDS_TO_HIGHLIGHT)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--query", action="append", default=[])
+    parser.add_argument("--results", type=int, default=100)
+    parser.add_argument("--pages", action="append", default=[])
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--field", action="append", default=None)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, "r") as f:
+            pages.extend(json.load(f))
+    if args.query:
+        pages.extend(fetch_pages(args.url, args.query, args.results))
+    if not pages:
+        parser.error("give --pages and/or --query")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(pages, f)
+
+    for page in pages:
+        page["papers"] = [strip_marks(paper) for paper in page["papers"]]
+
+    fields = args.field or ["summary", "title"]
+    print(
+        f"{'query':<30} {'papers':>6} {'legacy ms':>10} {'new ms':>10} {'speedup':>8}"
+    )
+    for page in pages:
+        legacy = time_page(legacy_highlight_markup, page, fields, args.repeat)
+        new = time_page(apply_highlight_markup, page, fields, args.repeat)
+        print(
+            f"{page['query'][:30]:<30} {len(page['papers']):>6} "
+            f"{legacy:>10.2f} {new:>10.2f} {legacy / new if new else 0:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
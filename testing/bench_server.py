@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Offline latency benchmark of the search API: runs server.app in process (through
+Flask's test client) against fake_es.py and fakeredis, replays a query mix and
+reports throughput, p50/p95/p99 and the per stage timings of the Server-Timing
+header (see backend/server/metrics.py), so regressions in highlighting, caching
+or embedding show up without a cluster. The mix is replayed three times:
+
+  cold  - every cache empty
+  warm  - redis caches filled by the cold run, in-process caches emptied
+  hot   - everything left as the warm run left it (the L1 answers repeats)
+
+Needs the server's requirements plus fakeredis with Lua (the cache locks are Lua
+scripts): pip install "fakeredis[lua]". --fake-model swaps the embedding model
+for fake_es.hashed_embedding so nothing is downloaded; the embedding stage then
+no longer measures the model.
+
+Queries are replayed from query logs (--log, see backend/server/query_log.py) or
+drawn from a built-in mix of --term searches (text and vector, every sorting,
+first pages) with a few hot queries, like real traffic.
+
+Examples:
+  python bench_server.py --fake-model
+  python bench_server.py --bulk db_output.ndjson --log ../query-logs --es-latency 5
+  python bench_server.py --fake-model --concurrency 8 --json before.json
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import types
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_es
+import fakeredis
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), "..", "backend", "server")
+sys.path.insert(0, SERVER_DIR)
+
+from query_log import read_query_logs
+
+INDEX = "bench"
+DEFAULT_TERMS = [
+    "graphene",
+    "perovskite",
+    "lithium battery",
+    "topological insulator",
+    "superconductor",
+    "thin film",
+    "quantum dot",
+    "catalyst",
+]
+# fields query_log.QueryLog adds to each body
+LOG_FIELDS = ("ts", "latency_ms", "cache", "status")
+
+
+def build_mix(args):
+    if args.log:
+        bodies = [
+            {field: value for field, value in entry.items() if field not in LOG_FIELDS}
+            for entry in read_query_logs(args.log)
+            if entry.get("status", 200) == 200
+        ]
+        return bodies[: args.requests] if args.requests else bodies
+
+    queries = []
+    for term in args.term:
+        for field, vector, sorting in [
+            ("Abstract", False, "Most-Relevant"),
+            ("Abstract", True, "Most-Relevant"),
+            ("Title", True, "Most-Relevant"),
+            ("Abstract", False, "Most-Recent"),
+            ("Abstract", False, "Oldest-First"),
+        ]:
+            for page in (1, 2, 3):
+                queries.append(
+                    {
+                        "searches": [
+                            {
+                                "term": term,
+                                "field": field,
+                                "operator": "AND",
+                                "isVector": vector,
+                            }
+                        ],
+                        "sorting": sorting,
+                        "page": page,
+                        "results": 10,
+                    }
+                )
+    # zipf like popularity, so some queries repeat within a run
+    rng = random.Random(args.seed)
+    rng.shuffle(queries)
+    weights = [1 / (rank + 1) for rank in range(len(queries))]
+    return rng.choices(queries, weights, k=args.requests or 500)
+
+
+def start_fake_es(args):
+    """
+    Starts fake_es.py in its own process, returns it, its URL and the corpus size.
+    """
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(__file__), "fake_es.py"),
+        "--port",
+        "0",
+        "--papers",
+        str(args.papers),
+        "--latency",
+        str(args.es_latency),
+        "--jitter",
+        str(args.es_jitter),
+        "--seed",
+        str(args.seed),
+    ]
+    for path in args.bulk:
+        command += ["--bulk", path]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # "serving <n> papers on <url>"
+    words = process.stdout.readline().split()
+    if not words:
+        sys.exit("fake_es.py failed to start")
+    return process, words[-1], int(words[1])
+
+
+def take_es_calls(es_url):
+    with urllib.request.urlopen(f"{es_url}/_calls") as response:
+        return json.load(response)
+
+
+def install_fake_model():
+    """
+    Stands a hashed encoder in for sentence_transformers, before server imports it.
+    """
+
+    class SentenceTransformer:
+        def __init__(self, name):
+            self.name = name
+
+        def encode(self, text):
+            return fake_es.hashed_embedding(text)
+
+    module = types.ModuleType("sentence_transformers")
+    module.SentenceTransformer = SentenceTransformer
+    sys.modules["sentence_transformers"] = module
+
+
+def import_server(es_url, verbose):
+    import redis
+
+    os.environ.update(ES_URL=es_url, INDEX=INDEX, CERT_PATH="")
+    for name in ("API_KEY", "QUERY_LOG", "READY_FILE", "PROMETHEUS_MULTIPROC_DIR"):
+        os.environ.pop(name, None)
+    if not verbose:
+        logging.getLogger("gunicorn.error").addHandler(logging.NullHandler())
+
+    fake_redis = fakeredis.FakeServer()
+    redis.StrictRedis = functools.partial(fakeredis.FakeStrictRedis, server=fake_redis)
+
+    import server
+
+    if not server.redis_success:
+        sys.exit("could not connect to fakeredis")
+    return server
+
+
+def clear_caches(server, keep_redis):
+    """
+    Empties the in-process caches, and redis unless keep_redis is set.
+    """
+    if not keep_redis:
+        server.redis_client.flushall()
+    server.embedding_cache.local.clear()
+    if server.paper_cache.local is not None:
+        server.paper_cache.local.clear()
+    if server.page_bodies is not None:
+        server.page_bodies = type(server.page_bodies)(
+            server.PAGE_L1_BYTES, server.PAGE_L1_TTL
+        )
+    server.index_size.clear()
+
+
+def parse_server_timing(header):
+    timings = {}
+    for metric in header.split(","):
+        name, _, duration = metric.strip().partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+
+def replay(server, bodies, concurrency):
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def send(body):
+        if not hasattr(local, "client"):
+            local.client = server.app.test_client()
+        start = time.perf_counter()
+        response = local.client.post("/api/papers", json=body)
+        latency = time.perf_counter() - start
+        timings = parse_server_timing(response.headers.get("Server-Timing", ""))
+        with lock:
+            results.append((latency, response.status_code, timings))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, bodies))
+    return results, time.perf_counter() - start
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def summarize(results, elapsed, es_calls):
+    latencies = [latency * 1000 for latency, status, _ in results if status == 200]
+    stages = {}
+    for _, _, timings in results:
+        for stage, ms in timings.items():
+            if stage != "total":
+                stages.setdefault(stage, []).append(ms)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "throughput": len(results) / elapsed,
+        "p50": percentile(latencies, 50) if latencies else None,
+        "p95": percentile(latencies, 95) if latencies else None,
+        "p99": percentile(latencies, 99) if latencies else None,
+        "es_calls": dict(es_calls),
+        "stages": {
+            stage: {
+                "count": len(values),
+                "mean": statistics.mean(values),
+                "p95": percentile(values, 95),
+                "total": sum(values),
+            }
+            for stage, values in stages.items()
+        },
+    }
+
+
+def report(phase, summary):
+    calls = ", ".join(f"{name} {n}" for name, n in sorted(summary["es_calls"].items()))
+    print(
+        f"\n{phase}: {summary['requests']} requests, {summary['errors']} errors, "
+        f"{summary['throughput']:.1f} req/s, ES calls: {calls or 'none'}"
+    )
+    if summary["p50"] is not None:
+        print(
+            f"  latency ms  p50 {summary['p50']:.2f}  p95 {summary['p95']:.2f}  "
+            f"p99 {summary['p99']:.2f}"
+        )
+    print(f"  {'stage':<18} {'count':>6} {'mean ms':>9} {'p95 ms':>9} {'total ms':>10}")
+    stages = sorted(summary["stages"].items(), key=lambda item: -item[1]["total"])
+    for stage, s in stages:
+        print(
+            f"  {stage:<18} {s['count']:>6} {s['mean']:>9.3f} {s['p95']:>9.3f} "
+            f"{s['total']:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bulk", action="append", default=[], help="corpus dump")
+    parser.add_argument("--papers", type=int, default=2000, help="synthetic papers")
+    parser.add_argument("--log", action="append", default=[], help="query log")
+    parser.add_argument("--term", action="append", default=[])
+    parser.add_argument("--requests", type=int, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--es-latency", type=float, default=0.0, help="ms")
+    parser.add_argument("--es-jitter", type=float, default=0.0, help="mean extra ms")
+    parser.add_argument("--fake-model", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+    args.term = args.term or DEFAULT_TERMS
+
+    bodies = build_mix(args)
+    if not bodies:
+        parser.error("no queries to replay")
+
+    es, es_url, papers = start_fake_es(args)
+    try:
+        if args.fake_model:
+            install_fake_model()
+        server = import_server(es_url, args.verbose)
+
+        print(
+            f"{papers} papers, {len(bodies)} requests "
+            f"({len({json.dumps(b, sort_keys=True) for b in bodies})} distinct), "
+            f"concurrency {args.concurrency}, ES latency {args.es_latency} ms"
+        )
+        results = {}
+        for phase in ("cold", "warm", "hot"):
+            if phase != "hot":
+                clear_caches(server, keep_redis=phase == "warm")
+            take_es_calls(es_url)
+            replayed, elapsed = replay(server, bodies, args.concurrency)
+            results[phase] = summarize(replayed, elapsed, take_es_calls(es_url))
+            report(phase, results[phase])
+    finally:
+        es.terminate()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
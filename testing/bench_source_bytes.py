@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Measures the bytes Elasticsearch sends back for a page of search results with
+and without the embedding fields in _source, plus the time to decode them.
+
+Talks to Elasticsearch directly (same env as the server, backend/server/env/.env).
+
+Examples:
+  python bench_source_bytes.py --query graphene --results 100
+"""
+
+import argparse
+import json
+import os
+import time
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv(
+    dotenv_path=os.path.join(
+        os.path.dirname(__file__), "..", "backend", "server", "env", ".env"
+    )
+)
+
+EMBEDDING_FIELDS = ["summary_embedding", "title_embedding"]
+
+
+def fetch(url, headers, verify, body):
+    response = requests.post(url, headers=headers, json=body, verify=verify, timeout=60)
+    response.raise_for_status()
+    start = time.perf_counter()
+    json.loads(response.content)
+    decode_ms = (time.perf_counter() - start) * 1000
+    return len(response.content), decode_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--query", action="append", default=[])
+    parser.add_argument("--results", type=int, default=20)
+    args = parser.parse_args()
+    if not args.query:
+        parser.error("give at least one --query")
+
+    url = f"{os.getenv('ES_URL')}/{os.getenv('INDEX', '')}/_search"
+    headers = {"Authorization": f"ApiKey {os.getenv('API_KEY')}"}
+    verify = os.getenv("CERT_PATH") or True
+
+    print(
+        f"{'query':<30} {'full bytes':>11} {'excl bytes':>11} {'ratio':>6} "
+        f"{'full dec ms':>11} {'excl dec ms':>11}"
+    )
+    for query in args.query:
+        body = {
+            "query": {"match": {"summary": {"query": query, "fuzziness": "AUTO"}}},
+            "size": args.results,
+        }
+        full, full_ms = fetch(url, headers, verify, body)
+        excl, excl_ms = fetch(
+            url, headers, verify, {**body, "_source": {"excludes": EMBEDDING_FIELDS}}
+        )
+        print(
+            f"{query[:30]:<30} {full:>11} {excl:>11} {full / excl:>5.1f}x "
+            f"{full_ms:>11.2f} {excl_ms:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the hybrid vector search round trips against Elasticsearch: the
+previous knn search followed by a second fuzzy search for the total, against
+both sent in one _msearch (what handle_vector_search does now).
+
+Talks to Elasticsearch directly (same env as the server, backend/server/env/.env)
+so the server's response cache does not get in the way.
+
+Examples:
+  python bench_vector_search.py --query graphene --query "topological insulator"
+  python bench_vector_search.py --query perovskite --repeat 20 --results 50
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch
+from sentence_transformers import SentenceTransformer  # type: ignore
+
+load_dotenv(
+    dotenv_path=os.path.join(
+        os.path.dirname(__file__), "..", "backend", "server", "env", ".env"
+    )
+)
+
+
+def bodies(query, vector, num_results, num_candidates):
+    fuzzy = {"match": {"summary": {"query": query, "fuzziness": "AUTO"}}}
+    knn_body = {
+        "knn": {
+            "field": "summary_embedding",
+            "query_vector": vector,
+            "num_candidates": num_candidates,
+            "k": num_results,
+        },
+        "query": {"bool": {"must": []}},
+        "size": num_results,
+        "sort": ["_score"],
+    }
+    total_body = {"query": {"bool": {"must": [fuzzy]}}}
+    return knn_body, total_body
+
+
+def sequential(client, index, knn_body, total_body):
+    client.search(index=index, **knn_body)
+    client.search(index=index, size=knn_body["size"], **total_body)
+
+
+def single_msearch(client, index, knn_body, total_body):
+    client.msearch(
+        searches=[
+            {"index": index},
+            {**knn_body, "track_total_hits": False},
+            {"index": index},
+            {**total_body, "size": 0},
+        ]
+    )
+
+
+def time_strategy(strategy, client, index, knn_body, total_body, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        strategy(client, index, knn_body, total_body)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--query", action="append", default=[])
+    parser.add_argument("--results", type=int, default=20)
+    parser.add_argument("--candidates", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    if not args.query:
+        parser.error("give at least one --query")
+
+    client = Elasticsearch(
+        os.getenv("ES_URL"),
+        api_key=os.getenv("API_KEY"),
+        ca_certs=os.getenv("CERT_PATH", ""),
+    )
+    index = os.getenv("INDEX", "")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+
+    print(f"{'query':<30} {'2 searches ms':>14} {'msearch ms':>11} {'speedup':>8}")
+    for query in args.query:
+        vector = model.encode(query).tolist()
+        knn_body, total_body = bodies(query, vector, args.results, args.candidates)
+
+        # warm up caches on both paths before timing
+        sequential(client, index, knn_body, total_body)
+        single_msearch(client, index, knn_body, total_body)
+
+        before, _ = time_strategy(
+            sequential, client, index, knn_body, total_body, args.repeat
+        )
+        after, _ = time_strategy(
+            single_msearch, client, index, knn_body, total_body, args.repeat
+        )
+        print(
+            f"{query[:30]:<30} {before:>14.2f} {after:>11.2f} "
+            f"{before / after if after else 0:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
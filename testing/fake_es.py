@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Small HTTP stand-in for Elasticsearch, covering the part of the API the search
+server uses: _search (query, knn, sort, from/size, search_after on a point in
+time), _msearch, _count, _mget and point in time open/close. Answers come from
+an in-memory corpus and are recorded per request body. Every request takes at
+least --latency ms (the stand-in's own work included) plus an exponential
+--jitter, so timings do not depend on how fast the stand-in searches. GET
+/_calls returns (and resets) the number of requests per endpoint. Run as its own
+process by bench_server.py, so it does not compete with the server for the GIL.
+
+The corpus is a db_to_file.py dump (--bulk, as in bench_cache_codec.py) or
+synthetic papers. Papers without embeddings get hashed_embedding vectors.
+
+Example:
+  python fake_es.py --bulk db_output.ndjson --port 9201 --latency 5
+  ES_URL=http://localhost:9201 INDEX=bench gunicorn server:app
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+DIMS = 384
+EMBEDDING_FIELDS = ["summary_embedding", "title_embedding"]
+TEXT_FIELDS = [
+    "summary",
+    "title",
+    "authors",
+    "categories",
+    "MAT",
+    "DSC",
+    "SPL",
+    "SMT",
+    "CMT",
+    "PRO",
+    "APL",
+]
+TOKEN = re.compile(r"[a-z0-9]+")
+
+WORDS = TOKEN.findall(
+    "graphene perovskite oxide thin film superconductor magnetic spin orbit "
+    "topological insulator lithium battery cathode anode electrolyte catalyst "
+    "nanowire quantum dot phonon exciton semiconductor heterostructure strain "
+    "ferroelectric polymer alloy crystal defect diffusion annealing sputtering"
+)
+METHODS = ["sol-gel", "CVD", "MBE", "ball milling", "hydrothermal", "sputtering"]
+MATERIALS = ["LiFePO4", "MoS2", "BaTiO3", "GaN", "Bi2Se3", "SrTiO3", "CsPbI3"]
+# Elasticsearch counts hits up to this many unless told otherwise
+TRACK_TOTAL_HITS = 10000
+
+
+def hashed_embedding(text):
+    """
+    Deterministic unit vector for a text, a stand-in for the embedding model.
+    """
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).standard_normal(DIMS).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    papers = []
+    for i in range(n):
+        papers.append(
+            {
+                "id": f"{2401 + i // 10000}.{i % 10000:05d}",
+                "title": " ".join(rng.choices(WORDS, k=8)).capitalize(),
+                "summary": " ".join(rng.choices(WORDS, k=150)).capitalize() + ".",
+                "authors": [f"Author {rng.randint(1, 500)}" for _ in range(3)],
+                "categories": ["cond-mat.mtrl-sci"],
+                "date": int(f"20{rng.randint(15, 25)}{rng.randint(1, 12):02d}01"),
+                "MAT": rng.sample(MATERIALS, 2),
+                "SMT": rng.sample(METHODS, 1),
+                "PRO": rng.sample(WORDS, 2),
+                "APL": rng.sample(WORDS, 1),
+            }
+        )
+    return papers
+
+
+def load_corpus(paths):
+    papers = []
+    for path in paths:
+        with open(path, "r") as f:
+            # bulk format: action line, then the source line
+            for i, line in enumerate(f):
+                if i % 2 == 1 and line.strip():
+                    papers.append(json.loads(line))
+    return papers
+
+
+def tokens(value):
+    if isinstance(value, list):
+        value = " ".join(str(item) for item in value)
+    return TOKEN.findall(str(value).lower())
+
+
+class Corpus:
+    def __init__(self, papers):
+        self.ids = [str(paper["id"]) for paper in papers]
+        self.sources = dict(zip(self.ids, papers))
+        self.tokens = [
+            {field: Counter(tokens(paper.get(field, ""))) for field in TEXT_FIELDS}
+            for paper in papers
+        ]
+        self.vectors = {
+            field: np.vstack(
+                [
+                    np.asarray(paper[field], dtype=np.float32)
+                    if paper.get(field)
+                    else hashed_embedding(paper.get(field.split("_")[0], pid))
+                    for pid, paper in zip(self.ids, papers)
+                ]
+            )
+            for field in EMBEDDING_FIELDS
+        }
+
+    def score(self, query, i):
+        """
+        Score of paper i for the query, None when it does not match.
+        """
+        if not query or "match_all" in query:
+            return 1.0
+        if "match" in query:
+            ((field, match),) = query["match"].items()
+            text = match["query"] if isinstance(match, dict) else match
+            counts = self.tokens[i].get(field)
+            if counts is None:
+                counts = Counter(tokens(self.sources[self.ids[i]].get(field, "")))
+            score = sum(counts[token] for token in tokens(text))
+            return float(score) if score else None
+        if "term" in query or "terms" in query:
+            ((field, value),) = (query.get("term") or query["terms"]).items()
+            if isinstance(value, dict):
+                value = value.get("value")
+            values = value if isinstance(value, list) else [value]
+            found = self.sources[self.ids[i]].get(field)
+            found = found if isinstance(found, list) else [found]
+            return 1.0 if any(v in found for v in values) else None
+        if "ids" in query:
+            return 1.0 if self.ids[i] in query["ids"]["values"] else None
+        if "range" in query:
+            ((field, bounds),) = query["range"].items()
+            value = self.sources[self.ids[i]].get(field)
+            if value is None:
+                return None
+            if "gte" in bounds and value < bounds["gte"]:
+                return None
+            if "lte" in bounds and value > bounds["lte"]:
+                return None
+            return 0.0
+        if "bool" in query:
+            return self.bool_score(query["bool"], i)
+        raise ValueError(f"unsupported query {list(query)}")
+
+    def bool_score(self, clauses, i):
+        total = 0.0
+        for clause in clauses.get("must", []):
+            score = self.score(clause, i)
+            if score is None:
+                return None
+            total += score
+        for clause in clauses.get("filter", []):
+            if self.score(clause, i) is None:
+                return None
+        for clause in clauses.get("must_not", []):
+            if self.score(clause, i) is not None:
+                return None
+        should = [self.score(clause, i) for clause in clauses.get("should", [])]
+        matched = [score for score in should if score is not None]
+        # like Elasticsearch, should clauses are only required on their own
+        if (
+            should
+            and not matched
+            and not clauses.get("must")
+            and not clauses.get("filter")
+        ):
+            return None
+        return total + sum(matched)
+
+    def matches(self, query):
+        scores = {}
+        for i in range(len(self.ids)):
+            score = self.score(query, i)
+            if score is not None:
+                scores[i] = score
+        return scores
+
+
+def sort_spec(sort):
+    spec = []
+    for item in sort or ["_score"]:
+        if isinstance(item, str):
+            spec.append((item, "desc" if item == "_score" else "asc"))
+        else:
+            ((field, options),) = item.items()
+            order = (
+                options.get("order", "asc") if isinstance(options, dict) else options
+            )
+            spec.append((field, order))
+    return spec
+
+
+def total_hits(count, track):
+    """
+    hits.total as Elasticsearch reports it for track_total_hits, None (left out
+    of the response) when totals are off.
+    """
+    if track is False:
+        return None
+    limit = None if track is True else int(track)
+    if limit is not None and count > limit:
+        return {"value": limit, "relation": "gte"}
+    return {"value": count, "relation": "eq"}
+
+
+class FakeElasticsearch:
+    def __init__(self, papers, latency_ms=0.0, jitter_ms=0.0, seed=0):
+        self.corpus = Corpus(papers)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rng = random.Random(seed)
+        self.recorded = {}
+        self.pits = set()
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    # requests
+
+    def delay(self, start):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.rng.expovariate(1 / self.jitter) if self.jitter else 0.0
+            time.sleep(max(0.0, start + self.latency + extra - time.perf_counter()))
+
+    def search(self, body, params):
+        body = dict(body)
+        pit = body.pop("pit", None)
+        if pit is not None and pit["id"] not in self.pits:
+            raise KeyError(pit["id"])
+        excludes = params.get("_source_excludes", [""])[0].split(",")
+        key = json.dumps([body, excludes], sort_keys=True)
+        with self.lock:
+            response = self.recorded.get(key)
+        if response is None:
+            response = self.run_search(body, [e for e in excludes if e])
+            with self.lock:
+                self.recorded[key] = response
+        if pit is not None:
+            response = {**response, "pit_id": pit["id"]}
+        return response
+
+    def run_search(self, body, excludes):
+        corpus = self.corpus
+        scores = corpus.matches(body.get("query"))
+        knn = body.get("knn")
+        if knn is not None:
+            similarity = corpus.vectors[knn["field"]] @ np.asarray(
+                knn["query_vector"], dtype=np.float32
+            )
+            nearest = sorted(scores, key=lambda i: -similarity[i])[: knn["k"]]
+            scores = {i: float(similarity[i]) for i in nearest}
+
+        spec = sort_spec(body.get("sort"))
+
+        def value(i, field):
+            if field == "_score":
+                return scores[i]
+            if field == "_shard_doc":
+                return i
+            # keyword subfields sort like the field itself
+            field = field.removesuffix(".keyword")
+            return corpus.sources[corpus.ids[i]].get(field, 0)
+
+        ranked = list(scores)
+        for field, order in reversed(spec):
+            ranked.sort(key=lambda i: value(i, field), reverse=order == "desc")
+
+        search_after = body.get("search_after")
+        if search_after is not None:
+
+            def after(i):
+                for (field, order), last in zip(spec, search_after):
+                    v = value(i, field)
+                    if v != last:
+                        return v > last if order == "asc" else v < last
+                return False
+
+            ranked = [i for i in ranked if after(i)]
+        start = body.get("from", 0)
+        page = ranked[start : start + body.get("size", 10)]
+
+        source = body.get("_source", True)
+        if isinstance(source, dict):
+            excludes = excludes + source.get("excludes", [])
+        hits = []
+        for i in page:
+            hit = {"_index": "bench", "_id": corpus.ids[i], "_score": scores[i]}
+            if source is not False:
+                hit["_source"] = {
+                    field: v
+                    for field, v in corpus.sources[corpus.ids[i]].items()
+                    if field not in excludes
+                }
+            if body.get("sort"):
+                hit["sort"] = [value(i, field) for field, _ in spec]
+            hits.append(hit)
+
+        response_hits = {
+            "max_score": max(scores.values(), default=None),
+            "hits": hits,
+        }
+        total = total_hits(len(scores), body.get("track_total_hits", TRACK_TOTAL_HITS))
+        if total is not None:
+            response_hits["total"] = total
+        response = {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": response_hits,
+        }
+        if body.get("profile"):
+            # no timings to report, just the shape
+            response["profile"] = {"shards": []}
+        return response
+
+    def mget(self, body, params):
+        excludes = params.get("_source_excludes", [""])[0].split(",")
+        ids = body.get("ids") or [doc["_id"] for doc in body.get("docs", [])]
+        docs = []
+        for pid in ids:
+            source = self.corpus.sources.get(pid)
+            if source is None:
+                docs.append({"_index": "bench", "_id": pid, "found": False})
+                continue
+            docs.append(
+                {
+                    "_index": "bench",
+                    "_id": pid,
+                    "found": True,
+                    "_source": {f: v for f, v in source.items() if f not in excludes},
+                }
+            )
+        return {"docs": docs}
+
+    def open_pit(self):
+        pit_id = uuid.uuid4().hex
+        with self.lock:
+            self.pits.add(pit_id)
+        return {"id": pit_id}
+
+    def close_pit(self, body):
+        with self.lock:
+            found = body.get("id") in self.pits
+            self.pits.discard(body.get("id"))
+        return {"succeeded": found, "num_freed": int(found)}
+
+    def handle(self, method, path, params, raw):
+        """
+        Returns (status, response) for a request, after the configured latency.
+        """
+        if path == "/_calls":
+            return 200, dict(self.take_calls())
+
+        start = time.perf_counter()
+        parts = [part for part in path.split("/") if part]
+        endpoint = parts[-1] if parts else ""
+        with self.lock:
+            self.calls[endpoint] += 1
+        try:
+            return self.respond(method, path, endpoint, params, raw)
+        finally:
+            self.delay(start)
+
+    def respond(self, method, path, endpoint, params, raw):
+        try:
+            if endpoint == "_msearch":
+                lines = [json.loads(line) for line in raw.splitlines() if line.strip()]
+                responses = []
+                for body in lines[1::2]:
+                    responses.append({**self.search(body, {}), "status": 200})
+                return 200, {"took": 1, "responses": responses}
+            body = json.loads(raw) if raw.strip() else {}
+            if endpoint == "_search":
+                return 200, self.search(body, params)
+            if endpoint == "_count":
+                return 200, {"count": len(self.corpus.matches(body.get("query")))}
+            if endpoint == "_mget":
+                return 200, self.mget(body, params)
+            if endpoint == "_pit" and method == "DELETE":
+                return 200, self.close_pit(body)
+            if endpoint == "_pit":
+                return 200, self.open_pit()
+        except KeyError as e:
+            return 404, error("search_context_missing_exception", f"No context {e}")
+        return 404, error("resource_not_found_exception", f"{method} {path}")
+
+    # server
+
+    def start(self, port=0):
+        """
+        Serves in a background thread, returns the URL.
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes, don't wait on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8") if length else ""
+                status, response = fake.handle(
+                    self.command, url.path, parse_qs(url.query), raw
+                )
+                payload = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_DELETE = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def take_calls(self):
+        with self.lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+
+def error(kind, reason):
+    return {"error": {"type": kind, "reason": reason}, "status": 404}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bulk", action="append", default=[])
+    parser.add_argument("--papers", type=int, default=2000, help="synthetic papers")
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mean extra ms")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    papers = (
+        load_corpus(args.bulk)
+        if args.bulk
+        else synthetic_corpus(args.papers, args.seed)
+    )
+    fake = FakeElasticsearch(papers, args.latency, args.jitter, args.seed)
+    print(f"serving {len(papers)} papers on {fake.start(args.port)}", flush=True)
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
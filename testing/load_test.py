@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Load test of the search API: keeps a fixed number of /api/papers requests in
+flight for a while at each concurrency level and reports throughput and latency,
+so the sync (gunicorn) and async (uvicorn) servers can be compared per core.
+
+Queries are read from a JSON lines log of /api/papers bodies (such as the server's
+QUERY_LOG files, see backend/server/query_log.py) or built from --query terms. Every request gets a fresh
+date range unless --cached is given, so the response cache does not answer them.
+
+Examples:
+  # sync server, 2 workers       gunicorn -w 2 -b 0.0.0.0:8080 server:app
+  # async server, 2 workers      uvicorn async_server:app --port 8080 --workers 2
+  python load_test.py --query graphene --query perovskite --concurrency 1 8 32 64
+  python load_test.py --log queries.jsonl --duration 30 --cores 2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+
+import aiohttp
+
+
+def build_bodies(args):
+    if args.log:
+        with open(args.log, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    return [
+        {
+            "searches": [
+                {
+                    "term": term,
+                    "field": "Abstract",
+                    "operator": "AND",
+                    "isVector": args.vector,
+                }
+            ],
+            "sorting": "Most-Relevant",
+            "page": 1,
+            "results": 10,
+        }
+        for term in args.query
+    ]
+
+
+async def run_level(session, url, bodies, concurrency, duration, cached):
+    latencies = []
+    errors = 0
+    bodies_cycle = itertools.cycle(bodies)
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            body = dict(next(bodies_cycle))
+            if not cached:
+                # a distinct start date per request misses the response cache
+                body["date"] = f"{next(counter) % 10000000:08d}-99991231"
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json=body) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def main_async(args):
+    url = args.url.rstrip("/") + "/api/papers"
+    bodies = build_bodies(args)
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency))
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    print(
+        f"{'conc':>5} {'req/s':>8} {'req/s/core':>10} {'p50 ms':>8} {'p95 ms':>8} {'err':>5}"
+    )
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = await run_level(
+                session, url, bodies, concurrency, args.duration, args.cached
+            )
+            if not latencies:
+                print(f"{concurrency:>5} no successful requests ({errors} errors)")
+                continue
+            throughput = len(latencies) / elapsed
+            print(
+                f"{concurrency:>5} {throughput:>8.1f} {throughput / args.cores:>10.1f} "
+                f"{percentile(latencies, 50) * 1000:>8.1f} "
+                f"{percentile(latencies, 95) * 1000:>8.1f} {errors:>5}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--log", help="JSON lines of /api/papers bodies")
+    parser.add_argument("--query", action="append", default=[])
+    parser.add_argument("--vector", action="store_true", help="vector searches")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--cores", type=int, default=1, help="cores given to the server"
+    )
+    parser.add_argument(
+        "--cached", action="store_true", help="let the response cache answer"
+    )
+    args = parser.parse_args()
+    if not args.log and not args.query:
+        parser.error("one of --log or --query is required")
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Replays a log of /api/papers request bodies (one JSON object per line, optionally
+with a "ts" unix timestamp, such as the server's QUERY_LOG files) and compares how
+often each caching scheme of the server would have answered without querying
+Elasticsearch:
+
+  page    - the response cache alone, keyed by query, page and page size
+  window  - the response cache plus the result-window cache, which keeps the
+            top RESULT_WINDOW ranked ids per query and grows on demand
+
+Both are replayed twice: with the searches keyed verbatim (the previous keys)
+and canonicalised the way the server keys them now (search.canonical_searches).
+
+Examples:
+  python replay_cache_hits.py queries.jsonl
+  python replay_cache_hits.py queries.jsonl --ttl 86400 --window 200
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from search import canonical_searches
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_WINDOW = 200
+MAX_RESULT_WINDOW = 10000
+
+
+def request_keys(body, canonical):
+    searches = body.get("searches", [])
+    searches = json.dumps(canonical_searches(searches) if canonical else searches)
+    sorting = str(body.get("sorting", "Most-Recent"))
+    date = str(body.get("date", ""))
+    page = int(body.get("page", 1))
+    results = int(body.get("results", 10))
+    highlight = str(body.get("highlight", "markup"))
+
+    query_key = (searches, sorting, date)
+    page_key = (*query_key, page, results, highlight)
+    return query_key, page_key, page * results
+
+
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.data = {}
+
+    def get(self, key, now):
+        entry = self.data.get(key)
+        if entry is None or (self.ttl and now - entry[0] > self.ttl):
+            return None
+        return entry[1]
+
+    def set(self, key, value, now):
+        self.data[key] = (now, value)
+
+
+def replay(records, ttl, window_size, canonical):
+    pages = TTLCache(ttl)
+    window_pages = TTLCache(ttl)
+    windows = TTLCache(ttl)
+    counts = {"requests": 0, "page_hits": 0, "window_page_hits": 0, "window_hits": 0}
+
+    for i, body in enumerate(records):
+        now = float(body.get("ts", i))
+        query_key, page_key, depth = request_keys(body, canonical)
+        counts["requests"] += 1
+
+        # previous scheme: one response cache entry per page
+        if pages.get(page_key, now) is not None:
+            counts["page_hits"] += 1
+        else:
+            pages.set(page_key, True, now)
+
+        # window scheme: response cache first, then the window of ids
+        if window_pages.get(page_key, now) is not None:
+            counts["window_page_hits"] += 1
+            continue
+        window_pages.set(page_key, True, now)
+
+        cached_depth = windows.get(query_key, now)
+        if cached_depth is not None and cached_depth >= min(depth, MAX_RESULT_WINDOW):
+            counts["window_hits"] += 1
+        else:
+            target = min(MAX_RESULT_WINDOW, -(-depth // window_size) * window_size)
+            windows.set(query_key, max(target, cached_depth or 0), now)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("log", nargs="+", help="JSON lines of /api/papers bodies")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TTL)
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    args = parser.parse_args()
+
+    records = []
+    for path in args.log:
+        with open(path, "r") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda body: body.get("ts", 0))
+
+    for canonical in (False, True):
+        counts = replay(records, args.ttl, args.window, canonical)
+        total = counts["requests"] or 1
+        page_ratio = counts["page_hits"] / total
+        window_ratio = (counts["window_page_hits"] + counts["window_hits"]) / total
+
+        print(f"--- {'canonical' if canonical else 'verbatim'} query keys")
+        print(f"requests:                 {counts['requests']}")
+        print(f"page cache hit ratio:     {page_ratio:.1%}")
+        print(
+            f"page + window hit ratio:  {window_ratio:.1%} "
+            f"({counts['window_hits']} served from a cached window)"
+        )
+        print(
+            f"elasticsearch queries:    {total - counts['page_hits']} -> "
+            f"{total - counts['window_page_hits'] - counts['window_hits']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the search caches (backend/server/cache.py): single flight
+coalescing, stale-while-revalidate refreshes, the cached result format and the
+in-process byte-bounded LRU, and the index size. Redis is fakeredis (pip install "fakeredis[lua]"),
+no server needed:
+
+  python test_cache.py
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+import fakeredis
+import redis.exceptions
+import zstandard
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from cache import (
+    AsyncIndexSize,
+    AsyncSingleFlight,
+    BytesLRUCache,
+    IndexSize,
+    ResultCodec,
+    SingleFlight,
+)
+
+
+def train_dictionary(seed: int) -> bytes:
+    samples = [
+        json.dumps({"id": f"{seed}.{i}", "title": f"paper {i * seed} on graphene"})
+        for i in range(2000)
+    ]
+    return zstandard.train_dictionary(
+        2048, [sample.encode() for sample in samples], dict_id=seed
+    ).as_bytes()
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+
+    def test_concurrent_callers_share_one_computation(self):
+        flight = SingleFlight(self.redis)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "page"
+
+        results = []
+
+        def call():
+            results.append(flight.do("key", compute, lambda: None))
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["page"] * 4)
+        self.assertFalse(self.redis.exists(SingleFlight.lock_name("key")))
+
+    def test_other_worker_waits_for_the_value(self):
+        # another worker holds the lock and writes the value after a while
+        lock = self.redis.lock(
+            SingleFlight.lock_name("key"), timeout=30, thread_local=False
+        )
+        self.assertTrue(lock.acquire(blocking=False))
+        flight = SingleFlight(self.redis, poll=0.01)
+
+        def write():
+            time.sleep(0.05)
+            self.redis.set("key", "page")
+            lock.release()
+
+        threading.Thread(target=write).start()
+        calls = []
+        result = flight.do(
+            "key", lambda: calls.append(1) or "computed", lambda: self.redis.get("key")
+        )
+        self.assertEqual(result, b"page")
+        self.assertEqual(calls, [])
+
+    def test_computes_when_the_lock_goes_away_without_a_value(self):
+        lock = self.redis.lock(
+            SingleFlight.lock_name("key"), timeout=30, thread_local=False
+        )
+        lock.acquire(blocking=False)
+        threading.Timer(0.05, lock.release).start()
+
+        flight = SingleFlight(self.redis, poll=0.01)
+        self.assertEqual(flight.do("key", lambda: "computed", lambda: None), "computed")
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", lambda: int("x"), lambda: None)
+        # nothing left in flight, the next call computes again
+        self.assertEqual(flight.do("key", lambda: 1, lambda: None), 1)
+
+    def test_stale_value_served_while_refreshing(self):
+        codec = ResultCodec()
+        self.redis.set("page", codec.encode_entry("old", -1))
+        flight = SingleFlight(self.redis)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            self.redis.set("page", codec.encode_entry("new", 60))
+
+        value, stale = codec.decode_entry(self.redis.get("page"))
+        self.assertEqual((value, stale), ("old", True))
+        flight.refresh("page", compute)
+        started.wait(5)
+
+        # the refresh runs in the background: the stale value is still served,
+        # and neither this worker nor another starts a second refresh
+        self.assertEqual(codec.decode_entry(self.redis.get("page")), ("old", True))
+        flight.refresh("page", compute)
+        SingleFlight(self.redis).refresh("page", compute)
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while flight._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(codec.decode_entry(self.redis.get("page")), ("new", False))
+        self.assertEqual(len(calls), 1)
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis()
+
+    async def test_concurrent_callers_share_one_computation(self):
+        flight = AsyncSingleFlight(self.redis)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "page"
+
+        async def lookup():
+            return None
+
+        results = await asyncio.gather(
+            *(flight.do("key", compute, lookup) for _ in range(4))
+        )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["page"] * 4)
+
+    async def test_stale_value_served_while_refreshing(self):
+        codec = ResultCodec()
+        await self.redis.set("page", codec.encode_entry("old", -1))
+        flight = AsyncSingleFlight(self.redis)
+        release = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            await self.redis.set("page", codec.encode_entry("new", 60))
+
+        flight.refresh("page", compute)
+        flight.refresh("page", compute)
+        await asyncio.sleep(0.01)
+        self.assertEqual(
+            codec.decode_entry(await self.redis.get("page")), ("old", True)
+        )
+
+        release.set()
+        await asyncio.gather(*flight._tasks)
+        self.assertEqual(
+            codec.decode_entry(await self.redis.get("page")), ("new", False)
+        )
+        self.assertEqual(len(calls), 1)
+
+    async def test_refresh_leaves_the_request_context(self):
+        request = contextvars.ContextVar("request", default=None)
+        request.set("finished request")
+        seen = []
+
+        async def compute():
+            seen.append(request.get())
+
+        flight = AsyncSingleFlight()
+        flight.refresh("page", compute)
+        await asyncio.gather(*flight._tasks)
+        self.assertEqual(seen, [None])
+
+
+class TestResultCodec(unittest.TestCase):
+    def test_round_trip(self):
+        codec = ResultCodec(train_dictionary(1))
+        page = ([{"id": "1", "title": "graphene"}], 1, -1)
+        self.assertEqual(codec.decode(codec.encode(page)), [list(page[0]), 1, -1])
+
+    def test_version_mismatch(self):
+        codec = ResultCodec()
+        raw = codec.encode({"ids": ["a"]})
+        self.assertIsNone(codec.decode(b"\x02" + raw[1:]))
+        self.assertIsNone(codec.decode(b""))
+        self.assertIsNone(codec.decode(None))
+
+    def test_dictionary_mismatch(self):
+        ours, theirs = (
+            ResultCodec(train_dictionary(1)),
+            ResultCodec(train_dictionary(2)),
+        )
+        self.assertIsNone(ours.decode(theirs.encode({"ids": ["a"]})))
+        # values written without a dictionary are still read
+        self.assertEqual(ours.decode(ResultCodec().encode([1, 2])), [1, 2])
+
+    def test_corrupt_frame(self):
+        codec = ResultCodec()
+        with self.assertLogs("gunicorn.error", "ERROR"):
+            self.assertIsNone(codec.decode(codec.VERSION + b"not zstd"))
+
+    def test_entries(self):
+        codec = ResultCodec()
+        self.assertEqual(codec.decode_entry(codec.encode_entry("v", 60)), ("v", False))
+        self.assertEqual(codec.decode_entry(codec.encode_entry("v", -1)), ("v", True))
+        # values written before entries had a freshness
+        self.assertIsNone(codec.decode_entry(codec.encode("v")))
+
+
+class TestBytesLRUCache(unittest.TestCase):
+    def test_evicts_by_bytes(self):
+        cache = BytesLRUCache(maxbytes=100, ttl=60)
+        for key in "abcd":
+            cache.set(key, b"x" * 25)
+        cache.get("a")  # most recently used now
+        cache.set("e", b"x" * 20)
+
+        self.assertIsNone(cache.get("b"))
+        for key in "acde":
+            self.assertIsNotNone(cache.get(key))
+        self.assertEqual(cache.stats()["bytes"], 95)
+
+    def test_replacing_a_value(self):
+        cache = BytesLRUCache(maxbytes=100, ttl=60)
+        cache.set("a", b"x" * 20)
+        cache.set("a", b"y" * 10)
+        self.assertEqual(cache.get("a"), b"y" * 10)
+        self.assertEqual(cache.stats()["bytes"], 10)
+
+    def test_large_values_skipped(self):
+        cache = BytesLRUCache(maxbytes=100, ttl=60)
+        cache.set("a", b"x" * 26)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_expiry(self):
+        cache = BytesLRUCache(maxbytes=100, ttl=-1)
+        cache.set("a", b"x")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+
+class BrokenRedis:
+    def get(self, key):
+        raise redis.exceptions.ConnectionError("down")
+
+    def setex(self, key, ttl, value):
+        raise redis.exceptions.ConnectionError("down")
+
+
+class AsyncBrokenRedis:
+    async def get(self, key):
+        raise redis.exceptions.ConnectionError("down")
+
+    async def setex(self, key, ttl, value):
+        raise redis.exceptions.ConnectionError("down")
+
+
+class TestIndexSize(unittest.TestCase):
+    def test_shared_through_redis(self):
+        server = fakeredis.FakeServer()
+        counts = []
+        first = IndexSize(
+            "papers", lambda: counts.append(1) or 42, fakeredis.FakeRedis(server=server)
+        )
+        second = IndexSize(
+            "papers", lambda: counts.append(1) or 0, fakeredis.FakeRedis(server=server)
+        )
+        self.assertEqual((first.get(), second.get()), (42, 42))
+        self.assertEqual(len(counts), 1)
+
+    def test_redis_down(self):
+        counts = []
+        size = IndexSize("papers", lambda: counts.append(1) or 42, BrokenRedis())
+        with self.assertLogs("gunicorn.error", "WARNING"):
+            self.assertEqual(size.get(), 42)
+        # kept in the process until the ttl runs out
+        self.assertEqual(size.get(), 42)
+        self.assertEqual(len(counts), 1)
+
+
+class TestAsyncIndexSize(unittest.IsolatedAsyncioTestCase):
+    async def test_redis_down(self):
+        counts = []
+
+        async def count():
+            counts.append(1)
+            return 42
+
+        size = AsyncIndexSize("papers", count, AsyncBrokenRedis())
+        with self.assertLogs("gunicorn.error", "WARNING"):
+            self.assertEqual(await size.get(), 42)
+        self.assertEqual(await size.get(), 42)
+        self.assertEqual(len(counts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
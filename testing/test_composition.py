@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the formula parsing behind composition searches
+(backend/server/composition.py). No server needed:
+
+  python test_composition.py
+"""
+
+import os
+import sys
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from composition import (
+    FORMULA_FIELD,
+    canonical_formula,
+    composition_clause,
+    parse_element_list,
+    parse_formula,
+)
+
+
+class TestParseFormula(unittest.TestCase):
+    def test_groups(self):
+        self.assertEqual(
+            parse_formula("Li2(FePO4)2"),
+            {"Li": 2, "Fe": 2, "P": 2, "O": 8},
+        )
+        self.assertEqual(parse_formula("Ca[OH]2"), {"Ca": 1, "O": 2, "H": 2})
+
+    def test_fractions(self):
+        self.assertEqual(
+            parse_formula("Li0.5CoO2"),
+            {"Li": Fraction(1, 2), "Co": 1, "O": 2},
+        )
+
+    def test_invalid(self):
+        for formula in ["", "Xx2", "fe2O3", "Fe2O3)", "(Fe2O3", "Fe2 O3!", "Fe0"]:
+            with self.subTest(formula=formula):
+                self.assertIsNone(parse_formula(formula))
+
+
+class TestCanonicalFormula(unittest.TestCase):
+    def test_reduced_and_alphabetized(self):
+        self.assertEqual(canonical_formula("SrTiO3"), "O3SrTi")
+        self.assertEqual(canonical_formula("Fe4O6"), "Fe2O3")
+        self.assertEqual(canonical_formula("Li0.5CoO2"), "Co2LiO4")
+        self.assertEqual(canonical_formula("H2O"), "H2O")
+
+    def test_special_formulas(self):
+        # pymatgen writes these as molecules, and so does the index
+        cases = {
+            "O2": "O2",
+            "O": "O2",
+            "O4": "O2",
+            "N2": "N2",
+            "H2": "H2",
+            "Cl2": "Cl2",
+            "H2O2": "H2O2",
+            "HO": "H2O2",
+            "Li2O2": "Li2O2",
+            "Na2O2": "Na2O2",
+            "Rb2O2": "O2Rb2",
+        }
+        for formula, expected in cases.items():
+            with self.subTest(formula=formula):
+                self.assertEqual(canonical_formula(formula), expected)
+
+    def test_not_special(self):
+        # only exact reductions are special
+        self.assertEqual(canonical_formula("LiO2"), "LiO2")
+        self.assertEqual(canonical_formula("Fe"), "Fe")
+
+    def test_invalid(self):
+        self.assertIsNone(canonical_formula("graphene"))
+
+
+class TestCompositionClause(unittest.TestCase):
+    def test_element_list(self):
+        self.assertEqual(parse_element_list("O, Fe-O"), ["Fe", "O"])
+        self.assertIsNone(parse_element_list("Fe Xx"))
+
+    def test_formula(self):
+        self.assertEqual(composition_clause("O2"), {"term": {FORMULA_FIELD: "O2"}})
+
+    def test_neither(self):
+        self.assertIsNone(composition_clause("perovskite"))
+
+
+if __name__ == "__main__":
+    unittest.main()
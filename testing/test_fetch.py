@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Tests for the model package downloader (backend/models/lbnlp/models/fetch.py)
+against a local HTTP server serving a fixture package. No network needed:
+
+  python test_fetch.py
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "models"))
+
+from lbnlp.models.fetch import ModelPkgLoader, _extract_member, _PrefixHash
+
+# one of the names ModelPkgLoader.structure knows how to unpack
+PKG_NAME = "relevance_2020v1"
+
+
+def fixture_package():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipped:
+        zipped.writestr("relevance/model.json", json.dumps({"fixture": True}))
+        # incompressible, so the package spans several segments
+        zipped.writestr("relevance/weights.bin", os.urandom(300_000))
+    return buffer.getvalue()
+
+
+class PackageHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.package at /signed/pkg.zip, like a presigned S3 URL, and
+    redirects /download/pkg.zip there, like figshare.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, None))
+        if self.redirect():
+            return
+        if not self.server.allow_head:
+            # presigned URLs are only signed for GET
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.package)))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        self.server.requests.append(("GET", self.path, range_header))
+        if self.redirect():
+            return
+        package = self.server.package
+        if range_header and self.server.ranges:
+            start, _, end = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(start), min(int(end), len(package) - 1)
+            body = package[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(package)}")
+        else:
+            body = package
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self):
+        if self.path != "/download/pkg.zip":
+            return False
+        self.send_response(302)
+        self.send_header("Location", "/signed/pkg.zip")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+
+class TestModelPkgLoader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.package = fixture_package()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PackageHandler)
+        cls.server.package = cls.package
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/download/pkg.zip"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.allow_head = True
+        self.server.ranges = True
+        self.server.requests = []
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def loader(self, sha256=None):
+        metadata_path = os.path.join(self.data_dir, "modelpkg_metadata.json")
+        with open(metadata_path, "w") as f:
+            json.dump(
+                {
+                    PKG_NAME: {
+                        "url": self.url,
+                        "hash": sha256 or hashlib.sha256(self.package).hexdigest(),
+                        "models": {"relevance": {}},
+                    }
+                },
+                f,
+            )
+        return ModelPkgLoader(
+            PKG_NAME, data_dir=self.data_dir, metadata_path=metadata_path
+        )
+
+    def ranged_gets(self):
+        return [
+            rng
+            for method, path, rng in self.server.requests
+            if method == "GET" and path == "/signed/pkg.zip" and rng
+        ]
+
+    def assert_loaded(self, loader):
+        with open(loader.file_path, "rb") as f:
+            self.assertEqual(f.read(), self.package)
+        self.assertFalse(os.path.exists(loader.part_path))
+        self.assertFalse(os.path.exists(loader.state_path))
+        model = os.path.join(loader.structured_path, "relevance", "model.json")
+        with open(model) as f:
+            self.assertEqual(json.load(f), {"fixture": True})
+
+    def test_ranged(self):
+        loader = self.loader()
+        loader.download(connections=4, chunk_size=4096)
+        self.assertEqual(loader.sha256, hashlib.sha256(self.package).hexdigest())
+        loader.validate()
+        loader.structure()
+        self.assert_loaded(loader)
+        self.assertGreater(len(self.ranged_gets()), 1)
+
+    def test_head_refused(self):
+        # the ranged GET probe stands in for HEAD
+        self.server.allow_head = False
+        loader = self.loader()
+        loader.load()
+        self.assert_loaded(loader)
+        self.assertIn("bytes=0-0", self.ranged_gets())
+        self.assertGreater(len(self.ranged_gets()), 2)
+
+    def test_no_ranges(self):
+        self.server.allow_head = False
+        self.server.ranges = False
+        loader = self.loader()
+        loader.load()
+        self.assert_loaded(loader)
+        whole = [
+            request
+            for request in self.server.requests
+            if request == ("GET", "/signed/pkg.zip", None)
+        ]
+        self.assertEqual(len(whole), 1)
+
+    def test_resume(self):
+        loader = self.loader()
+        loader.download(connections=4, chunk_size=4096)
+        # pretend the last segment was cut off halfway
+        os.replace(loader.file_path, loader.part_path)
+        segments = loader._load_segments(self.url, len(self.package), 4)
+        for segment in segments[:-1]:
+            segment["written"] = segment["end"] - segment["start"]
+        last = segments[-1]
+        last["written"] = (last["end"] - last["start"]) // 2
+        with open(loader.part_path, "r+b") as f:
+            f.seek(last["start"] + last["written"])
+            f.write(b"\0" * (last["end"] - last["start"] - last["written"]))
+        loader._save_segments(self.url, len(self.package), segments)
+        self.server.requests = []
+
+        loader.download(connections=4, chunk_size=4096)
+        loader.validate()
+        loader.structure()
+        self.assert_loaded(loader)
+        resumed = last["start"] + last["written"]
+        self.assertEqual(self.ranged_gets(), [f"bytes={resumed}-{last['end'] - 1}"])
+
+    def test_hash_mismatch(self):
+        loader = self.loader(sha256="0" * 64)
+        with self.assertRaises(ValueError):
+            loader.load()
+        self.assertFalse(os.path.exists(loader.file_path))
+        self.assertFalse(os.path.exists(loader.structured_path))
+
+
+class TestPrefixHash(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.data = os.urandom(40)
+        self.segments = [
+            {"start": 0, "end": 20, "written": 0},
+            {"start": 20, "end": 40, "written": 0},
+        ]
+
+    def write(self, prefix_hash, position, size):
+        with open(self.path, "r+b") as f:
+            f.seek(position)
+            f.write(self.data[position : position + size])
+        segment = self.segments[position // 20]
+        segment["written"] += size
+        prefix_hash.update(position, self.data[position : position + size])
+
+    def test_hashed_while_written(self):
+        with open(self.path, "wb") as f:
+            f.truncate(40)
+        prefix_hash = _PrefixHash(self.path, self.segments)
+        self.write(prefix_hash, 0, 10)
+        self.write(prefix_hash, 20, 10)  # ahead of the prefix, read back later
+        self.write(prefix_hash, 10, 10)
+        self.write(prefix_hash, 30, 10)
+        self.assertEqual(prefix_hash.hexdigest(), hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(prefix_hash.read_back, 10)
+
+    def test_resumed(self):
+        # the first segment was written by an earlier run
+        with open(self.path, "wb") as f:
+            f.write(self.data[:20] + bytes(20))
+        self.segments[0]["written"] = 20
+        prefix_hash = _PrefixHash(self.path, self.segments)
+        self.write(prefix_hash, 20, 20)
+        self.assertEqual(prefix_hash.hexdigest(), hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(prefix_hash.read_back, 20)
+
+
+class TestExtractMember(unittest.TestCase):
+    def test_outside_the_package(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zipped:
+            zipped.writestr("../escaped.txt", "x")
+        dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dest)
+        with zipfile.ZipFile(buffer) as zipped, self.assertRaises(ValueError):
+            _extract_member(zipped, zipped.infolist()[0], dest)
+        self.assertFalse(os.path.exists(os.path.join(dest, "..", "escaped.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
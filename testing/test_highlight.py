@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the python-side highlighter (backend/server/highlight.py). No
+server needed:
+
+  python test_highlight.py
+"""
+
+import copy
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from highlight import (
+    FIELDS_TO_HIGHLIGHT,
+    apply_highlight_markup,
+    find_matches,
+    highlight_offsets,
+    mark,
+)
+
+
+def matched(text, terms):
+    return [text[start:end] for start, end in find_matches(text, terms)]
+
+
+class TestFindMatches(unittest.TestCase):
+    def test_multi_word_terms(self):
+        text = "Sputtered thin-film electrodes and a thin film"
+        self.assertEqual(matched(text, ["thin film"]), ["thin-film", "thin film"])
+
+    def test_whole_words_only(self):
+        # a term inside a longer word marks the whole word when close enough
+        self.assertEqual(matched("LiFePO4 cathodes", ["FePO4"]), ["LiFePO4"])
+        self.assertEqual(matched("NaFePO4F cathodes", ["FePO4"]), [])
+        # and is never matched across word boundaries
+        self.assertEqual(matched("Li Fe PO4", ["FePO4"]), [])
+
+    def test_fuzzy(self):
+        text = "graphene and grapheme"
+        self.assertEqual(matched(text, ["graphene"]), ["graphene", "grapheme"])
+        self.assertEqual(find_matches(text, ["graphene"], 100), [(0, 8)])
+
+    def test_overlaps_keep_the_best_match(self):
+        # equal scores: the leftmost match wins, and the later one overlapping
+        # it on the left is dropped
+        text = "thin film deposition of films"
+        self.assertEqual(
+            matched(text, ["film deposition", "thin film", "film"]),
+            ["thin film", "films"],
+        )
+        # a worse match overlapping a better one on its right is dropped too
+        text = "graphene oxide"
+        self.assertEqual(matched(text, ["graphine oxide", "oxide"]), ["oxide"])
+        # matches next to each other are both kept
+        self.assertEqual(
+            find_matches("graphene oxide", ["graphene", "oxide"]), [(0, 8), (9, 14)]
+        )
+
+    def test_nothing_to_match(self):
+        self.assertEqual(find_matches("graphene", []), [])
+        self.assertEqual(find_matches("", ["graphene"]), [])
+        self.assertEqual(find_matches(None, ["graphene"]), [])
+        self.assertEqual(find_matches("a b", ["thin film deposition"]), [])
+
+
+SOURCE = {
+    "title": "Thin-film LiFePO4 cathodes",
+    "summary": "We grow thin film LiFePO4 by sputtering; the films are dense.",
+    "authors": ["A. Film", "B. Smith"],
+    "MAT": ["LiFePO4", "FePO4", 3],
+    "date": 20240101,
+}
+TERMS = {
+    "title": ["thin film", "FePO4"],
+    "summary": ["thin film", "FePO4", "sputter"],
+    "authors": ["film"],
+    "MAT": ["FePO4"],
+}
+
+
+class TestOffsets(unittest.TestCase):
+    def test_offsets_agree_with_markup(self):
+        source = copy.deepcopy(SOURCE)
+        offsets = highlight_offsets(source, TERMS, FIELDS_TO_HIGHLIGHT)
+        self.assertEqual(source, SOURCE)
+
+        marked = apply_highlight_markup(
+            copy.deepcopy(SOURCE), TERMS, FIELDS_TO_HIGHLIGHT
+        )
+        for field in FIELDS_TO_HIGHLIGHT:
+            value = SOURCE.get(field)
+            if isinstance(value, str):
+                expected = mark(value, offsets.get(field, []))
+            elif isinstance(value, list):
+                expected = [
+                    mark(item, item_offsets) if isinstance(item, str) else item
+                    for item, item_offsets in zip(
+                        value, offsets.get(field, [[]] * len(value))
+                    )
+                ]
+            else:
+                continue
+            self.assertEqual(marked[field], expected, field)
+
+        self.assertEqual(
+            marked["title"], "<mark>Thin-film</mark> <mark>LiFePO4</mark> cathodes"
+        )
+        self.assertEqual(
+            marked["MAT"], ["<mark>LiFePO4</mark>", "<mark>FePO4</mark>", 3]
+        )
+        self.assertEqual(offsets["authors"], [[[3, 7]], []])
+
+    def test_fields_without_matches_left_out(self):
+        offsets = highlight_offsets(
+            SOURCE,
+            {"title": ["perovskite"], "date": ["2024"]},
+            FIELDS_TO_HIGHLIGHT,
+        )
+        self.assertEqual(offsets, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
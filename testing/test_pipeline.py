@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the search pipeline shared by the sync and async servers
+(backend/server/pipeline.py). No server or cluster needed:
+
+  python test_pipeline.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from pipeline import (
+    MAX_RESULT_WINDOW,
+    DateSegment,
+    advance_pit,
+    batch_ids,
+    date_segments,
+    join_segments,
+    page_ids,
+    pit_body,
+    plan_search,
+    regular_window,
+    regular_window_body,
+    vector_window,
+    window_hit,
+)
+
+
+def search(term, field="Abstract", is_vector=False):
+    return {"term": term, "field": field, "operator": "AND", "isVector": is_vector}
+
+
+def response(ids, total=None, start=0):
+    hits = [{"_id": pid, "sort": [start + i, pid]} for i, pid in enumerate(ids)]
+    body = {"hits": {"hits": hits}}
+    if total is not None:
+        body["hits"]["total"] = {"value": total, "relation": "eq"}
+    return body
+
+
+class TestPlanSearch(unittest.TestCase):
+    def test_kinds(self):
+        plan = plan_search([search("graphene")], 0, 99991231, "Most-Recent", "desc")
+        self.assertEqual(plan.kind, "date")
+
+        plan = plan_search([search("graphene")], 0, 99991231, "Most-Relevant", "desc")
+        self.assertEqual(plan.kind, "regular")
+
+        plan = plan_search(
+            [search("graphene", is_vector=True)], 0, 99991231, "Most-Relevant", "desc"
+        )
+        self.assertEqual(plan.kind, "vector")
+        self.assertEqual(plan.vector_field, "summary_embedding")
+        # the vector term is only matched for the total and highlighting
+        self.assertEqual(plan.quer["bool"]["must"], [])
+        self.assertEqual(len(plan.highlight_quer["bool"]["must"]), 1)
+
+    def test_invalid(self):
+        self.assertIsNone(
+            plan_search([search("x", field="nope")], 0, 1, "Most-Recent", "desc")
+        )
+
+
+class TestWindows(unittest.TestCase):
+    def test_window_hit(self):
+        window = {"ids": ["a"] * 200, "complete": False}
+        self.assertTrue(window_hit(window, 100, 200))
+        self.assertFalse(window_hit(window, 300, 400))
+        self.assertTrue(window_hit({"ids": ["a"], "complete": True}, 300, 400))
+        self.assertFalse(window_hit(None, 10, 200))
+
+    def test_regular_window_extends(self):
+        window = {"ids": ["a", "b"], "total": 5, "inflated": -1, "complete": False}
+        body = regular_window_body({"match_all": {}}, window, 4)
+        self.assertEqual((body["from"], body["size"]), (2, 2))
+
+        grown = regular_window(window, response(["c"], total=3), 4)
+        self.assertEqual(grown["ids"], ["a", "b", "c"])
+        self.assertTrue(grown["complete"])
+
+    def test_vector_window_inflated(self):
+        window = vector_window(
+            response(["a", "b"]), response([], total=7), index_size=1000, target=200
+        )
+        self.assertEqual((window["total"], window["inflated"]), (100, 7))
+        self.assertTrue(window["complete"])
+
+    def test_date_segment_after_cached_one(self):
+        previous = {
+            "ids": ["a", "b"],
+            "total": 5,
+            "inflated": -1,
+            "complete": False,
+            "search_after": [1, "b"],
+        }
+        reader = DateSegment(1, 2, {"match_all": {}}, "desc", previous)
+        body = reader.next_body()
+        self.assertEqual(body["search_after"], [1, "b"])
+        self.assertEqual(body["size"], 2)
+        self.assertNotIn("from", body)
+        # the total comes from the previous segment
+        self.assertFalse(body["track_total_hits"])
+
+        reader.add(response(["c", "d"], start=2))
+        self.assertTrue(reader.done)
+        self.assertEqual(
+            reader.window(),
+            {
+                "ids": ["c", "d"],
+                "total": 5,
+                "inflated": -1,
+                "complete": False,
+                "search_after": [3, "d"],
+            },
+        )
+
+    def test_date_segment_after_last_one(self):
+        previous = {"ids": ["a"], "total": 1, "complete": True, "search_after": None}
+        reader = DateSegment(1, 2, {"match_all": {}}, "desc", previous)
+        self.assertTrue(reader.done)
+        self.assertEqual(reader.window()["ids"], [])
+
+    def test_date_segment_from(self):
+        reader = DateSegment(3, 200, {"match_all": {}}, "asc", None)
+        body = reader.next_body()
+        self.assertEqual((body["from"], body["size"]), (600, 200))
+        self.assertNotIn("search_after", body)
+        self.assertNotIn("track_total_hits", body)
+
+        reader.add(response(["a"], total=601, start=600))
+        self.assertTrue(reader.done)
+        window = reader.window()
+        self.assertEqual((window["ids"], window["total"]), (["a"], 601))
+        self.assertTrue(window["complete"])
+
+    def test_date_segment_walks_deep(self):
+        segment = (2 * MAX_RESULT_WINDOW + 400) // 200
+        reader = DateSegment(segment, 200, {"match_all": {}}, "desc", None)
+
+        sizes = []
+        position = 0
+        while not reader.done:
+            body = reader.next_body()
+            sizes.append(body["size"])
+            self.assertNotIn("from", body)
+            ids = [str(position + i) for i in range(body["size"])]
+            total = 30000 if position == 0 else None
+            reader.add(response(ids, total=total, start=position))
+            position += body["size"]
+
+        self.assertEqual(sizes, [MAX_RESULT_WINDOW, MAX_RESULT_WINDOW, 400, 200])
+        window = reader.window()
+        self.assertEqual(window["ids"][0], str(2 * MAX_RESULT_WINDOW + 400))
+        self.assertEqual(window["total"], 30000)
+        self.assertEqual(window["search_after"][0], 2 * MAX_RESULT_WINDOW + 599)
+
+    def test_date_segment_past_the_end(self):
+        reader = DateSegment(60, 200, {"match_all": {}}, "desc", None)
+        reader.next_body()
+        reader.add(response(["a"], total=1))
+        self.assertTrue(reader.done)
+        self.assertEqual(reader.window()["ids"], [])
+
+    def test_date_segments(self):
+        self.assertEqual(list(date_segments(1, 10, 200)), [0])
+        self.assertEqual(list(date_segments(3, 100, 200)), [1])
+        self.assertEqual(list(date_segments(2, 100, 150)), [0, 1])
+
+        segments = [{"ids": ["a", "b"], "total": 9}, {"ids": ["c", "d"], "total": 9}]
+        window = join_segments(segments, 3, 2)
+        self.assertEqual(page_ids(window, 4, 2), ["a", "b"])
+        self.assertEqual(page_ids(window, 9, 1), ["c"])
+        self.assertEqual(window["total"], 9)
+
+    def test_page_ids(self):
+        window = {"ids": [str(i) for i in range(25)]}
+        self.assertEqual(page_ids(window, 3, 10), ["20", "21", "22", "23", "24"])
+        self.assertEqual(page_ids(window, 4, 10), [])
+
+
+class TestExport(unittest.TestCase):
+    def test_pit_cursor(self):
+        plan = plan_search([search("graphene")], 0, 99991231, "Oldest-First", "asc")
+        cursor = {"pit_id": "p1", "search_after": None}
+        self.assertNotIn("search_after", pit_body(plan, cursor))
+
+        hits = advance_pit(cursor, {"pit_id": "p2", **response(["a", "b"])})
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(cursor, {"pit_id": "p2", "search_after": [1, "b"]})
+        self.assertEqual(pit_body(plan, cursor)["search_after"], [1, "b"])
+
+
+class TestBatchIds(unittest.TestCase):
+    def test_batch_ids(self):
+        self.assertEqual(batch_ids({"ids": ["b", "a", "b"]}), ["b", "a"])
+        self.assertIsNone(batch_ids({"ids": "a"}))
+        self.assertIsNone(batch_ids({"ids": ["a"] * 201}))
+        self.assertIsNone(batch_ids(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the query building and cache keys of /api/papers
+(backend/server/search.py). No server needed:
+
+  python test_search.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "server"))
+
+from search import handle_bool_searching, make_page_key, make_window_key
+
+
+def search(term, field="abstract", operator="AND", is_vector=False):
+    return {"term": term, "field": field, "operator": operator, "isVector": is_vector}
+
+
+def build(searches, sorting="Most-Relevant"):
+    return handle_bool_searching(searches, 0, 99991231, sorting)
+
+
+def page_key(searches, sorting="Most-Relevant"):
+    return make_page_key("papers", 1, searches, sorting, 1, 10, 0, 99991231, "markup")
+
+
+def window_key(searches, sorting="Most-Relevant"):
+    return make_window_key("papers", 1, searches, sorting, 0, 99991231)
+
+
+class TestClauseOrder(unittest.TestCase):
+    def assertSameQuery(self, first, second):
+        self.assertEqual(build(first), build(second))
+        self.assertEqual(page_key(first), page_key(second))
+        self.assertEqual(window_key(first), window_key(second))
+
+    def assertDifferentQuery(self, first, second):
+        self.assertNotEqual(build(first), build(second))
+        self.assertNotEqual(page_key(first), page_key(second))
+        self.assertNotEqual(window_key(first), window_key(second))
+
+    def test_text_clauses(self):
+        first = [
+            search("graphene"),
+            search("CVD", field="Synthesis", operator="OR"),
+            search("oxide", field="Title", operator="NOT"),
+        ]
+        self.assertSameQuery(first, first[::-1])
+
+    def test_all_wins_wherever_it_is(self):
+        vector = search("battery", is_vector=True)
+        first, second = [vector, search("all")], [search("all"), vector]
+        self.assertSameQuery(first, second)
+
+        all_query, _, vector_field, _ = build(first)
+        self.assertTrue(all_query)
+        self.assertIsNone(vector_field)
+
+    def test_invalid_wherever_it_is(self):
+        first = [search("x", field="bad"), search("all")]
+        second = [search("all"), search("x", field="bad")]
+        self.assertSameQuery(first, second)
+        self.assertEqual(build(first), (None, None, None, None))
+
+        first = [search("Fe2O3)", field="composition"), search("all")]
+        self.assertEqual(build(first), (None, None, None, None))
+        self.assertEqual(build(first[::-1]), (None, None, None, None))
+
+    def test_last_vector_clause_wins(self):
+        first = [
+            search("battery", is_vector=True),
+            search("catalyst", field="title", is_vector=True),
+        ]
+        self.assertDifferentQuery(first, first[::-1])
+        self.assertEqual(build(first)[2:], ("title_embedding", "catalyst"))
+        self.assertEqual(build(first[::-1])[2:], ("summary_embedding", "battery"))
+
+    def test_searches_left_untouched(self):
+        searches = [search("graphene")]
+        build(searches)
+        self.assertEqual(searches, [search("graphene")])
+
+
+if __name__ == "__main__":
+    unittest.main()